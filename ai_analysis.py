@@ -1,25 +1,16 @@
 
 # ai_analysis.py
-import google.generativeai as genai
-import json
 from PIL import Image
 import io
+import json
 import streamlit as st
+import schema
+import backends
+import roi
+import pdf_tools
+import time
 
-def analyze_drawing(image_file, api_key):
-    """
-    Analyzes the uploaded drawing using Gemini 1.5 Pro.
-    Returns a list of dictionaries representing the components.
-    """
-    if not api_key:
-        st.error("API Key is missing.")
-        return []
-
-    try:
-        genai.configure(api_key=api_key.strip())
-        model = genai.GenerativeModel('gemini-flash-latest')
-
-        prompt = """
+ANALYSIS_PROMPT = """
         You are an expert steel structure estimator. Analyze this technical drawing (which may include multiple pages) with EXTREME SPEED.
         
         SPEED & EFFICIENCY RULES (CRITICAL):
@@ -53,6 +44,7 @@ def analyze_drawing(image_file, api_key):
                 {
                     "pattern_name": "Pole Type A (Main)",  // Use the drawing's identifier (e.g. Type A, Mk-1)
                     "validation_alerts": [ "Base Plate thickness is missing", "Check Rib dimensions" ],  // List of specific warnings. Empty if perfect.
+                    "source_pages": [1, 2],  // 1-based pages (sheets) this pattern was read from
                     "components": [
                         {
                             "type": "Pipe" or "Plate",
@@ -82,61 +74,355 @@ def analyze_drawing(image_file, api_key):
         - **Validation:** If you assign 0 or "CHECK", you MUST add a corresponding note in `validation_alerts`.
         """
 
-        input_data = []
-        input_data.append(prompt)
+REFINE_PROMPT = """
+        You are an expert steel structure estimator doing a CAREFUL SECOND PASS on this technical drawing.
+        A fast first pass produced the patterns below, but some values are 0, "CHECK" or flagged in `validation_alerts`.
 
-        # 1. Handle PIL Image (Already processed in app.py)
-        if isinstance(image_file, Image.Image):
-            input_data.append(image_file)
-        
-        # 2. Handle PDF file (Streamlit UploadedFile)
-        elif hasattr(image_file, "type") and image_file.type == "application/pdf":
-            image_file.seek(0)
-            pdf_bytes = image_file.read()
-            input_data.append({
-                "mime_type": "application/pdf",
-                "data": pdf_bytes
-            })
-            
-        # 3. Fallback: Try to open as image if it's a file-like object
-        elif hasattr(image_file, 'read'):
-             image_file.seek(0)
-             try:
-                img = Image.open(image_file)
-                input_data.append(img)
-             except Exception:
-                st.error("Unsupported file format. Please upload PNG, JPG, or PDF.")
-                return []
-        else:
-             st.error("Invalid file input.")
-             return []
-
-        response = model.generate_content(input_data)
-        text = response.text.strip()
-        
-        # Cleanup potential markdown formatting
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-            
-        data = json.loads(text)
-        
-        # Validate structure: if it returns a list directly (old prompt style), wrap it
-        if isinstance(data, list):
-            return [{"pattern_name": "Detected Pattern", "components": data}]
-        
-        return data.get("patterns", [])
+        YOUR MISSION:
+        - Re-read the drawing carefully and fill in ONLY the uncertain values listed in `uncertain_fields`.
+        - Accuracy matters more than speed. Zoom in on the bill of materials, title block and detail views.
+        - You receive only the sheets these patterns were read from.
+        - Keep `pattern_name`, component `type` and `name` EXACTLY as given so results can be merged.
+        - If a value is still truly illegible, keep 0 / "CHECK" and keep a note in `validation_alerts`.
+        - You MAY add components the first pass missed.
 
-    except Exception as e:
-        st.error(f"An error occurred during AI analysis: {str(e)}")
+        FIRST PASS (patterns to re-check):
+        {patterns_json}
+
+        RETURN FORMAT:
+        Return ONLY a strict JSON object {{"patterns": [...]}} with the same structure as above.
+        """
+
+ROI_NOTE = """
+        NOTE: Instead of whole sheets you receive CROPPED REGIONS (bill-of-materials tables, title block, detail views).
+        Each crop is preceded by a label like "[Region 2] table on page 1, bbox px=(x0,y0)-(x1,y1)".
+        For EVERY component add an integer field "region" with the id of the region it was read from.
+        """
+
+class AnalysisError(Exception):
+    """A drawing could not be analyzed (raised instead of st.error for worker threads and the API)."""
+
+def _report(message: str, raise_errors: bool):
+    if raise_errors:
+        raise AnalysisError(message)
+    st.error(message)
+
+def _drawing_parts(image_file, raise_errors=False):
+    """
+    Converts the uploaded drawing into Gemini input parts.
+    Returns a list of parts, or None if the input is not supported.
+    """
+    # 1. Handle PIL Image (Already processed in app.py)
+    if isinstance(image_file, Image.Image):
+        return [image_file]
+
+    # 2. Handle PDF file (Streamlit UploadedFile)
+    if hasattr(image_file, "type") and image_file.type == "application/pdf":
+        image_file.seek(0)
+        pdf_bytes = image_file.read()
+        return [{
+            "mime_type": "application/pdf",
+            "data": pdf_bytes
+        }]
+
+    # 3. Fallback: Try to open as image if it's a file-like object
+    if hasattr(image_file, 'read'):
+        image_file.seek(0)
+        try:
+            return [Image.open(image_file)]
+        except Exception:
+            _report("Unsupported file format. Please upload PNG, JPG, or PDF.", raise_errors)
+            return None
+
+    _report("Invalid file input.", raise_errors)
+    return None
+
+def _crop_parts(parts):
+    """
+    Replaces each sheet image with its detected table/detail crops (see roi.py),
+    each preceded by a text label carrying its page coordinates.
+    Returns (parts, regions, part_pages) with the 1-based page of every part.
+    Images without usable regions are sent whole.
+    """
+    cropped = []
+    regions = []
+    part_pages = []
+    for page, part in enumerate(parts, start=1):
+        found = roi.find_regions(part, page=page) if isinstance(part, Image.Image) else []
+        if not found:
+            cropped.append(part)
+            part_pages.append(page)
+            continue
+        for region, crop in roi.crop_regions(part, found):
+            region["id"] = len(regions) + 1
+            regions.append(region)
+            cropped.extend([roi.region_label(region), crop])
+            part_pages.extend([page, page])
+    return cropped, regions, part_pages
+
+def _attach_regions(patterns, regions):
+    """Maps each component's "region" id back to page coordinates."""
+    by_id = {r["id"]: r for r in regions}
+    for pattern in patterns:
+        pattern["source_regions"] = regions
+        for comp in pattern.get("components", []):
+            region = by_id.get(int(schema.to_float(comp.get("region"))))
+            if region:
+                comp["source_page"] = region["page"]
+                comp["source_bbox"] = list(region["bbox"])
+    return patterns
+
+def analyze_text_layer(pdf_bytes: bytes):
+    """
+    Reads dimensions straight from a vector PDF's text layer (see pdf_tools.py).
+    Returns (patterns, pages_needing_model). patterns is None if there is no usable text layer.
+    """
+    start = time.perf_counter()
+    local = pdf_tools.extract_patterns(pdf_bytes)
+    if not local or not local["patterns"]:
+        return None, None
+    todo = [p["page"] for p in local["pages"] if not p["confident"]]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.info(f"📐 Text layer: {len(local['pages']) - len(todo)}/{len(local['pages'])} pages extracted locally ({elapsed_ms:.0f} ms).")
+    return local["patterns"], todo
+
+def _remap_pages(patterns: list, page_map: list) -> list:
+    """Translates 1-based page numbers of a subset PDF back to the original document."""
+    def original(n):
+        n = int(schema.to_float(n))
+        return page_map[n - 1] if 0 < n <= len(page_map) else None
+
+    for pattern in patterns:
+        if pattern.get("source_pages"):
+            pattern["source_pages"] = [o for o in (original(n) for n in pattern["source_pages"]) if o]
+        for comp in pattern.get("components", []):
+            if comp.get("source_page"):
+                comp["source_page"] = original(comp["source_page"])
+    return patterns
+
+def analyze_drawing(image_file, api_key, backend=None, tiered=False, crop_regions=False, text_first=True, pages=None,
+                    raise_errors=False):
+    """
+    Analyzes the uploaded drawing using Gemini 1.5 Pro.
+    Returns a list of dictionaries representing the components.
+    backend: optional object with generate(input_data, model_name) -> str
+             (see backends.py). Defaults to the live Gemini backend.
+    tiered: run the fast model first, then re-analyze only the uncertain
+            patterns with the accurate model and merge the results.
+    crop_regions: send only the detected BOM tables / title block / detail
+                  views instead of whole sheets (images only).
+    text_first: for PDFs, parse the text layer locally first and only send
+                scanned / low-confidence pages to the model.
+    pages: for PDFs, analyze only these 1-based pages (incremental revisions).
+           Page numbers in the result always refer to the original document.
+    raise_errors: raise AnalysisError instead of showing st.error and returning
+                  what was read locally (background threads, HTTP API).
+    """
+    parts = _drawing_parts(image_file, raise_errors)
+    if parts is None:
         return []
 
+    is_pdf = isinstance(parts[0], dict) and parts[0].get("mime_type") == "application/pdf"
+    if is_pdf and pages:
+        parts = [{"mime_type": "application/pdf", "data": pdf_tools.subset_pdf(parts[0]["data"], pages)}]
+        return _remap_pages(_analyze_parts(parts, is_pdf, api_key, backend, tiered, crop_regions, text_first,
+                                            raise_errors), pages)
+    return _analyze_parts(parts, is_pdf, api_key, backend, tiered, crop_regions, text_first, raise_errors)
+
+def _analyze_parts(parts, is_pdf, api_key, backend, tiered, crop_regions, text_first, raise_errors=False):
+    local_patterns = None
+    todo = None
+    try:
+        # Vector PDF: skip the model for every page the text layer covers
+        if text_first and is_pdf:
+            pdf_bytes = parts[0]["data"]
+            local_patterns, todo = analyze_text_layer(pdf_bytes)
+            if local_patterns is not None:
+                if not todo:
+                    return local_patterns
+                parts = [{"mime_type": "application/pdf", "data": pdf_tools.subset_pdf(pdf_bytes, todo)}]
+
+        if backend is None:
+            if not api_key:
+                _report("API Key is missing.", raise_errors)
+                return local_patterns or []
+            backend = backends.GeminiBackend(api_key)
+
+        regions = []
+        part_pages = None if is_pdf else list(range(1, len(parts) + 1))
+        if crop_regions:
+            parts, regions, part_pages = _crop_parts(parts)
+        prompt = ANALYSIS_PROMPT + ROI_NOTE if regions else ANALYSIS_PROMPT
+
+        text = backend.generate([prompt] + parts, backends.MODEL_FAST)
+
+        # Strip fences, validate against the schema and normalize values in one pass
+        patterns = schema.parse_model_output(text)
+        if regions:
+            patterns = _attach_regions(patterns, regions)
+
+    except AnalysisError:
+        raise
+    except Exception as e:
+        _report(f"An error occurred during AI analysis: {str(e)}", raise_errors)
+        return local_patterns or []
+
+    if tiered:
+        patterns = refine_patterns(patterns, parts, backend, part_pages, renumbered=not regions)
+    if local_patterns:
+        patterns = _remap_pages(patterns, todo)
+        patterns = pdf_tools.merge_pattern_lists(local_patterns, patterns)
+    return patterns
+
+def needs_escalation(pattern: dict) -> bool:
+    """A pattern goes to the accurate model if it has alerts or any uncertain (0/"CHECK") value."""
+    if pattern.get("validation_alerts"):
+        return True
+    return any(c.get("_uncertain") for c in pattern.get("components", []))
+
+def _flagged_parts(parts: list, targets: list, part_pages: list = None):
+    """
+    Input parts for the second pass: only the pages the flagged patterns were read from
+    (their source_pages). part_pages is the 1-based page of every part (images and crops);
+    None for a PDF. Returns (parts, pages sent), or (parts, None) if every page is sent.
+    """
+    pages = set()
+    for p in targets:
+        if not p.get("source_pages"):
+            return parts, None      # Unknown pages: send the whole drawing
+        pages.update(int(schema.to_float(n)) for n in p["source_pages"])
+    pages = sorted(n for n in pages if n > 0)
+    if not pages:
+        return parts, None
+    if part_pages is None:
+        if len(parts) != 1 or not isinstance(parts[0], dict):
+            return parts, None
+        try:
+            data = pdf_tools.subset_pdf(parts[0]["data"], pages)
+        except Exception:
+            return parts, None      # pypdf missing or a page number out of range
+        return [{"mime_type": "application/pdf", "data": data}], pages
+    keep = [part for part, page in zip(parts, part_pages) if page in pages]
+    if not keep or len(keep) == len(parts):
+        return parts, None
+    return keep, sorted(set(pages) & set(part_pages))
+
+def refine_patterns(patterns: list, parts: list, backend, part_pages: list = None, renumbered: bool = True) -> list:
+    """
+    Second tier: sends only the uncertain patterns (with their current values) and
+    the pages they were read from to the accurate model, and merges the answers
+    back field by field. On failure the fast-pass result is kept.
+    part_pages: 1-based page of every part (see _flagged_parts).
+    renumbered: page numbers in the answer count the pages sent (whole pages, not
+                labelled crops) and are translated back.
+    """
+    targets = [p for p in patterns if needs_escalation(p)]
+    if not targets:
+        return patterns
+    parts, sent_pages = _flagged_parts(parts, targets, part_pages)
+
+    first_pass = [{
+        "pattern_name": p["pattern_name"],
+        "validation_alerts": p.get("validation_alerts", []),
+        "components": [
+            {**{f: c.get(f) for f in schema.COMPONENT_FIELDS}, "uncertain_fields": schema.uncertain_fields(c)}
+            for c in p.get("components", [])
+        ],
+    } for p in targets]
+    prompt = REFINE_PROMPT.format(patterns_json=json.dumps(first_pass, ensure_ascii=False, indent=1))
+
+    try:
+        text = backend.generate([prompt] + parts, backends.MODEL_ACCURATE)
+        refined = schema.parse_model_output(text)
+    except Exception as e:
+        st.warning(f"Accurate re-analysis failed, keeping fast results: {str(e)}")
+        return patterns
+    if sent_pages and renumbered:
+        refined = _remap_pages(refined, sent_pages)
+
+    st.info(f"🔎 Re-analyzed {len(targets)}/{len(patterns)} uncertain patterns with the accurate model.")
+    return merge_refined(patterns, refined)
+
+def _component_key(c: dict):
+    return (str(c.get("type", "")).strip().lower(), str(c.get("name", "")).strip().lower())
+
+def _merge_fields(comp: dict, ref_comp: dict) -> dict:
+    """Takes each field that is uncertain in comp and certain in ref_comp."""
+    comp = dict(comp)
+    mask = comp.get("_uncertain", 0)
+    ref_mask = ref_comp.get("_uncertain", 0)
+    for field in schema.COMPONENT_FIELDS:
+        bit = schema.FIELD_BITS[field]
+        if mask & bit and not ref_mask & bit:
+            comp[field] = ref_comp[field]
+            mask &= ~bit
+    comp["_uncertain"] = mask
+    return comp
+
+def _same_part(comp: dict, ref_comp: dict) -> bool:
+    """Same type, and every number certain in both passes agrees (a row the model renamed)."""
+    if _component_key(comp)[0] != _component_key(ref_comp)[0]:
+        return False
+    both = ~(comp.get("_uncertain", 0) | ref_comp.get("_uncertain", 0))
+    return all(comp.get(f) == ref_comp.get(f) for f in schema.NUMERIC_FIELDS if both & schema.FIELD_BITS[f])
+
+def merge_refined(patterns: list, refined: list) -> list:
+    """
+    Field-by-field merge: a field is taken from the refined result only if it was
+    uncertain in the first pass and is certain in the second.
+    Refined rows are matched by (type, name), then unmatched ones to unmatched
+    first-pass rows of the same part (renamed by the model; the first-pass name is kept).
+    Only the rest is appended, flagged for review (name uncertain, note).
+    """
+    refined_by_name = {p["pattern_name"].strip().lower(): p for p in refined}
+    merged = []
+    for pattern in patterns:
+        ref = refined_by_name.get(pattern["pattern_name"].strip().lower())
+        if ref is None:
+            merged.append(pattern)
+            continue
+
+        ref_components = {}
+        for c in ref.get("components", []):
+            ref_components.setdefault(_component_key(c), []).append(c)
+
+        components = []
+        unmatched = []      # Positions of first-pass rows without a refined row of the same name
+        for comp in pattern.get("components", []):
+            candidates = ref_components.get(_component_key(comp))
+            if not candidates:
+                unmatched.append(len(components))
+                components.append(comp)
+                continue
+            components.append(_merge_fields(comp, candidates.pop(0)))
+
+        added = []
+        for ref_comp in (c for leftovers in ref_components.values() for c in leftovers):
+            j = next((j for j in unmatched if _same_part(components[j], ref_comp)), None)
+            if j is not None:
+                unmatched.remove(j)
+                components[j] = _merge_fields(components[j], ref_comp)
+                continue
+            # Components only the accurate model found
+            ref_comp = dict(ref_comp)
+            ref_comp["_uncertain"] = ref_comp.get("_uncertain", 0) | schema.FIELD_BITS["name"]
+            ref_comp["notes"] = f"⚠️ Added by second pass (再解析で追加) {ref_comp.get('notes', '')}".strip()
+            added.append(ref_comp)
+        components.extend(added)
+
+        pattern = dict(pattern)
+        pattern["components"] = components
+        still_uncertain = any(c.get("_uncertain") for c in components)
+        pattern["validation_alerts"] = (ref.get("validation_alerts") or pattern.get("validation_alerts", [])) if still_uncertain else []
+        if added:
+            pattern["validation_alerts"] = list(pattern["validation_alerts"]) + [
+                f"{c['name']}: added by the second pass, confirm it is not a duplicate" for c in added]
+        merged.append(pattern)
+    return merged
+
 def get_dummy_data():
     """Returns dummy data for testing UI without API calls."""
-    return [
+    return schema.normalize_patterns([
         {
             "pattern_name": "Sample Pole Type A",
             "components": [
@@ -153,4 +439,4 @@ def get_dummy_data():
                  {"type": "Plate", "name": "Base Plate", "diameter_mm": 0, "thickness_mm": 19.0, "length_mm": 400, "width_mm": 400, "count": 1, "notes": ""}
             ]
         }
-    ]
+    ])
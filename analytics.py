@@ -0,0 +1,269 @@
+# analytics.py
+# Estimate Analytics Store (積算実績データベース)
+# Every saved project is appended to a columnar Parquet store, one row per
+# component, partitioned by year (year=2026/...). Reads go through a
+# memory-mapped Arrow dataset with partition / statistics pruning, so
+# aggregates over years of estimates stay sub-second on one machine.
+# pyarrow is optional: without it the store is disabled (available() is False).
+import os
+import uuid
+import threading
+from datetime import datetime
+import numpy as np
+import logic
+import schema
+import formulas
+
+STORE_DIR = os.environ.get("ESTIMATOR_ANALYTICS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "analytics_store")
+COMPACT_FILES = 32      # Files per year partition before they are merged into one
+ROW_GROUP_ROWS = 64 * 1024
+
+GROUP_KEYS = ("year", "quarter", "month", "customer", "project", "pattern", "section", "kind")
+FILTER_KEYS = ("customer", "project", "pattern", "section", "kind", "estimate_id")
+
+_lock = threading.Lock()   # Appends and compaction of this process
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.fs
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+def available() -> bool:
+    return _arrow() is not None
+
+def _schema(pa):
+    f64, text = pa.float64(), pa.string()
+    return pa.schema([
+        ("estimate_id", text), ("saved_at", pa.timestamp("s")), ("month", text), ("quarter", text),
+        ("project", text), ("customer", text), ("pattern", text), ("quantity", pa.int32()),
+        ("type", text), ("name", text), ("kind", text), ("section", text),
+        ("diameter_mm", f64), ("thickness_mm", f64), ("length_mm", f64), ("width_mm", f64), ("count", f64),
+        ("unit_weight_kg", f64), ("total_weight_kg", f64), ("area_m2", f64),
+        ("quoted_weight_kg", f64), ("quoted_pipe_m", f64), ("material_cost", f64), ("quoted_pipe_kg", f64),
+    ])
+
+def _partitioning(pa):
+    return pa.dataset.partitioning(pa.schema([("year", pa.int16())]), flavor="hive")
+
+def section_key(kind: str, diameter_mm: float, thickness_mm: float) -> str:
+    """Section label: "318.5x6.0" for pipes, "PL12" for plates and ribs."""
+    if kind == "pipe":
+        return f"{diameter_mm:g}x{thickness_mm:.1f}"
+    return f"PL{thickness_mm:g}"
+
+def parse_section(text: str) -> str:
+    """Section typed by a user ("318.5×6", "pl 12") in section_key form; unparsable text is returned stripped."""
+    s = text.strip().lower().replace("×", "x").replace("*", "x").replace(" ", "")
+    try:
+        if s.startswith("pl"):
+            return section_key("plate", 0.0, float(s[2:]))
+        d, t = s.split("x")
+        return section_key("pipe", float(d), float(t))
+    except ValueError:
+        return text.strip()
+
+def _combined(patterns: list):
+    """One table of all (pattern name, table, quantity) with "pattern" / "quantity" columns (None if empty)."""
+    import pandas as pd
+    parts = []
+    for pattern, df, quantity in patterns:
+        if len(df):
+            parts.append(df.assign(pattern=str(pattern), quantity=max(0, int(schema.to_float(quantity)))))
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+def estimate_rows(project: str, customer: str, df, saved_at: datetime) -> dict:
+    """{column: array} of one estimate from its combined calculated (optionally priced) table."""
+    rows = len(df)
+    kind = np.where(logic.pipe_mask(df), "pipe", np.where(logic.rib_mask(df), "rib", "plate")).astype(object)
+    out = {"pattern": df["pattern"].to_numpy(dtype=object), "quantity": df["quantity"].to_numpy(dtype=np.int32), "kind": kind}
+    for c in ("type", "name"):
+        out[c] = df[c].fillna("").astype(str).to_numpy(dtype=object) if c in df else np.full(rows, "", dtype=object)
+    for c in ("diameter_mm", "thickness_mm", "length_mm", "width_mm"):
+        out[c] = logic.column_values(df, c)
+    out["count"] = logic.column_values(df, "count", default=1.0)
+    out["unit_weight_kg"] = logic.column_values(df, "Unit Weight (kg)")
+    out["total_weight_kg"] = logic.column_values(df, "Total Weight (kg)")
+    out["area_m2"] = logic.column_values(df, "Surface Area (m²)")
+    out["section"] = np.array([section_key(k, d, t) for k, d, t in
+                               zip(kind.tolist(), out["diameter_mm"].tolist(), out["thickness_mm"].tolist())], dtype=object)
+    quantity = out["quantity"].astype(np.float64)
+    out["quoted_weight_kg"] = out["total_weight_kg"] * quantity
+    # Pipe metres include the overlap allowance of the joints, as the weight does
+    length_m = formulas.pipe_length_m({"length_mm": out["length_mm"],
+                                       "overlap_count": np.trunc(logic.column_values(df, "overlap_count"))})
+    out["quoted_pipe_m"] = np.where(kind == "pipe", length_m * out["count"] * quantity, 0.0)
+    out["quoted_pipe_kg"] = np.where(kind == "pipe", out["quoted_weight_kg"], 0.0)
+    out["material_cost"] = logic.column_values(df, "Material Cost (¥)") * quantity
+    out["project"] = np.full(rows, project, dtype=object)
+    out["customer"] = np.full(rows, customer, dtype=object)
+    out["saved_at"] = np.full(rows, np.datetime64(saved_at.replace(microsecond=0), "s"))
+    out["month"] = np.full(rows, saved_at.strftime("%Y-%m"), dtype=object)
+    out["quarter"] = np.full(rows, f"{saved_at.year}-Q{(saved_at.month - 1) // 3 + 1}", dtype=object)
+    return out
+
+def _files(root: str, year: int = None) -> list:
+    found = []
+    for dirpath, _, names in os.walk(root):
+        if year is not None and os.path.basename(dirpath) != f"year={year}":
+            continue
+        found += [os.path.join(dirpath, n) for n in names if n.endswith(".parquet")]
+    return sorted(found)
+
+def dataset(root: str = STORE_DIR):
+    """Memory-mapped Arrow dataset of the store, or None when empty / pyarrow is missing."""
+    pa = _arrow()
+    if pa is None or not _files(root):
+        return None
+    return pa.dataset.dataset(root, schema=_schema(pa).append(pa.field("year", pa.int16())), format="parquet",
+                              partitioning=_partitioning(pa), filesystem=pa.fs.LocalFileSystem(use_mmap=True))
+
+def contains(estimate: str, root: str = STORE_DIR) -> bool:
+    data = dataset(root)
+    if data is None:
+        return False
+    pa = _arrow()
+    return data.count_rows(filter=pa.dataset.field("estimate_id") == estimate) > 0
+
+def record(project: str, customer: str, patterns: list, saved_at: datetime = None, root: str = STORE_DIR):
+    """
+    Appends one estimate: (pattern name, calculated table, pole quantity) per pattern.
+    Returns its estimate id, or None if pyarrow is missing, the tables are empty or it is already stored.
+    """
+    pa = _arrow()
+    if pa is None:
+        return None
+    saved_at = saved_at or datetime.now()
+    df = _combined(patterns)
+    if df is None:
+        return None
+    # Content id: saving the same estimate twice stores it once
+    import session_store
+    estimate = session_store.content_hash(project, customer, df)[:16]
+    cols = estimate_rows(project, customer, df, saved_at)
+    with _lock:
+        if contains(estimate, root):
+            return None
+        cols["estimate_id"] = np.full(len(cols["pattern"]), estimate, dtype=object)
+        table = pa.Table.from_pydict(cols, schema=_schema(pa))
+        folder = os.path.join(root, f"year={saved_at.year}")
+        os.makedirs(folder, exist_ok=True)
+        _write(pa, table, os.path.join(folder, f"{saved_at:%Y%m%d%H%M%S}-{estimate}.parquet"))
+        if len(_files(root, saved_at.year)) > COMPACT_FILES:
+            _compact_year(pa, root, saved_at.year)
+    return estimate
+
+def _write(pa, table, path: str):
+    tmp = path + ".tmp"
+    pa.parquet.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS, compression="zstd")
+    os.replace(tmp, path)
+
+def _compact_year(pa, root: str, year: int):
+    """Merges the files of one year into one, sorted by save time (row-group statistics prune date filters)."""
+    files = _files(root, year)
+    if len(files) < 2:
+        return
+    table = pa.concat_tables([pa.parquet.read_table(f, schema=_schema(pa), memory_map=True) for f in files])
+    table = table.sort_by("saved_at")
+    _write(pa, table, os.path.join(root, f"year={year}", f"part-{uuid.uuid4().hex[:12]}.parquet"))
+    for f in files:
+        os.remove(f)
+
+def compact(root: str = STORE_DIR) -> int:
+    """Merges every year partition into one file. Returns the number of partitions compacted."""
+    pa = _arrow()
+    if pa is None or not os.path.isdir(root):
+        return 0
+    n = 0
+    with _lock:
+        for name in sorted(os.listdir(root)):
+            if name.startswith("year=") and len(_files(root, int(name[5:]))) > 1:
+                _compact_year(pa, root, int(name[5:]))
+                n += 1
+    return n
+
+def _filter(pa, filters: dict, start: datetime, end: datetime):
+    field = pa.dataset.field
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if start is not None:
+        expr = both(expr, (field("year") >= start.year) & (field("saved_at") >= pa.scalar(start, pa.timestamp("s"))))
+    if end is not None:
+        expr = both(expr, (field("year") <= end.year) & (field("saved_at") < pa.scalar(end, pa.timestamp("s"))))
+    for key, value in (filters or {}).items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Unknown filter '{key}' (use {', '.join(FILTER_KEYS)}).")
+        if value in (None, "", []):
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        if key == "section":
+            values = [parse_section(v) for v in values]
+        expr = both(expr, field(key).isin(values))
+    return expr
+
+def query(group_by=("quarter",), filters: dict = None, start: datetime = None, end: datetime = None,
+          root: str = STORE_DIR):
+    """
+    Aggregates of the stored estimates as a DataFrame, one row per group.
+    group_by: keys of GROUP_KEYS ( () for one total row ); filters: {key: value or [values]}
+    of FILTER_KEYS (sections like "318.5x6.0" or "PL12"); start / end: save time range [start, end).
+    Columns: estimates, patterns, rows, quoted kg / pipe m / material ¥ (x pole quantity), pipe kg per pipe metre.
+    """
+    import pandas as pd
+    keys = list(group_by)
+    unknown = [k for k in keys if k not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown group key {unknown} (use {', '.join(GROUP_KEYS)}).")
+    names = keys + ["Estimates", "Patterns", "Rows", "Quoted Weight (kg)", "Quoted Pipe (m)", "Material Cost (¥)", "kg / m"]
+    data = dataset(root)
+    if data is None:
+        return pd.DataFrame(columns=names)
+    pa = _arrow()
+    columns = sorted(set(keys) | {"estimate_id", "pattern", "quoted_weight_kg", "quoted_pipe_m", "material_cost",
+                                  "quoted_pipe_kg"})
+    table = data.to_table(columns=columns, filter=_filter(pa, filters, start, end))
+    # kg / m uses only rows with a pipe weight (estimates stored before it have none)
+    table = table.append_column("weighed_pipe_m", pa.compute.if_else(
+        pa.compute.is_null(table["quoted_pipe_kg"]), 0.0, table["quoted_pipe_m"]))
+    # Patterns are counted per estimate
+    table = table.append_column("estimate_pattern", pa.compute.binary_join_element_wise(
+        table["estimate_id"], table["pattern"], "/"))
+    agg = table.group_by(keys).aggregate([
+        ("estimate_id", "count_distinct"), ("estimate_pattern", "count_distinct"), ("estimate_id", "count"),
+        ("quoted_weight_kg", "sum"), ("quoted_pipe_m", "sum"), ("material_cost", "sum"),
+        ("quoted_pipe_kg", "sum"), ("weighed_pipe_m", "sum"),
+    ]).to_pandas()
+    out = pd.DataFrame({k: agg[k] for k in keys})
+    out["Estimates"] = agg["estimate_id_count_distinct"]
+    out["Patterns"] = agg["estimate_pattern_count_distinct"]
+    out["Rows"] = agg["estimate_id_count"]
+    out["Quoted Weight (kg)"] = agg["quoted_weight_kg_sum"].round(1)
+    out["Quoted Pipe (m)"] = agg["quoted_pipe_m_sum"].round(2)
+    out["Material Cost (¥)"] = agg["material_cost_sum"].round(0)
+    pipe_m = agg["weighed_pipe_m_sum"]
+    out["kg / m"] = (agg["quoted_pipe_kg_sum"] / pipe_m.where(pipe_m > 0)).round(2)
+    if len(out) and keys:
+        out = out.sort_values(keys, ignore_index=True)
+    return out[names] if len(out) else out.reindex(columns=names)
+
+def distinct(key: str, root: str = STORE_DIR) -> list:
+    """Sorted distinct values of a column (filter choices in the app)."""
+    data = dataset(root)
+    if data is None:
+        return []
+    pa = _arrow()
+    return sorted(v for v in pa.compute.unique(data.to_table(columns=[key])[key]).to_pylist() if v)
+
+def stats(root: str = STORE_DIR) -> dict:
+    files = _files(root) if os.path.isdir(root) else []
+    data = dataset(root)
+    return {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files),
+            "rows": data.count_rows() if data is not None else 0}
@@ -0,0 +1,564 @@
+# api.py
+# Local Estimation API (ローカル積算API)
+# Stdlib HTTP server for other tools on the same machine: drawing analyses run as
+# jobs on a bounded worker pool, and estimate requests that arrive within a few
+# milliseconds of each other are validated and calculated as one batched table.
+#
+#   python api.py --port 8600
+#
+#   GET  /health
+#   POST /estimate                 {"patterns": [...]} or {"components": [...]}, optional "price_version", "rates",
+#                                  "stock" and "sheets"; priced as in the app: price-book bands, pipes charged by
+#                                  purchased bars ({"lengths_mm": [6000, 12000], "kerf_mm": 3}, default lengths
+#                                  if omitted, false: net weight), plates by nested sheets if "sheets" is given
+#                                  ({"sizes_mm": ["1219x2438", [1524, 3048]], "gap_mm": 5})
+#   POST /report                   same body -> .xlsx (formula report for one pattern, export workbook otherwise)
+#   POST /jobs?name=<file>         raw drawing bytes (Content-Type image/png, image/jpeg or application/pdf),
+#                                  optional &version=<name>&stock=6000,12000&kerf=3 (stock=off: net weight)
+#                                  &sheets=1219x2438,1524x3048&gap=5
+#   GET  /jobs/<id>                status, analysis result and estimate of a job
+#   GET  /jobs/<id>/report.xlsx    export workbook of a finished job (?pattern=<index> for one formula report)
+#
+# ESTIMATOR_API_TOKEN set: every request except /health needs "Authorization: Bearer <token>".
+# Drawing jobs use the X-Api-Key header (or GEMINI_API_KEY) and ESTIMATOR_BACKEND, see backends.get_backend.
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import logic
+import schema
+import model
+import reports
+import bulk
+import quality
+import backends
+import ai_analysis
+import cutting
+import nesting
+import pricebook
+
+MAX_BODY_BYTES = int(float(os.environ.get("ESTIMATOR_API_MAX_MB", 50)) * 1024 * 1024)
+JOB_WORKERS = int(os.environ.get("ESTIMATOR_API_WORKERS", 4))
+MAX_QUEUED_JOBS = 64       # Unfinished drawing jobs; more are refused with 503 until the queue drains
+MAX_KEPT_JOBS = 500        # Finished jobs beyond this are forgotten, oldest first
+MAX_INFLIGHT = 32          # Concurrent /estimate and /report requests; more get 503
+BATCH_WINDOW_S = 0.005     # Estimate requests arriving within this window share one calculation
+BATCH_MAX_ROWS = 50000     # A batch is closed early once it holds this many component rows
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+FRAME_COLUMNS = model.CATEGORY_COLUMNS + model.DIM_COLUMNS + model.INT_COLUMNS + ("notes",)
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# --- Estimation ---
+
+def parse_patterns(body) -> list:
+    """Normalized patterns of an /estimate or /report body."""
+    if not isinstance(body, dict):
+        raise ApiError(400, "Body must be a JSON object.")
+    if isinstance(body.get("patterns"), list):
+        patterns = schema.normalize_patterns(body["patterns"])
+    elif isinstance(body.get("components"), list):
+        patterns = schema.normalize_patterns([{"pattern_name": str(body.get("pattern_name") or "Pattern 1"),
+                                               "components": body["components"]}])
+    else:
+        raise ApiError(400, 'Expected "patterns" or "components" (list).')
+    if not patterns:
+        raise ApiError(400, "No patterns in the request.")
+    return patterns
+
+def parse_version(body) -> pricebook.Version:
+    """Price-book version named by "price_version", else the one in effect today (as in the app's sidebar)."""
+    name = body.get("price_version") if isinstance(body, dict) else None
+    book = pricebook.load_cached()
+    if name is None:
+        return book.version_at()
+    try:
+        return book.get(str(name))
+    except KeyError as e:
+        raise ApiError(400, e.args[0])
+
+def parse_rates(body, version: pricebook.Version = None) -> dict:
+    """Rates of the price-book version (logic.DEFAULT_RATES without one) overridden by the numeric "rates" of the body."""
+    rates = dict(version.rates if version is not None else logic.DEFAULT_RATES)
+    given = body.get("rates") or {} if isinstance(body, dict) else {}
+    if not isinstance(given, dict):
+        raise ApiError(400, '"rates" must be an object.')
+    for key, value in given.items():
+        if key not in rates:
+            raise ApiError(400, f"Unknown rate '{key}' (known: {', '.join(rates)}).")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ApiError(400, f"Rate '{key}' must be a number.")
+        rates[key] = value
+    return rates
+
+def parse_stock(body):
+    """Cutting-stock options of the body ("stock", default lengths if omitted), or None (false) to charge pipes by net weight."""
+    stock = body.get("stock", {}) if isinstance(body, dict) else {}
+    if stock is None or stock is False:
+        return None
+    if not isinstance(stock, dict):
+        raise ApiError(400, '"stock" must be an object.')
+    lengths = stock.get("lengths_mm", cutting.DEFAULT_STOCK_LENGTHS_MM)
+    try:
+        if not isinstance(lengths, str):
+            lengths = " ".join(str(v) for v in lengths)
+        lengths = cutting.parse_lengths(lengths)
+        kerf = float(stock.get("kerf_mm", cutting.DEFAULT_KERF_MM))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, f"Invalid stock options: {e}")
+    return {"lengths": lengths, "kerf": max(0.0, kerf), "exact": bool(stock.get("exact", True))}
+
+def parse_sheets(body):
+    """Plate-nesting options of the body ("sheets"), or None to charge plates by net weight (the app's default)."""
+    sheets = body.get("sheets") if isinstance(body, dict) else None
+    if sheets is None or sheets is False:
+        return None
+    if not isinstance(sheets, dict):
+        raise ApiError(400, '"sheets" must be an object.')
+    sizes = sheets.get("sizes_mm", nesting.DEFAULT_SHEET_SIZES_MM)
+    try:
+        if not isinstance(sizes, str):
+            sizes = ", ".join(s if isinstance(s, str) else "x".join(str(v) for v in s) for s in sizes)
+        sizes = nesting.parse_sheets(sizes)
+        gap = float(sheets.get("gap_mm", nesting.DEFAULT_GAP_MM))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, f"Invalid sheet options: {e}")
+    return {"sizes": sizes, "gap": max(0.0, gap)}
+
+def pattern_frame(pattern: dict) -> pd.DataFrame:
+    """Typed component table of a pattern, as the app's editor starts from."""
+    df = model.PatternTable.from_pattern(pattern).frame()
+    df = df[list(FRAME_COLUMNS)]
+    df["type"] = df["type"].astype(str)
+    df["name"] = df["name"].astype(str)
+    return df
+
+def calculate_patterns(frames: list) -> list:
+    """
+    Validates and calculates several pattern tables as one table (rib context per
+    pattern via logic.rib_context_groups) and splits the result again.
+    """
+    sizes = [len(f) for f in frames]
+    if not frames:
+        return []
+    big = pd.concat(frames, ignore_index=True)
+    groups = np.repeat(np.arange(len(frames)), sizes)
+    big = logic.calculate_frame(logic.validate_frame(big, *logic.rib_context_groups(big, groups)))
+    bounds = np.cumsum([0] + sizes)
+    return [big.iloc[a:b].reset_index(drop=True) for a, b in zip(bounds[:-1], bounds[1:])]
+
+class Batcher:
+    """
+    Collects the pattern tables of concurrent estimate requests for BATCH_WINDOW_S
+    and runs calculate_patterns once over all of them, which saves the fixed
+    per-call overhead of the vectorized calculation on small requests.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW_S, max_rows: int = BATCH_MAX_ROWS):
+        self.window = window
+        self.max_rows = max_rows
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._loop, name="estimate-batcher", daemon=True).start()
+
+    def submit(self, frames: list) -> Future:
+        """Future of the validated, calculated tables of one request."""
+        future = Future()
+        self._queue.put((frames, future))
+        return future
+
+    def _loop(self):
+        while True:
+            items = [self._queue.get()]
+            rows = sum(len(f) for f in items[0][0])
+            deadline = time.monotonic() + self.window
+            while rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+                rows += sum(len(f) for f in item[0])
+            self._run(items)
+
+    def _run(self, items: list):
+        self.batches += 1
+        self.requests += len(items)
+        try:
+            results = calculate_patterns([f for frames, _ in items for f in frames])
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        k = 0
+        for frames, future in items:
+            future.set_result(results[k:k + len(frames)])
+            k += len(frames)
+
+def estimate(patterns: list, rates: dict, batcher: Batcher, stock: dict = None,
+             version: pricebook.Version = None, sheets: dict = None) -> tuple:
+    """
+    Prices the patterns the same way as app.py. Returns (estimates, plans): estimates is
+    [(pattern name, priced table, logic.cost_breakdown)], plans {"cutting": ..., "nesting": ...}.
+    stock: parse_stock options; pipes of all patterns x their quantity are cut together.
+    version: price-book version whose size bands set the material ¥/kg of each row.
+    sheets: parse_sheets options; plates and ribs of all patterns are nested per thickness.
+    """
+    calculated = batcher.submit([pattern_frame(p) for p in patterns]).result()
+    quantities = [schema.to_float(p.get("quantity", 1)) for p in patterns]
+    plans = {"cutting": {}, "nesting": {}}
+    if stock:
+        pieces = cutting.collect_pieces(calculated, quantities)
+        plans["cutting"] = cutting.optimize(pieces, stock["lengths"], stock["kerf"], stock["exact"])
+    if sheets:
+        plans["nesting"] = nesting.optimize(nesting.collect_pieces(calculated, quantities), sheets["sizes"], sheets["gap"])
+    banded = version.with_rates(rates) if version is not None and version.bands else None
+    out = []
+    for p, df in zip(patterns, calculated):
+        factor = cutting.row_factors(df, plans["cutting"]) if plans["cutting"] else None
+        if plans["nesting"]:
+            nest_factor = nesting.row_factors(df, plans["nesting"])
+            factor = nest_factor if factor is None else factor * nest_factor
+        band_prices = banded.unit_prices(df) if banded is not None else None
+        priced = model.exact(logic.price_frame(df, rates["pipe_price"], rates["plate_price"], factor, band_prices))
+        out.append((p.get("pattern_name", "Pattern"), priced, logic.cost_breakdown(priced, rates)))
+    return out, plans
+
+def estimate_json(patterns: list, estimates: list, plans: dict = None, version: pricebook.Version = None) -> dict:
+    result = []
+    totals = {}
+    for p, (name, df, costs) in zip(patterns, estimates):
+        needs_check = df["_priority"].to_numpy() == 1
+        rows = df.drop(columns="_priority").assign(needs_check=needs_check)
+        costs = {k: round(float(v), 2) for k, v in costs.items()}
+        for k, v in costs.items():
+            totals[k] = totals.get(k, 0.0) + v
+        result.append({"pattern_name": name, "alerts": p.get("validation_alerts", []),
+                       "checks": int(needs_check.sum()), "costs": costs,
+                       "rows": rows.to_dict(orient="records")})
+    out = {"patterns": result, "totals": {k: round(v, 2) for k, v in totals.items()}}
+    if version is not None:
+        out["price_version"] = version.name
+    plans = plans or {}
+    if plans.get("cutting"):
+        out["cutting"] = {"groups": cutting.summary(plans["cutting"]), "cutting_list": cutting.cutting_list(plans["cutting"])}
+    if plans.get("nesting"):
+        out["nesting"] = {"groups": nesting.summary(plans["nesting"]), "sheet_list": nesting.sheet_list(plans["nesting"])}
+    return out
+
+def report_bytes(estimates: list, rates: dict, pattern: int = None) -> bytes:
+    """Formula report of one pattern (index or the only one), else the export workbook."""
+    if pattern is None and len(estimates) == 1:
+        pattern = 0
+    if pattern is not None:
+        if not 0 <= pattern < len(estimates):
+            raise ApiError(404, f"No pattern {pattern}.")
+        name, df, costs = estimates[pattern]
+        return reports.generate_report_excel(name, df, logic.report_settings(costs, rates))
+    return reports.export_workbook({name: df for name, df, _ in estimates})
+
+# --- Drawing jobs ---
+
+class JobQueue:
+    """Drawing analyses (bulk.process_entry) on a bounded thread pool, kept by id."""
+
+    def __init__(self, batcher: Batcher, workers: int = JOB_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS, keep: int = MAX_KEPT_JOBS):
+        self.batcher = batcher
+        self.max_queued = max_queued
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="analysis")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._unfinished = 0
+
+    def submit(self, name: str, mime_type: str, data: bytes, backend, api_key: str, rates: dict, stock: dict = None,
+               version: pricebook.Version = None, sheets: dict = None):
+        """The new job, or None if MAX_QUEUED_JOBS are still unfinished."""
+        with self._lock:
+            if self._unfinished >= self.max_queued:
+                return None
+            self._unfinished += 1
+            job = {"id": uuid.uuid4().hex, "file": name, "status": "queued", "created": time.time(),
+                   "finished": None, "rates": rates, "stock": stock, "version": version, "sheets": sheets,
+                   "result": None, "estimates": None, "plans": None}
+            self._jobs[job["id"]] = job
+            self._prune()
+        self._pool.submit(self._run, job, mime_type, data, backend, api_key)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self) -> dict:
+        with self._lock:
+            out = {}
+            for job in self._jobs.values():
+                out[job["status"]] = out.get(job["status"], 0) + 1
+            return out
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: dict, mime_type: str, data: bytes, backend, api_key: str):
+        job["status"] = "running"
+        try:
+            # Analysis failures raise, so process_entry reports them as status "error" with the message
+            def analyze(drawing):
+                return ai_analysis.analyze_drawing(drawing, api_key, backend=backend, raise_errors=True)
+            result = bulk.process_entry(job["file"], mime_type, data, analyze, gate=quality.gate)
+            if result["patterns"]:
+                job["estimates"], job["plans"] = estimate(result["patterns"], job["rates"], self.batcher, job["stock"],
+                                                          job["version"], job["sheets"])
+            job["result"] = result
+            job["status"] = result["status"]
+        except Exception as e:
+            job["result"] = {"error": str(e)}
+            job["status"] = "error"
+        finally:
+            job["finished"] = time.time()
+            with self._lock:
+                self._unfinished -= 1
+
+    def _prune(self):
+        finished = [k for k, j in self._jobs.items() if j["finished"] is not None]
+        for k in finished[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[k]
+
+def job_json(job: dict) -> dict:
+    out = {k: job[k] for k in ("id", "file", "status", "created", "finished")}
+    result = job["result"]
+    if result is not None:
+        out.update({k: result.get(k) for k in ("checks", "weight_kg", "area_m2", "seconds", "error")})
+    if job["estimates"]:
+        out["estimate"] = estimate_json(result["patterns"], job["estimates"], job["plans"], job["version"])
+    return out
+
+# --- HTTP ---
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, token: str = None, workers: int = JOB_WORKERS, verbose: bool = False):
+        super().__init__(address, Handler)
+        self.token = token
+        self.verbose = verbose
+        self.batcher = Batcher()
+        self.jobs = JobQueue(self.batcher, workers=workers)
+        self.reports = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="report")
+        self.inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+        self.started = time.time()
+
+    def server_close(self):
+        super().server_close()
+        self.jobs.shutdown()
+        self.reports.shutdown(wait=False, cancel_futures=True)
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "EstimatorAPI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/") or "/"
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._body_read = False
+        try:
+            if path == "/health" and method == "GET":
+                return self._health()
+            self._authorize()
+            parts = path.strip("/").split("/")
+            if method == "POST" and path == "/estimate":
+                return self._estimate(report=False)
+            if method == "POST" and path == "/report":
+                return self._estimate(report=True)
+            if method == "POST" and path == "/jobs":
+                return self._submit_job(query)
+            if method == "GET" and parts[0] == "jobs" and len(parts) == 2:
+                return self._send_json(200, job_json(self._job(parts[1])))
+            if method == "GET" and parts[0] == "jobs" and len(parts) == 3 and parts[2] == "report.xlsx":
+                return self._job_report(self._job(parts[1]), query)
+            raise ApiError(404, f"No route for {method} {url.path}")
+        except ApiError as e:
+            self._send_error(e.status, str(e))
+        except Exception as e:
+            self._send_error(500, f"{type(e).__name__}: {e}")
+
+    # --- Endpoints ---
+    def _health(self):
+        server = self.server
+        self._send_json(200, {"status": "ok", "uptime_s": round(time.time() - server.started, 1),
+                              "jobs": server.jobs.counts(), "batches": server.batcher.batches,
+                              "batched_requests": server.batcher.requests})
+
+    def _estimate(self, report: bool):
+        body = self._read_json()
+        patterns, version = parse_patterns(body), parse_version(body)
+        rates, stock, sheets = parse_rates(body, version), parse_stock(body), parse_sheets(body)
+        if not self.server.inflight.acquire(blocking=False):
+            raise ApiError(503, "Too many concurrent requests.")
+        try:
+            estimates, plans = estimate(patterns, rates, self.server.batcher, stock, version, sheets)
+            if not report:
+                return self._send_json(200, estimate_json(patterns, estimates, plans, version))
+            pattern = body.get("pattern")
+            if pattern is not None and not isinstance(pattern, int):
+                raise ApiError(400, '"pattern" must be an index.')
+            data = self.server.reports.submit(report_bytes, estimates, rates, pattern).result()
+            self._send(200, data, XLSX, {"Content-Disposition": 'attachment; filename="estimate.xlsx"'})
+        finally:
+            self.server.inflight.release()
+
+    def _submit_job(self, query: dict):
+        name = os.path.basename(query.get("name", "")) or "drawing"
+        mime_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if mime_type not in bulk.DRAWING_EXTENSIONS.values():
+            mime_type = bulk.DRAWING_EXTENSIONS.get(os.path.splitext(name)[1].lower(), mime_type)
+        if mime_type not in bulk.DRAWING_EXTENSIONS.values():
+            raise ApiError(415, "Send a PNG, JPEG or PDF drawing.")
+        version = parse_version({"price_version": query.get("version")})
+        try:
+            rates = parse_rates({"rates": json.loads(query["rates"])} if "rates" in query else {}, version)
+        except ValueError:
+            raise ApiError(400, '"rates" must be a JSON object.')
+        stock = {"lengths_mm": query.get("stock", cutting.DEFAULT_STOCK_LENGTHS_MM), "kerf_mm": query.get("kerf", cutting.DEFAULT_KERF_MM)}
+        stock = parse_stock({"stock": None if query.get("stock") == "off" else stock})
+        sheets = None
+        if "sheets" in query:
+            sheets = parse_sheets({"sheets": {"sizes_mm": query["sheets"], "gap_mm": query.get("gap", nesting.DEFAULT_GAP_MM)}})
+        data = self._read_body()
+        if not data:
+            raise ApiError(400, "Empty drawing.")
+        api_key = self.headers.get("X-Api-Key") or os.environ.get("GEMINI_API_KEY", "")
+        backend = backends.get_backend(api_key)
+        if backend is None and mime_type != "application/pdf":
+            raise ApiError(400, "No analysis backend: send X-Api-Key or set ESTIMATOR_BACKEND.")
+        job = self.server.jobs.submit(name, mime_type, data, backend, api_key, rates, stock, version, sheets)
+        if job is None:
+            raise ApiError(503, "Analysis queue is full.")
+        self._send_json(202, job_json(job), {"Location": f"/jobs/{job['id']}"})
+
+    def _job_report(self, job: dict, query: dict):
+        if not job["estimates"]:
+            raise ApiError(409, f"Job is {job['status']}; no estimate to report.")
+        try:
+            pattern = int(query["pattern"]) if "pattern" in query else None
+        except ValueError:
+            raise ApiError(400, "pattern must be an index.")
+        data = self.server.reports.submit(report_bytes, job["estimates"], job["rates"], pattern).result()
+        stem = os.path.splitext(job["file"])[0]
+        self._send(200, data, XLSX, {"Content-Disposition": f'attachment; filename="{stem}.xlsx"'})
+
+    # --- Helpers ---
+    def _authorize(self):
+        token = self.server.token
+        if not token:
+            return
+        given = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            raise ApiError(401, "Missing or wrong bearer token.")
+
+    def _job(self, job_id: str) -> dict:
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            raise ApiError(404, f"No job {job_id}.")
+        return job
+
+    def _read_body(self) -> bytes:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY_BYTES:
+            raise ApiError(413, f"Body must be at most {MAX_BODY_BYTES // 2**20} MB.")
+        self._body_read = True
+        return self.rfile.read(length)
+
+    def _send_error(self, status: int, message: str):
+        # A request refused before its body was read: the unread bytes would be parsed as the
+        # next request on a keep-alive connection, so the connection is closed instead
+        has_body = (self.headers.get("Content-Length") or "0").strip() != "0" or "Transfer-Encoding" in self.headers
+        if has_body and not self._body_read:
+            self.close_connection = True
+        self._send_json(status, {"error": message})
+
+    def _read_json(self):
+        try:
+            return json.loads(self._read_body() or b"null")
+        except ValueError as e:
+            raise ApiError(400, f"Invalid JSON: {e}")
+
+    def _send_json(self, status: int, payload, headers: dict = None):
+        data = json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+        self._send(status, data, "application/json; charset=utf-8", headers)
+
+    def _send(self, status: int, data: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Steel pole estimator HTTP API")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (local only by default)")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Concurrent drawing analyses / reports")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    server = ApiServer((args.host, args.port), token=os.environ.get("ESTIMATOR_API_TOKEN") or None,
+                       workers=args.workers, verbose=args.verbose)
+    print(f"Estimator API on http://{args.host}:{args.port} ({args.workers} workers)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
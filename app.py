@@ -1,11 +1,5 @@
 import streamlit as st
-import pandas as pd
-import logic
-import ai_analysis
-import visualizer
-from io import BytesIO
-from PIL import Image
-from streamlit_pdf_viewer import pdf_viewer
+from functools import partial
 st.set_page_config(layout="wide", page_title="Steel Pole Estimator (鋼管柱積算)")
 # --- パスワード認証機能の追加 ---
 def check_password():
@@ -29,100 +23,461 @@ if not check_password():
     st.stop()  # パスワードが正しくない場合、これ以降の処理を停止する
 # --- ここまで ---
 
+# Heavy modules load on first use: the data stack once there is a drawing or project,
+# Gemini (ai_analysis) on Analyze, the 3D views (visualizer) when opened, the PDF viewer for PDFs.
+# The sidebar only reads settings from pricebook / quality; their numpy / PIL load on first use
+import os
+import session_store
+
 st.title("🔩 Steel Pole Material Estimation System")
 st.markdown("**(鋼管柱・自動拾い出しシステム)**")
 st.caption("Produced by AxelOn Inc.")
 
 # Sidebar for Setup
 with st.sidebar:
+    page = st.radio("Page (画面)", ["Estimate (積算)", "Analytics (実績分析)", "Price Book (単価表)"], horizontal=True,
+                    label_visibility="collapsed")
     st.header("1. Setup (設定)")
     api_key = st.text_input("Enter Gemini API Key (APIキーを入力)", type="password")
     uploaded_file = st.file_uploader("Upload Drawing (図面アップロード)", type=["png", "jpg", "jpeg", "pdf"])
+    bulk_files = st.file_uploader("Bulk Upload: ZIP / Multiple Drawings (一括取込)", type=["zip", "png", "jpg", "jpeg", "pdf"],
+                                  accept_multiple_files=True)
+    bulk_workers = st.number_input("Bulk Concurrency (同時解析数)", min_value=1, max_value=16, value=4, step=1)
+    asset_file = st.file_uploader("Load Saved Asset (保存データ読込)", type=["json"],
+                                  help="Restores a saved project, including page hashes for incremental revision analysis.")
+    tiered_mode = st.checkbox("Tiered Analysis (高速解析→要確認のみ高精度再解析)", value=False,
+                              help="Fast model first; only patterns with alerts or 0/CHECK values are re-analyzed with the accurate model.")
+    roi_mode = st.checkbox("Send Tables/Details Only (表・詳細図のみ送信)", value=False,
+                           help="Detects BOM tables, the title block and framed detail views locally and sends only those crops (images only).")
+    incremental_mode = st.checkbox("Incremental Revision Mode (変更ページのみ再解析)", value=True,
+                                   help="For a revised PDF package, only pages whose content changed since the last analysis are re-analyzed.")
+    fast_3d = st.checkbox("Fast 3D Preview (軽量3D表示)", value=False,
+                          help="Coarser pipe tessellation without wireframe contours. Large scenes switch to this automatically.")
     
     st.divider()
     st.header("Cost Settings (原価設定)")
-    # Material Unit Costs
-    price_pipe_steel = st.sidebar.number_input("Unit Price: Pipe (鋼管単価 ¥/kg)", value=311, step=10)
-    price_plate_steel = st.sidebar.number_input("Unit Price: Plate (板材単価 ¥/kg)", value=396, step=10)
-    price_galv_process = st.sidebar.number_input("Galvanizing (メッキ単価 ¥/kg)", value=85, step=5)
+    import pricebook
+    # Price book version (pricebook.py): its rates are the defaults below, its size bands price the rows
+    price_book = pricebook.load_cached()
+    price_version = price_book.get(st.selectbox(
+        "Price Book Version (単価表)", price_book.names(), index=price_book.names().index(price_book.version_at().name),
+        help=f"Versions by effective date from {pricebook.PRICE_BOOK_FILE} (built-in defaults if the file is missing)."))
+    for band_material in ("pipe", "plate"):
+        if price_version.bands.get(band_material):
+            st.caption(f"{band_material.title()} bands: {price_version.band_label(band_material)}")
+
+    def book_rate(key):
+        """Rate of the version: int for whole values of int defaults, float otherwise (fractional book prices are kept)."""
+        value = price_version.rates[key]
+        if isinstance(pricebook.DEFAULT_RATES[key], int) and float(value).is_integer():
+            return int(value)
+        return float(value)
+
+    def rate_input(label, key, step):
+        value = book_rate(key)
+        return st.sidebar.number_input(label, value=value, step=type(value)(step))
+
+    def rate_slider(label, key, high):
+        value = book_rate(key)
+        kind = type(value)
+        return st.sidebar.slider(label, kind(0), kind(high), value, kind(1))
+
+    # Material Unit Costs (rows outside the price-book bands)
+    price_pipe_steel = rate_input("Unit Price: Pipe (鋼管単価 ¥/kg)", "pipe_price", 10)
+    price_plate_steel = rate_input("Unit Price: Plate (板材単価 ¥/kg)", "plate_price", 10)
+    price_galv_process = rate_input("Galvanizing (メッキ単価 ¥/kg)", "galv_price", 5)
     
     # Labor & Efficiency
-    # Labor & Efficiency
-    labor_rate_weld = st.sidebar.number_input("Labor Rate: Welding (溶接単価 ¥/H)", value=4244, step=100)
-    labor_rate_paint = st.sidebar.number_input("Labor Rate: Painting (塗装単価 ¥/H)", value=12530, step=100)
-    price_paint_mat = st.sidebar.number_input("Paint Mat. Price (塗料単価 ¥/m²)", value=1700, step=100)
-    weld_speed_mm_min = st.sidebar.number_input("Weld Eff. (溶接能率 mm/min)", value=50, step=5)
-    paint_eff_m2_h = st.sidebar.number_input("Paint Eff. (塗装能率 m²/H)", value=1.5, step=0.1)
+    labor_rate_weld = rate_input("Labor Rate: Welding (溶接単価 ¥/H)", "rate_weld", 100)
+    labor_rate_paint = rate_input("Labor Rate: Painting (塗装単価 ¥/H)", "rate_paint", 100)
+    price_paint_mat = rate_input("Paint Mat. Price (塗料単価 ¥/m²)", "price_paint_mat", 100)
+    weld_speed_mm_min = rate_input("Weld Eff. (溶接能率 mm/min)", "weld_speed_mm_min", 5)
+    paint_eff_m2_h = rate_input("Paint Eff. (塗装能率 m²/H)", "paint_eff_m2_h", 0.1)
     
     st.divider()
     st.header("Markup Settings (掛率設定)")
-    overhead_rate = st.sidebar.slider("Overhead & Profit (%)", 0, 50, 20, 1)
-    contingency_rate = st.sidebar.slider("Risk Contingency (%)", 0, 20, 5, 1)
+    overhead_rate = rate_slider("Overhead & Profit (%)", "rate_oh", 50)
+    contingency_rate = rate_slider("Risk Contingency (%)", "rate_risk", 20)
+
+    rates = {
+        "pipe_price": price_pipe_steel, "plate_price": price_plate_steel, "galv_price": price_galv_process,
+        "rate_weld": labor_rate_weld, "rate_paint": labor_rate_paint, "price_paint_mat": price_paint_mat,
+        "weld_speed_mm_min": weld_speed_mm_min, "paint_eff_m2_h": paint_eff_m2_h,
+        "rate_oh": overhead_rate, "rate_risk": contingency_rate,
+    }
+
+    st.divider()
+    with st.expander("Pipe Stock Lengths (鋼管定尺)", expanded=False):
+        cut_enabled = st.checkbox("Charge pipes by purchased bars (定尺購入量で材料費計算)", value=True,
+                                  help="Pipe rows of all patterns are cut from these mill lengths; offcuts are charged as material.")
+        stock_text = st.text_input("Stock Lengths mm (定尺長さ)", value="6000, 9000, 12000")
+        kerf_mm = st.number_input("Kerf mm (切断代)", min_value=0.0, max_value=20.0, value=3.0, step=0.5)
+        cut_exact = st.checkbox("Exact improvement (厳密最適化)", value=True,
+                                help="Re-plans the bars with the most offcut with a bounded exact search.")
+
+    with st.expander("Plate Sheets (鋼板定尺)", expanded=False):
+        nest_charge = st.checkbox("Charge plates by purchased sheets (定尺板取りで材料費計算)", value=False,
+                                  help="Plate and rib rows of all patterns are nested on these sheets per thickness; offcuts are charged as material. "
+                                       "Off: plates are charged by net weight and the nesting plan is shown for reference.")
+        sheet_text = st.text_input("Sheet Sizes mm (定尺寸法 W x L)", value="1219x2438, 1524x3048, 1829x6096")
+        gap_mm = st.number_input("Cutting Gap mm (切断代)", min_value=0.0, max_value=30.0, value=5.0, step=1.0)
+
+    with st.expander("Quality Gate (図面品質チェック)", expanded=False):
+        import quality
+        st.caption("Checked locally on upload before any AI call. Warn / block below these values.")
+        quality_thresholds = {}
+        for q_key, (q_warn, q_block) in quality.DEFAULT_THRESHOLDS.items():
+            q1, q2 = st.columns(2)
+            quality_thresholds[q_key] = (
+                q1.number_input(f"{quality.LABELS[q_key]} warn", value=q_warn, step=1.0, key=f"q_warn_{q_key}"),
+                q2.number_input("block", value=q_block, step=1.0, key=f"q_block_{q_key}"),
+            )
+        quality_blocking = st.checkbox("Block analysis on failed check (不合格時は解析停止)", value=True)
+
+    with st.expander("Session Memory (セッションメモリ)", expanded=False):
+        memory_budget_mb = st.number_input("Memory Budget (MB)", min_value=8, max_value=4096,
+                                           value=int(session_store.DEFAULT_BUDGET_MB), step=8,
+                                           help="Reports and results beyond this are moved to a local disk store until needed again.")
 
     st.divider()
     st.info("💡 **Tips (ヒント):**\n- 図面が鮮明であることを確認してください。\n- ベースプレートの板厚は必ず目視確認してください。\n- ジョイントの重なり数を確認してください。")
 
-if uploaded_file:
-    # ... (Image handling same as before) ...
-    # Attempt to open image for preview and analysis
-    image = None
+# --- Analytics Page: aggregates over every saved estimate (analytics.py) ---
+if page == "Analytics (実績分析)":
+    import analytics
+    st.subheader("📊 Estimate Analytics (積算実績分析)")
+    if not analytics.available():
+        st.warning("pyarrow is not installed, so the analytics store is disabled (pip install pyarrow).")
+        st.stop()
+    store_info = analytics.stats()
+    st.caption(f"{store_info['rows']:,} component rows in {store_info['files']} files "
+               f"({store_info['bytes'] / 2**20:,.1f} MB) at {analytics.STORE_DIR}")
+    if not store_info["rows"]:
+        st.info("No estimates yet. Projects are recorded here when saved with 💾 Save Asset.")
+        st.stop()
+    from datetime import datetime, timedelta
+    a1, a2, a3 = st.columns([2, 1, 1])
+    group_by = a1.multiselect("Group by (集計単位)", analytics.GROUP_KEYS, default=["quarter"])
+    date_from = a2.date_input("Saved from (開始日)", value=None)
+    date_to = a3.date_input("Saved to (終了日)", value=None)
+    f1, f2, f3 = st.columns(3)
+    filters = {
+        "customer": f1.multiselect("Customer (顧客)", analytics.distinct("customer")),
+        "section": [v for v in f2.text_input("Section (断面)", placeholder="318.5x6.0, PL12").split(",") if v.strip()],
+        "kind": f3.multiselect("Kind (種別)", ["pipe", "plate", "rib"]),
+    }
     try:
-        image = Image.open(uploaded_file)
-    except Exception:
-        pass # Might be PDF or other format
+        result = analytics.query(group_by, filters,
+                                 start=datetime.combine(date_from, datetime.min.time()) if date_from else None,
+                                 end=datetime.combine(date_to, datetime.min.time()) + timedelta(days=1) if date_to else None)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    st.dataframe(result, hide_index=True, use_container_width=True)
+    if len(group_by) == 1 and len(result) > 1:
+        st.bar_chart(result.set_index(group_by[0])["Quoted Weight (kg)"])
+    st.caption("Quoted values include the pole quantity of each pattern; kg / m is the quoted pipe weight per metre of pipe (joint overlaps included).")
+    c1, c2 = st.columns(2)
+    c1.download_button("📥 Download CSV", result.to_csv(index=False).encode("utf-8-sig"), "estimate_analytics.csv", "text/csv")
+    if c2.button("Compact Store (ファイル統合)", help="Merges the files of each year into one for faster scans."):
+        c2.caption(f"{analytics.compact()} year partitions compacted.")
+    st.stop()
+
+# --- Price Book Page: versions and bulk re-pricing of saved assets (pricebook.py) ---
+if page == "Price Book (単価表)":
+    import pandas as pd
+    st.subheader("💴 Price Book (単価表)")
+    st.caption(f"Versions from {pricebook.PRICE_BOOK_FILE}" if os.path.exists(pricebook.PRICE_BOOK_FILE)
+               else f"No price-book file at {pricebook.PRICE_BOOK_FILE}: built-in defaults only (format: see README).")
+    st.dataframe(pd.DataFrame([{
+        "Version": v.name, "Effective (適用日)": v.effective.isoformat(),
+        "Pipe Bands (鋼管)": v.band_label("pipe") or f"¥{v.rates['pipe_price']:g}",
+        "Plate Bands (板材)": v.band_label("plate") or f"¥{v.rates['plate_price']:g}",
+        "Galv. (¥/kg)": v.rates["galv_price"], "Weld (¥/h)": v.rates["rate_weld"], "Paint (¥/h)": v.rates["rate_paint"],
+    } for v in price_book.versions]), hide_index=True, use_container_width=True)
+
+    st.markdown("#### ♻️ Bulk Re-pricing (一括再見積)")
+    reprice_files = st.file_uploader("Saved Assets (保存データ)", type=["json"], accept_multiple_files=True, key="reprice_files")
+    target_name = st.selectbox("Re-price with (適用単価表)", price_book.names(),
+                               index=price_book.names().index(price_book.version_at().name))
+    if reprice_files and st.button("Re-price (再見積)", type="primary"):
+        import json
+        reprice_assets = [json.loads(f.getvalue()) for f in reprice_files]
+        st.session_state.reprice_result = pricebook.reprice(reprice_assets, price_book.get(target_name),
+                                                            [f.name for f in reprice_files])
+    if st.session_state.get("reprice_result"):
+        delta_patterns, delta_projects = st.session_state.reprice_result
+        r1, r2, r3 = st.columns(3)
+        old_total, new_total = delta_projects["Old Quote (¥)"].sum(), delta_projects["New Quote (¥)"].sum()
+        r1.metric("Old Quotes", f"¥{old_total:,.0f}")
+        r2.metric("New Quotes", f"¥{new_total:,.0f}", f"{new_total - old_total:+,.0f}")
+        r3.metric("Assets / Patterns", f"{len(delta_projects)} / {len(delta_patterns)}")
+        st.dataframe(delta_projects, hide_index=True, use_container_width=True)
+        with st.expander("Patterns (パターン別)", expanded=False):
+            st.dataframe(delta_patterns, hide_index=True, use_container_width=True)
+        st.caption("Quotes include the pole quantity; material is charged on the purchased weight saved with each asset "
+                   "(bars / sheets), net weight for assets saved without it.")
+        st.download_button("📥 Download Delta Report (Excel)", partial(pricebook.delta_workbook, delta_patterns, delta_projects),
+                           "reprice_delta.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    st.stop()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def check_quality(data: bytes, mime_type: str, thresholds: tuple):
+    """Cached per upload content + thresholds, so reruns don't re-measure."""
+    import quality
+    return quality.gate(data, mime_type, dict(thresholds))
+
+def quality_gate(data, mime_type):
+    return check_quality(data, mime_type, tuple(quality_thresholds.items()))
+
+# Previews are cached per upload content hash (the bytes themselves are not re-hashed)
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_image_preview(key: str, _data: bytes):
+    return preview.image_preview(_data)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_page_count(key: str, _data: bytes):
+    return preview.pdf_page_count(_data)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_pdf_page(key: str, page: int, _data: bytes):
+    return preview.render_pdf_page(_data, page)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_thumbnail(key: str, page: int, _data: bytes):
+    return preview.pdf_thumbnail(_data, page)
+
+# 3D figures are compacted once and cached by geometry, so unchanged poles are not rebuilt
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_3d_preview(key: str, title: str, fast: bool, _df):
+    import visualizer
+    return visualizer.compact_figure(visualizer.generate_3d_preview(_df.copy(), title=title, fast=fast))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_cut_plans(pieces: dict, stock_lengths: tuple, kerf: float, exact: bool):
+    return cutting.optimize(pieces, stock_lengths, kerf, exact)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_nest_plans(groups: dict, sheet_sizes: tuple, gap: float):
+    return nesting.optimize(groups, sheet_sizes, gap)
+
+def record_estimate(project_name: str, customer: str, patterns: list):
+    import analytics
+    if analytics.record(project_name, customer, patterns):
+        st.toast("Recorded in the estimate analytics (実績DBに登録しました)")
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_site_view(key: str, _patterns):
+    import visualizer
+    return visualizer.compact_figure(visualizer.generate_site_view(_patterns))
+
+# Per-session artifact store (workbooks, bulk reports); cold entries are spilled to disk
+if "store" not in st.session_state:
+    st.session_state.store = session_store.SessionStore(memory_budget_mb)
+store = st.session_state.store
+store.set_budget(memory_budget_mb)
+
+def set_project(patterns: list):
+    """Stores analysis results / loaded assets as the typed project model."""
+    if not schema.is_normalized(patterns):
+        patterns = schema.normalize_patterns(patterns)
+    st.session_state.project = model.Project.from_patterns(patterns)
+    store.put("project", st.session_state.project, pin=True)   # Counted, never spilled (edited in place)
+
+def journal_step(action: str, *args):
+    """Undo / redo / goto on the edit journal (button callback); the editors restart from the restored tables."""
+    getattr(st.session_state.journal, action)(*args)
+    for key in [k for k in st.session_state.keys() if str(k).startswith("editor_")]:
+        del st.session_state[key]
+    st.session_state.pop("pending_propagation", None)
+
+if asset_file is not None or uploaded_file or bulk_files or st.session_state.get("project"):
+    import pandas as pd
+    import numpy as np
+    import logic
+    import schema
+    import revisions
+    import bulk
+    import preview
+    import parts
+    import model
+    import reports
+    import cutting
+    import nesting
+    import journal
+
+# Restore a saved asset once per file
+if asset_file is not None and st.session_state.get("loaded_asset") != (asset_file.name, asset_file.size):
+    import json
+    asset = json.loads(asset_file.getvalue())
+    set_project(parts.unpack_patterns(asset))
+    st.session_state.page_hashes = asset.get("meta", {}).get("page_hashes", [])
+    st.session_state.loaded_asset = (asset_file.name, asset_file.size)
+
+if uploaded_file or bulk_files or st.session_state.get("project"):
+    is_image = bool(uploaded_file) and uploaded_file.type.startswith("image/")
+    upload_key = preview.content_key(uploaded_file.getvalue()) if uploaded_file else None
 
     # Display Image (Left Column or Top)
     col1, col2 = st.columns([1, 1])
     
     with col1:
         st.subheader("2. Drawing Preview (図面プレビュー)")
-        if image:
-            st.image(image, use_container_width=True)
-        elif uploaded_file.type == "application/pdf":
-            st.info(f"📄 PDFファイルがアップロードされました: {uploaded_file.name}")
-            # PDF Preview
+        image_preview = None
+        if is_image:
+            try:
+                image_preview = cached_image_preview(upload_key, uploaded_file.getvalue())
+            except Exception:
+                pass # Unreadable image: analysis can still be attempted
+
+        if image_preview:
+            st.image(image_preview, use_container_width=True)
+        elif uploaded_file and uploaded_file.type == "application/pdf":
             binary_data = uploaded_file.getvalue()
-            pdf_viewer(input=binary_data, width=700)
-        else:
+            n_pages = cached_page_count(upload_key, binary_data)
+            st.info(f"📄 PDFファイルがアップロードされました: {uploaded_file.name} ({n_pages} pages)")
+            preview_page = 1
+            if n_pages > 1:
+                preview_page = st.number_input("Page (ページ)", min_value=1, max_value=n_pages, value=1, step=1, key=f"preview_page_{upload_key}")
+                # Thumbnail strip around the selected page, rendered on demand
+                window = preview.thumbnail_window(preview_page, n_pages)
+                for thumb_col, n in zip(st.columns(len(window)), window):
+                    thumb = cached_thumbnail(upload_key, n, binary_data)
+                    with thumb_col:
+                        if thumb:
+                            st.image(thumb, use_container_width=True)
+                        st.caption(f"**p.{n}**" if n == preview_page else f"p.{n}")
+            # Only the selected page is rendered / sent to the browser
+            kind, content = cached_pdf_page(upload_key, int(preview_page), binary_data)
+            if kind == "image":
+                st.image(content, use_container_width=True)
+            else:
+                from streamlit_pdf_viewer import pdf_viewer
+                pdf_viewer(input=content if kind == "pdf" else binary_data, width=700)
+        elif uploaded_file:
             st.info("プレビューを表示できません (Preview not available). 解析に進んでください。")
+        elif bulk_files:
+            st.info(f"📦 {bulk.count_entries(bulk_files)} drawings in the bulk upload.")
+            if store.get("bulk_report"):
+                st.dataframe(pd.DataFrame(store.get("bulk_report")), use_container_width=True)
+        else:
+            st.info("保存データを表示中 (Showing a loaded project without a drawing).")
+
+        # --- Quality Gate ---
+        quality_level = "ok"
+        if uploaded_file:
+            try:
+                quality_level, quality_reasons = quality_gate(uploaded_file.getvalue(), uploaded_file.type)
+            except Exception as e:
+                quality_level, quality_reasons = "warn", [f"Quality check failed: {e}"]
+            if quality_level == "ok":
+                st.success("✅ Drawing quality OK (図面品質 良好)")
+            else:
+                show = st.error if quality_level == "block" else st.warning
+                show("⚠️ **Drawing quality check (図面品質チェック):** re-scan or re-shoot may be needed.\n" +
+                     "\n".join(f"- {r}" for r in quality_reasons))
 
     with col2:
         st.subheader("3. Material Extraction (部材抽出)")
         
         # Session State for Data
-        if "extracted_data" not in st.session_state:
-            st.session_state.extracted_data = []
-
-        if st.button("🚀 Analyze Drawing with AI (AI解析開始)"):
-            if not api_key:
+        if "project" not in st.session_state:
+            st.session_state.project = model.Project()
+
+        # --- Bulk Package Mode ---
+        if bulk_files and st.button("📦 Analyze Bulk Package (一括解析開始)"):
+            import ai_analysis
+            import backends
+            backend = backends.get_backend(api_key)
+            total = bulk.count_entries(bulk_files)
+            progress = st.progress(0.0, text=f"0 / {total}")
+            status = st.empty()
+            report = []
+            project = []
+
+            # Runs on worker threads: failures are raised and reported per file instead of st.error
+            def analyze(drawing):
+                return ai_analysis.analyze_drawing(drawing, api_key, backend=backend, tiered=tiered_mode,
+                                                   crop_regions=roi_mode, raise_errors=True)
+
+            gate = quality_gate if quality_blocking else None
+            for result in bulk.run_pipeline(bulk_files, analyze, max_workers=bulk_workers, gate=gate):
+                project.extend(result.pop("patterns"))
+                report.append(result)
+                progress.progress(len(report) / max(total, 1), text=f"{len(report)} / {total}: {result['file']}")
+                status.dataframe(pd.DataFrame(report), use_container_width=True)
+
+            store.put("bulk_report", report)
+            if project:
+                set_project(project)
+                st.success(f"一括解析完了! {len(project)} patterns from {total} drawings.")
+            else:
+                st.error("データが抽出されませんでした (No data extracted).")
+
+        analyze_blocked = quality_blocking and quality_level == "block"
+        if analyze_blocked:
+            analyze_blocked = not st.checkbox("Analyze anyway (品質警告を無視して解析)", value=False)
+
+        if uploaded_file and st.button("🚀 Analyze Drawing with AI (AI解析開始)", disabled=analyze_blocked):
+            import ai_analysis
+            import backends
+            from PIL import Image
+            # Live Gemini, or a replay/synthetic stand-in selected via ESTIMATOR_BACKEND
+            backend = backends.get_backend(api_key)
+            is_pdf = uploaded_file.type == "application/pdf"
+
+            # Per-page content hashes: a new revision only re-analyzes changed sheets
+            page_hashes = revisions.file_page_hashes(uploaded_file)
+            changed = None
+            if incremental_mode and is_pdf and st.session_state.get("page_hashes") and len(st.session_state.project):
+                changed = revisions.changed_pages(st.session_state.page_hashes, page_hashes)
+
+            data = None
+            if changed == []:
+                st.info("前回解析から変更されたページはありません (No pages changed since the last analysis).")
+            elif backend is None and not is_pdf:
                 st.warning("APIキーを入力してください (Please enter an API Key first).")
                 # TODO: Remove dummy data in production or make optional
                 st.info("デモデータを使用します (Using Dummy Data)...")
                 data = ai_analysis.get_dummy_data()
-                st.session_state.extracted_data = data
             else:
                 with st.spinner("解析中... (Analyzing... 10-20秒かかります)"):
                     try:
-                        # Use the opened image if available, otherwise pass the file object
-                        target_file = image if image else uploaded_file
+                        # Images are decoded only here; PDFs are passed as the file object
+                        target_file = Image.open(uploaded_file) if is_image else uploaded_file
                         
-                        # PDF support enabled
-                        data = ai_analysis.analyze_drawing(target_file, api_key)
-                        if data:
-                            st.session_state.extracted_data = data
-                            st.success("解析完了! (Analysis Complete)")
-                        else:
+                        # PDF support enabled (vector PDFs are read from the text layer without a key)
+                        data = ai_analysis.analyze_drawing(target_file, api_key, backend=backend, tiered=tiered_mode,
+                                                           crop_regions=roi_mode, pages=changed)
+                        if not data and backend is None:
+                            st.info("デモデータを使用します (Using Dummy Data)...")
+                            data = ai_analysis.get_dummy_data()
+                        elif not data:
                             st.error("データが抽出されませんでした (No data extracted).")
                     except Exception as e:
                         st.error(f"Error: {e}")
 
-        # Data Editor
-        if len(st.session_state.extracted_data) > 0:
-            # Migration check
-            if isinstance(st.session_state.extracted_data[0], dict) and "pattern_name" not in st.session_state.extracted_data[0]:
-                 st.session_state.extracted_data = [{"pattern_name": "Default Pattern", "components": st.session_state.extracted_data}]
+            if data:
+                data = revisions.stamp_hashes(data, page_hashes, changed)
+                if changed:
+                    data = revisions.merge_revision(st.session_state.project.to_patterns(), data, page_hashes)
+                    st.success(f"差分解析完了! Re-analyzed {len(changed)}/{len(page_hashes)} changed pages; other patterns kept with their edits.")
+                else:
+                    st.success("解析完了! (Analysis Complete)")
+                set_project(data)
+                st.session_state.page_hashes = page_hashes
 
-            patterns = st.session_state.extracted_data
+        # Data Editor
+        if len(st.session_state.project) > 0:
+            # Typed per-pattern column tables (see model.py)
+            proj = st.session_state.project
+            patterns = proj.patterns
+
+            # Edit history: every correction as cell-level patches (see journal.py); a new project starts a new journal
+            edit_journal = st.session_state.get("journal")
+            if edit_journal is None or not edit_journal.matches(proj):
+                edit_journal = st.session_state.journal = journal.EditJournal(proj)
+            history_bar = st.container()   # Filled after the editors have recorded this run's edits
             
             # Create Tabs for each Pattern
             pattern_names = [p.get("pattern_name", f"Pattern {i+1}") for i, p in enumerate(patterns)]
@@ -130,66 +485,22 @@ if uploaded_file:
             
             # Store final dataframes for Export
             final_dfs_for_export = {}
+            estimate_frames = []    # (pattern name, priced table, pole quantity) per pattern, for the analytics store
 
             # --- Common Logic / Helpers ---
-            def get_float_helper(val):
-                try: 
-                    if isinstance(val, str):
-                        val = val.replace(",", "")
-                    return float(val)
-                except: return 0.0
-
-            def calculate_row(row):
-                 try:
-                    d = get_float_helper(row.get("diameter_mm", 0))
-                    t = get_float_helper(row.get("thickness_mm", 0))
-                    l = get_float_helper(row.get("length_mm", 0))
-                    w = get_float_helper(row.get("width_mm", 0))
-                    c = get_float_helper(row.get("count", 1))
-                    
-                    # Handle overlap count safely (ensure it's treated as float then int)
-                    overlap_val = row.get("overlap_count", 0)
-                    overlap = int(get_float_helper(overlap_val))
-                    
-                    ctype = str(row.get("type", "")).lower()
-                    name = str(row.get("name", "")).lower()
-                    is_rib = "rib" in name
-                    
-                    # Perform Calculations using logic module
-                    if "pipe" in ctype or "管" in ctype:
-                        # Pipe Weight
-                        u_w = logic.calculate_pipe_weight(d, t, l, overlap)
-                        row["Unit Weight (kg)"] = u_w
-                        
-                        # Pipe Surface Area
-                        s_area = logic.calculate_surface_area(d, l, w, "pipe", overlap, is_rib=False)
-                    else:
-                        # Plate Weight
-                        u_w = logic.calculate_plate_weight(l, w, t, is_rib=is_rib)
-                        row["Unit Weight (kg)"] = u_w
-                        
-                        # Plate Surface Area
-                        s_area = logic.calculate_surface_area(d, l, w, "plate", overlap, is_rib=is_rib)
-                    
-                    # Totals
-                    row["Total Weight (kg)"] = round(u_w * c, 2)
-                    row["Surface Area (m²)"] = round(s_area * c, 2)
-
-                 except Exception as e:
-                    # In case of calculation error, retain 0 but don't crash
-                    row["Unit Weight (kg)"] = 0.0
-                    row["Total Weight (kg)"] = 0.0
-                    row["Surface Area (m²)"] = 0.0
-                 
-                 return row
+            get_float_helper = schema.to_float
+
+            # Vectorized over the whole table; parts shared by several patterns are calculated once per run
+            calculate_frame = partial(logic.calculate_frame, cache={})
+            pending_propagation = st.session_state.setdefault("pending_propagation", {})
 
             total_project_weight = 0.0
             total_project_area = 0.0
+            edited_frames = []
 
             for i, tab in enumerate(tabs):
                 with tab:
                     pattern = patterns[i]
-                    components = pattern.get("components", [])
                     st.caption(f"Analyzing Pattern: {pattern.get('pattern_name')}")
 
                     # --- Validation Alerts (AI Report) ---
@@ -200,117 +511,46 @@ if uploaded_file:
                             for alert in alerts:
                                 st.markdown(f"- {alert}")
                     
-                    if not components:
+                    if len(pattern) == 0:
                         st.warning("No components in this pattern.")
                         continue
 
-                    df = pd.DataFrame(components)
-
-                    # Ensure columns exist
-                    required_cols = ["type", "name", "diameter_mm", "thickness_mm", "length_mm", "width_mm", "count", "notes"]
-                    for col in required_cols:
-                        if col not in df.columns:
-                            df[col] = "" 
+                    # Regions the data was read from (ROI crop mode)
+                    regions = pattern.get("source_regions", [])
+                    if regions:
+                        with st.expander(f"Detected Regions (検出領域: {len(regions)})", expanded=False):
+                            for r in regions:
+                                x0, y0, x1, y1 = r["bbox"]
+                                st.markdown(f"- **Region {r['id']}** ({r['kind']}) page {r['page']}: ({x0}, {y0}) – ({x1}, {y1}) px")
 
-                    # Add "Overlap Count"
-                    if "overlap_count" not in df.columns:
-                            df["overlap_count"] = df.apply(lambda row: 1 if "Overlap" in str(row.get("notes", "")) else 0, axis=1)
+                    # Zero-copy view of the typed columns; type/name as plain text so the
+                    # editor keeps them free-form (categoricals become fixed dropdowns)
+                    df = pattern.frame()
+                    df["type"] = df["type"].astype(str)
+                    df["name"] = df["name"].astype(str)
 
                     # --- Rib Logic Context ---
-                    base_w = 0.0
-                    pole_max_d = 0.0
-                    for _, row in df.iterrows():
-                        name = str(row.get("name", "")).lower()
-                        ctype = str(row.get("type", "")).lower()
-                        if "base" in name and "plate" in ctype: 
-                                w = get_float_helper(row.get("width_mm", 0))
-                                l = get_float_helper(row.get("length_mm", 0))
-                                base_w = max(w, l)
-                        if "pipe" in ctype:
-                                d = get_float_helper(row.get("diameter_mm", 0))
-                                if d > pole_max_d: pole_max_d = d
+                    base_w, pole_max_d = logic.rib_context_frame(df)
                     
                     # --- Data Validation & Sorting Logic ---
-                    def validate_and_update(row):
-                        # 1. Rib Logic
-                        name = str(row.get("name", "")).lower()
-                        notes = str(row.get("notes", "")) if row.get("notes") else ""
-                        needs_check = False
-                        
-                        if "rib" in name:
-                            c = get_float_helper(row.get("count", 0))
-                            if c == 0:
-                                row["count"] = 4
-                                notes += " [Default: 4]"
-                            w = get_float_helper(row.get("width_mm", 0))
-                            if w == 0 and base_w > 0 and pole_max_d > 0:
-                                calc_w = (base_w - pole_max_d) / 2
-                                if calc_w > 0:
-                                    row["width_mm"] = round(calc_w, 1)
-                                    notes += f" [Calc. Width: {calc_w:.1f}]"
-                        
-                        # 2. Unclear Data Check
-                        # Check critical dimensions for 'CHECK' string or 0 value (except reasonable 0s like width for pipe)
-                        check_cols = ["diameter_mm", "thickness_mm", "length_mm"]
-                        # For Plate, Width is critical. For Pipe, Width is usually 0.
-                        ctype = str(row.get("type", "")).lower()
-                        if "plate" in ctype:
-                            check_cols.append("width_mm")
-                            
-                        dims_missing = []
-                        for col in check_cols:
-                            val = row.get(col)
-                            # String check
-                            if isinstance(val, str) and "CHECK" in val.upper():
-                                dims_missing.append(col)
-                                needs_check = True
-                            # Value check (if numeric 0)
-                            else:
-                                f_val = get_float_helper(val)
-                                if f_val <= 0:
-                                    dims_missing.append(col)
-                                    needs_check = True
-
-                        if needs_check:
-                            row["_priority"] = 1 # Top priority
-                            if "⚠️" not in notes:
-                                notes = f"⚠️ CHECK: {', '.join(dims_missing)} " + notes
-                        else:
-                            row["_priority"] = 2
-                            
-                        row["notes"] = notes.strip()
-                        return row
-
-                    df = df.apply(validate_and_update, axis=1)
+                    df = logic.validate_frame(df, base_w, pole_max_d)
                     
                     # Sort by priority (Problematic rows first)
-                    if "_priority" in df.columns:
-                        df = df.sort_values(by="_priority")
-                        # Clean up temp column
-                        # df = df.drop(columns=["_priority"]) # Keep it hidden or drop? Drop is cleaner.
-                        # Actually we need to drop it before display, but keeping it in session state might complicate saving. 
-                        # Let's drop it now.
+                    df = df.sort_values(by="_priority")
 
                     # Reorder
-                    field_order = ["type", "name", "diameter_mm", "thickness_mm", "length_mm", "width_mm", "count", "overlap_count", "notes"]
+                    field_order = ["type", "name", "diameter_mm", "thickness_mm", "length_mm", "width_mm", "count", "overlap_count", "notes", "region"]
                     df = df[[c for c in field_order if c in df.columns]]
 
                     # Validation Warnings (Manual Logic - kept as backup)
                     potential_issues = []
-                    base_plate_found = False
-                    for idx, row in df.iterrows():
-                        name = str(row.get("name", "")).lower()
-                        t_val = row.get("thickness_mm", 0)
-                        try:
-                            if t_val and "CHECK" not in str(t_val):
-                                thickness = float(str(t_val).replace(",", ""))
-                                if "base" in name and "plate" in name:
-                                    base_plate_found = True
-                                    if thickness < 12 and thickness > 0: 
-                                            potential_issues.append(f"⚠️ Row {idx+1}: Thickness {thickness}mm seems thin for Base Plate.")
-                        except: pass
+                    name_lower = df["name"].str.lower()
+                    thickness = logic.column_values(df, "thickness_mm")
+                    is_base_plate = (thickness > 0) & name_lower.str.contains("base", regex=False).to_numpy() & name_lower.str.contains("plate", regex=False).to_numpy()
+                    for pos in np.flatnonzero(is_base_plate & (thickness < 12)):
+                        potential_issues.append(f"⚠️ Row {df.index[pos]+1}: Thickness {round(thickness[pos], 3):g}mm seems thin for Base Plate.")
                     
-                    if not base_plate_found and len(df) > 0:
+                    if not is_base_plate.any() and len(df) > 0:
                         potential_issues.append("⚠️ No component named 'Base Plate' found.")
                     
                     if potential_issues:
@@ -318,15 +558,8 @@ if uploaded_file:
                             for issue in potential_issues:
                                 st.markdown(issue)
 
-                    # Pre-calculation conversion for stability
-                    numeric_cols = ["diameter_mm", "thickness_mm", "length_mm", "width_mm", "count", "overlap_count"]
-                    for col in numeric_cols:
-                        if col in df.columns:
-                            # Convert to consistent numeric type, coerce errors to NaN then 0
-                            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
                     # Initial Calculation mainly for Total/Area columns
-                    df_calculated = df.apply(calculate_row, axis=1)
+                    df_calculated = calculate_frame(df)
                     
                     # Editor
                     edited_df = st.data_editor(
@@ -341,6 +574,7 @@ if uploaded_file:
                             "count": st.column_config.NumberColumn("数量 (Qty)", format="%.0f"),
                             "overlap_count": st.column_config.NumberColumn("継手間隔", format="%.0f"),
                             "notes": st.column_config.TextColumn("備考 (Notes)"),
+                            "region": st.column_config.NumberColumn("領域 (Region)", help="Source crop id (see detected regions)", disabled=True, format="%d"),
                             "Unit Weight (kg)": st.column_config.NumberColumn("単重 (Unit kg)", disabled=True, format="%.2f"),
                             "Total Weight (kg)": st.column_config.NumberColumn("重量 (Total kg)", disabled=True, format="%.2f"),
                             "Surface Area (m²)": st.column_config.NumberColumn("塗装面積 (Area)", disabled=True, format="%.2f"),
@@ -351,72 +585,155 @@ if uploaded_file:
                     )
 
                     # Reactive Recalc
-                    final_df = edited_df.apply(calculate_row, axis=1)
+                    final_df = calculate_frame(edited_df)
+
+                    # Shared parts: a dimension edit can be applied to every pattern using the same part
+                    common = final_df.index.intersection(df_calculated.index)
+                    sig_cols = list(parts.SIGNATURE_FIELDS)
+                    touched = (df_calculated.loc[common, sig_cols].astype(str) != final_df.loc[common, sig_cols].astype(str)).any(axis=1)
+                    for idx in common[touched.to_numpy()]:
+                        old_key = parts.part_key(df_calculated.loc[idx])
+                        if parts.part_key(final_df.loc[idx]) != old_key and any(pi != i for pi, _ in proj.uses(old_key)):
+                            pending_propagation[(i, old_key)] = final_df.loc[idx].to_dict()
+                    for (pi, old_key), new_values in list(pending_propagation.items()):
+                        if pi != i:
+                            continue
+                        others = sorted({patterns[n]["pattern_name"] for n, _ in proj.uses(old_key) if n != i})
+                        if not others:
+                            pending_propagation.pop((pi, old_key))
+                            continue
+                        st.info(f"🔗 '{new_values.get('name')}' is shared with: {', '.join(others)} (共通部材)")
+                        b1, b2 = st.columns(2)
+                        if b1.button("Apply to all patterns (全パターンに反映)", key=f"propagate_{i}_{old_key}"):
+                            before = edit_journal.snapshot({n for n, _ in proj.uses(old_key) if n != i})
+                            n_rows = proj.propagate(old_key, new_values, skip_pattern=i)
+                            edit_journal.record_changes(before, f"{new_values.get('name')} → {', '.join(others)}")
+                            pending_propagation.pop((pi, old_key))
+                            st.toast(f"Updated {n_rows} rows in other patterns.")
+                            st.rerun()
+                        if b2.button("Only this pattern (このパターンのみ)", key=f"keep_{i}_{old_key}"):
+                            pending_propagation.pop((pi, old_key))
+                            st.rerun()
                     
-                    # Update Session State
-                    st.session_state.extracted_data[i]["components"] = final_df.to_dict('records')
-                    final_dfs_for_export[pattern.get("pattern_name", f"Pattern {i}")] = final_df
-                    
-                    # Metrics
-                    p_weight = final_df["Total Weight (kg)"].sum()
-                    p_area = final_df["Surface Area (m²)"].sum()
-                    
-                    # --- Cost Calculations ---
-                    # 1. Material Cost (Row Level)
-                    def is_pipe(row):
-                        t = str(row.get("type", "")).lower()
-                        return "pipe" in t or "管" in t
-                        
-                    def calc_material_cost(row):
-                        w = row.get("Total Weight (kg)", 0)
-                        price = price_pipe_steel if is_pipe(row) else price_plate_steel
-                        return w * price
+                    # Update Session State (typed columns; uncertainty bits follow their rows).
+                    # Rows are stored in their original order with added rows last; the editor
+                    # appends added rows at the end (their index labels can repeat deleted ones)
+                    editor_state = st.session_state.get(f"editor_{i}", {})
+                    n_added = len(editor_state.get("added_rows", []))
+                    labels = final_df.index.to_numpy()
+                    source = np.concatenate([labels[:len(labels) - n_added], np.full(n_added, -1)]).astype(np.int64)
+                    order = np.argsort(np.where(source >= 0, source, len(source) + np.arange(len(source))), kind="stable")
+                    # The editor shows neither the mask nor the drawing trace (page, bbox); both follow their rows
+                    carried = {model.MASK_COLUMN: pattern.mask_for(source)}
+                    carried.update({c: pd.Series(v, index=final_df.index, dtype=object) for c, v in pattern.trace_for(source).items()})
+                    before = (pattern.columns, pattern.extra)
+                    pattern.set_frame(final_df.assign(**carried).iloc[order])
+                    user_edit = any(editor_state.get(k) for k in ("edited_rows", "added_rows", "deleted_rows"))
+                    edit_journal.record(i, before, source[order], pattern.get("pattern_name"), amend=not user_edit)
+                    edited_frames.append(final_df)
+
+            with history_bar:
+                stats = edit_journal.stats()
+                h1, h2, h3 = st.columns([1, 1, 4])
+                h1.button("↩️ Undo (元に戻す)", on_click=journal_step, args=("undo",),
+                          disabled=not edit_journal.can_undo(), use_container_width=True)
+                h2.button("↪️ Redo (やり直し)", on_click=journal_step, args=("redo",),
+                          disabled=not edit_journal.can_redo(), use_container_width=True)
+                h3.caption(f"Edit history (編集履歴): {stats['applied']} / {stats['edits']} edits, "
+                           f"{stats['patches']} patches, {stats['checkpoints']} checkpoints "
+                           f"({stats['checkpoint_bytes'] / 1024:,.0f} KB)")
+                if stats["edits"]:
+                    with st.expander("🕘 Edit History / Diff vs. AI original (編集履歴・元データとの差分)", expanded=False):
+                        st.dataframe(pd.DataFrame(edit_journal.history()), hide_index=True, use_container_width=True)
+                        g1, g2 = st.columns([3, 1])
+                        step = g1.selectbox(
+                            "Go to step (指定の時点に戻す)", list(range(stats["edits"] + 1)), index=stats["applied"],
+                            format_func=lambda k: "0: original (元データ)" if k == 0 else f"{k}: {edit_journal.entries[k - 1].label}")
+                        g2.button("Restore (復元)", on_click=journal_step, args=("goto", step), disabled=step == stats["applied"])
+                        diff_rows = edit_journal.diff_original([p.get("pattern_name") for p in patterns])
+                        st.markdown(f"**Diff vs. original (元データとの差分): {len(diff_rows)} changes**")
+                        if diff_rows:
+                            st.dataframe(pd.DataFrame(diff_rows), hide_index=True, use_container_width=True)
+
+            # Totals are shown here, once every pattern is costed (below)
+            summary_area = st.container()
+
+            # Project Site View: every pattern x its quantity in one scene
+            with st.expander("🏗️ Project Site View (全体配置ビュー)", expanded=False):
+                qty_df = pd.DataFrame({
+                    "pattern_name": [p["pattern_name"] for p in patterns],
+                    "quantity": [p.get("quantity", 1) for p in patterns],
+                })
+                edited_qty = st.data_editor(
+                    qty_df, hide_index=True, use_container_width=True, key="site_qty",
+                    column_config={
+                        "pattern_name": st.column_config.TextColumn("Pattern (パターン)", disabled=True),
+                        "quantity": st.column_config.NumberColumn("Poles (基数)", min_value=0, step=1, format="%d"),
+                    })
+                for p, q in zip(patterns, edited_qty["quantity"]):
+                    p["quantity"] = int(get_float_helper(q))
+                if st.toggle("Render site view (全体表示)", value=False):
+                    try:
+                        import visualizer
+                        site_patterns = proj.to_patterns()
+                        site_key = visualizer.geometry_hash([], [(visualizer.geometry_signature(p["components"]), p["pattern_name"], p["quantity"]) for p in site_patterns])
+                        fig_site = cached_site_view(site_key, site_patterns)
+                        st.plotly_chart(fig_site, use_container_width=True, key="3d_site")
+                    except Exception as e:
+                        st.error(f"3D Error: {e}")
+
+            # --- Stock Lengths: pipes of all patterns x their pole quantity are cut from mill lengths ---
+            cut_plans = {}
+            if cut_enabled:
+                try:
+                    stock_lengths = cutting.parse_lengths(stock_text)
+                except ValueError as e:
+                    st.sidebar.error(f"Stock lengths: {e}")
+                    stock_lengths = cutting.DEFAULT_STOCK_LENGTHS_MM
+                pieces = cutting.collect_pieces(edited_frames, [p.get("quantity", 1) for p in patterns])
+                cut_plans = cached_cut_plans(pieces, stock_lengths, float(kerf_mm), cut_exact)
+
+            # --- Plate Sheets: plates and ribs of all patterns are nested on standard sheets per thickness ---
+            try:
+                sheet_sizes = nesting.parse_sheets(sheet_text)
+            except ValueError as e:
+                st.sidebar.error(f"Sheet sizes: {e}")
+                sheet_sizes = nesting.DEFAULT_SHEET_SIZES_MM
+            plate_groups = nesting.collect_pieces(edited_frames, [p.get("quantity", 1) for p in patterns])
+            nest_plans = cached_nest_plans(plate_groups, sheet_sizes, float(gap_mm))
+
+            def purchase_factors(df):
+                """Purchased / net weight of every row (pipes by bars, plates by sheets when charged), or None."""
+                factor = cutting.row_factors(df, cut_plans) if cut_plans else None
+                if nest_charge and nest_plans:
+                    nest_factor = nesting.row_factors(df, nest_plans)
+                    factor = nest_factor if factor is None else factor * nest_factor
+                return factor
 
-                    final_df["Material Unit Price (¥/kg)"] = final_df.apply(lambda r: price_pipe_steel if is_pipe(r) else price_plate_steel, axis=1)
-                    final_df["Material Cost (¥)"] = final_df.apply(calc_material_cost, axis=1)
-                    
-                    # Re-save to export dict with new columns
-                    final_dfs_for_export[pattern.get("pattern_name", f"Pattern {i}")] = final_df
+            for i, tab in enumerate(tabs):
+                with tab:
+                    pattern = patterns[i]
+                    final_df = edited_frames[i]
 
-                    # Aggregate Material Cost
-                    cost_mat = final_df["Material Cost (¥)"].sum()
-                    
-                    # 2. Process Cost (Galvanizing)
-                    cost_galv = p_weight * price_galv_process
+                    # --- Cost Calculations (logic.cost_breakdown, shared with the HTTP API) ---
+                    # 1. Material Cost (Row Level; pipes by purchased bars and plates by purchased sheets when planned)
+                    factor = purchase_factors(final_df)
+                    band_prices = price_version.with_rates(rates).unit_prices(final_df) if price_version.bands else None
+                    final_df = logic.price_frame(final_df, price_pipe_steel, price_plate_steel, factor, band_prices)
                     
-                    # 3. Labor Cost (Estimation) using Weld Speed heuristic
-                    total_weld_len_mm = 0.0
-                    for _, r in final_df.iterrows():
-                        try:
-                            d_val = float(str(r.get("diameter_mm", 0)))
-                            l_val = float(str(r.get("length_mm", 0)))
-                            w_val = float(str(r.get("width_mm", 0)))
-                            c_val = float(str(r.get("count", 1)))
-                            
-                            if d_val > 0: 
-                                total_weld_len_mm += (d_val * 3.14159) * 2 * c_val
-                            elif l_val > 0 and w_val > 0:
-                                total_weld_len_mm += (l_val + w_val) * 2 * c_val
-                        except: pass
-                        
-                    weld_time_h = (total_weld_len_mm / (weld_speed_mm_min * 60)) if weld_speed_mm_min > 0 else 0
-                    paint_time_h = (p_area / paint_eff_m2_h) if paint_eff_m2_h > 0 else 0
-                    
-                    cost_weld = weld_time_h * labor_rate_weld
-                    cost_paint = paint_time_h * labor_rate_paint
-                    cost_labor = cost_weld + cost_paint
-                    
-                    cost_paint_mat = p_area * price_paint_mat
-                    
-                    # 1. Base Cost (製造原価)
-                    cost_base = cost_mat + cost_galv + cost_labor + cost_paint_mat
-                    
-                    # 2. Add-ons
-                    overhead_amount = cost_base * (overhead_rate / 100)
-                    contingency_amount = cost_base * (contingency_rate / 100)
-                    
-                    # 3. Grand Total (見積金額)
-                    price_est_total = cost_base + overhead_amount + contingency_amount
+                    # Export dict (float32 dimensions widened back to their entered values)
+                    final_df = model.exact(final_df)
+                    final_dfs_for_export[pattern.get("pattern_name", f"Pattern {i}")] = final_df
+                    estimate_frames.append((pattern.get("pattern_name", f"Pattern {i}"), final_df, pattern.get("quantity", 1)))
+
+                    # 2. Galvanizing, 3. Labor (weld speed heuristic), paint, markup
+                    costs = logic.cost_breakdown(final_df, rates)
+                    p_weight, p_area = costs["weight_kg"], costs["area_m2"]
+                    cost_mat, cost_galv, cost_paint_mat = costs["material"], costs["galvanizing"], costs["paint_material"]
+                    total_weld_len_mm, weld_time_h, paint_time_h = costs["weld_length_mm"], costs["weld_hours"], costs["paint_hours"]
+                    cost_weld, cost_paint, cost_labor = costs["weld"], costs["paint"], costs["labor"]
+                    cost_base, overhead_amount, contingency_amount = costs["base"], costs["overhead"], costs["contingency"]
+                    price_est_total = costs["quotation"]
                     
                     # Global Totals
                     total_project_weight += p_weight
@@ -443,6 +760,8 @@ if uploaded_file:
                         
                         summary_text = f"**{pattern.get('pattern_name')} Base Cost Breakdown:**\n"
                         summary_text += f"- Material: ¥{cost_mat:,.0f}\n"
+                        if factor is not None:
+                            summary_text += f"  - Purchased {costs['purchased_weight_kg']:,.1f} kg for {p_weight:,.1f} kg net (定尺歩留まり)\n"
                         summary_text += f"- Galvanizing: ¥{cost_galv:,.0f} (@¥{price_galv_process}/kg)\n"
                         summary_text += f"- Paint Material: ¥{cost_paint_mat:,.0f} (@¥{price_paint_mat}/m²)\n"
                         summary_text += f"- Labor: ¥{cost_labor:,.0f} (Weld @¥{labor_rate_weld}/h, Paint @¥{labor_rate_paint}/h)\n"
@@ -450,287 +769,12 @@ if uploaded_file:
                         summary_text += f"  - Paint: {p_area:.1f}m² -> {paint_time_h:.1f}H -> ¥{cost_paint:,.0f}"
                         st.markdown(summary_text)
 
-                    # --- Report Generation (Per Pattern) ---
-                    def generate_report_excel(p_name, df, settings):
-                        output = BytesIO()
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            workbook = writer.book
-                            worksheet = workbook.add_worksheet("Estimation Report")
-                            
-                            # Formats
-                            fmt_title = workbook.add_format({'bold': True, 'font_size': 14, 'align': 'center', 'border': 1, 'bg_color': '#D9E1F2'})
-                            fmt_header = workbook.add_format({'bold': True, 'font_size': 11, 'align': 'center', 'border': 1, 'bg_color': '#D9E1F2'})
-                            fmt_label = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#F2F2F2'})
-                            fmt_input = workbook.add_format({'border': 1, 'bg_color': '#FFF2CC'}) # Input cells yellow
-                            fmt_calc = workbook.add_format({'border': 1, 'bg_color': '#E2EFDA'}) # Calc cells green
-                            fmt_num = workbook.add_format({'border': 1, 'num_format': '#,##0.0'})
-                            fmt_money = workbook.add_format({'border': 1, 'num_format': '¥#,##0'})
-                            
-                            fmt_money_bold = workbook.add_format({'bold': True, 'border': 1, 'num_format': '¥#,##0', 'font_size': 12})
-                            
-                            # Settings Unpack
-                            galv_price = settings['galv_price']
-                            rate_weld = settings['rate_weld']
-                            rate_paint = settings['rate_paint']
-                            price_paint_mat = settings['price_paint_mat']
-                            time_weld = settings['time_weld']
-                            time_paint = settings['time_paint']
-                            rate_oh = settings['rate_oh']
-                            rate_risk = settings['rate_risk']
-                            
-                            # Layout Definition
-                            # Row 0: Title
-                            worksheet.merge_range('A1:J1', f"Steel Pole Estimation Report: {p_name}", fmt_title)
-                            
-                            # Row 2: Metadata
-                            worksheet.write('A2', "Date:", fmt_label)
-                            from datetime import datetime
-                            worksheet.write('B2', datetime.now().strftime("%Y-%m-%d"), fmt_input)
-                            worksheet.write('D2', "PRODUCER:", fmt_label)
-                            worksheet.write('E2', "AxelOn Inc.", fmt_input)
-
-                            # --- Cost Summary & Parameters Area ---
-                            # Define Rows for sections
-                            row_summary = 4
-                            row_params = 16
-                            row_data_header = 24
-                            
-                            # A. Calculation Parameters ( 積算条件 / 編集エリア )
-                            worksheet.merge_range(row_params, 0, row_params, 3, "▼ Calculation Parameters (積算条件・編集可)", fmt_header)
-                            # Weld Hours
-                            worksheet.write(row_params+1, 0, "Weld Hours (h)", fmt_label)
-                            worksheet.write_number(row_params+1, 1, time_weld, fmt_input) # B18
-                            cell_weld_h = f"B{row_params+2}"
-                            
-                            # Paint Hours
-                            worksheet.write(row_params+2, 0, "Paint Hours (h)", fmt_label)
-                            worksheet.write_number(row_params+2, 1, time_paint, fmt_input) # B19
-                            cell_paint_h = f"B{row_params+3}"
-                            
-                            # OH Rate
-                            worksheet.write(row_params+3, 0, "Overhead Rate (%)", fmt_label)
-                            worksheet.write_number(row_params+3, 1, rate_oh, fmt_input) # B20
-                            cell_rate_oh = f"B{row_params+4}"
-                            
-                            # Risk Rate
-                            worksheet.write(row_params+4, 0, "Risk Rate (%)", fmt_label)
-                            worksheet.write_number(row_params+4, 1, rate_risk, fmt_input) # B21
-                            cell_rate_risk = f"B{row_params+5}"
-
-                            # Rates (Right Side)
-                            worksheet.write(row_params+1, 2, "Weld Rate (¥/h)", fmt_label)
-                            worksheet.write_number(row_params+1, 3, rate_weld, fmt_input) 
-                            cell_rate_weld = f"D{row_params+2}"
-                            
-                            worksheet.write(row_params+2, 2, "Paint Rate (¥/h)", fmt_label)
-                            worksheet.write_number(row_params+2, 3, rate_paint, fmt_input) 
-                            cell_rate_paint = f"D{row_params+3}"
-                            
-                            worksheet.write(row_params+3, 2, "Paint Mat. (¥/m2)", fmt_label)
-                            worksheet.write_number(row_params+3, 3, price_paint_mat, fmt_input) 
-                            cell_price_paint_mat = f"D{row_params+4}"
-
-                            worksheet.write(row_params+4, 2, "Galv Unit Price (¥/kg)", fmt_label)
-                            worksheet.write_number(row_params+4, 3, galv_price, fmt_input) 
-                            cell_price_galv = f"D{row_params+5}"
-
-                            # B. Cost Summary ( 原価サマリー / 式 )
-                            worksheet.merge_range(row_summary, 0, row_summary, 2, "▼ Cost Summary (原価サマリー)", fmt_header)
-                            
-                            # Define Ranges for Data (To be determined after writing data)
-                            range_data_start = row_data_header + 2
-                            # placeholders for formula
-                            
-                            # 1. Total Weight
-                            worksheet.write(row_summary+1, 0, "Total Weight (kg)", fmt_label)
-                            # Formula: SUM(H_data)
-                            
-                            # 2. Material Cost
-                            worksheet.write(row_summary+2, 0, "Material Cost (¥)", fmt_label)
-                            # Formula: SUM(J_data)
-                            
-                            # 3. Galvanizing Cost
-                            worksheet.write(row_summary+3, 0, "Galvanizing Cost (¥)", fmt_label)
-                            # Formula: TotalWeight * GalvPrice
-                            
-                            # 4. Paint Material Cost
-                            worksheet.write(row_summary+4, 0, "Paint Material Cost (¥)", fmt_label)
-                            # Formula will be set later using cell_price_paint_mat
-                            
-                            # 5. Welding Cost
-                            worksheet.write(row_summary+5, 0, "Welding Labor Cost (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+5, 1, f"={cell_weld_h}*{cell_rate_weld}", fmt_money)
-                            
-                            # 6. Painting Cost
-                            worksheet.write(row_summary+6, 0, "Painting Labor Cost (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+6, 1, f"={cell_paint_h}*{cell_rate_paint}", fmt_money)
-                            
-                            # 7. TOTAL BASE COST
-                            worksheet.write(row_summary+7, 0, "TOTAL BASE COST (製造原価)", fmt_label)
-                            # Formula: Mat + Galv + PaintMat + Weld + PaintLabor
-                            
-                            # 8. Overhead
-                            worksheet.write(row_summary+8, 0, "Overhead & Profit (¥)", fmt_label)
-                            # Formula: Base * OH%
-                            
-                            # 9. Contingency
-                            worksheet.write(row_summary+9, 0, "Risk Contingency (¥)", fmt_label)
-                            # Formula: Base * Risk%
-                            
-                            # 10. QUOTATION PRICE
-                            worksheet.write(row_summary+10, 0, "QUOTATION PRICE (御見積金額)", fmt_header)
-                            # Formula: Base + OH + Risk
-                            
-                            
-                            # --- Component Data ---
-                            headers = ["Type", "Name", "Dia (mm)", "Thk (mm)", "Len (mm)", "Wid (mm)", "Qty", "Weight (kg)", "Unit Price", "Cost (¥)", "Area (m²)"]
-                            for i, h in enumerate(headers):
-                                worksheet.write(row_data_header, i, h, fmt_header)
-                            
-                            import math
-                            def safe_num(v):
-                                try:
-                                    f = float(v)
-                                    if math.isnan(f) or math.isinf(f): return 0.0
-                                    return f
-                                except:
-                                    return 0.0
-
-                            current_row = row_data_header + 1
-                            for _, r in df.iterrows():
-                                # Inputs & Statics
-                                worksheet.write(current_row, 0, r.get("type",""), fmt_input)
-                                worksheet.write(current_row, 1, r.get("name",""), fmt_input)
-                                
-                                # Safe Extract & Write
-                                d_v = safe_num(r.get("diameter_mm"))
-                                t_v = safe_num(r.get("thickness_mm"))
-                                l_v = safe_num(r.get("length_mm"))
-                                w_v = safe_num(r.get("width_mm"))
-                                q_v = safe_num(r.get("count"))
-                                mat_price = safe_num(r.get("Material Unit Price (¥/kg)"))
-
-                                worksheet.write_number(current_row, 2, d_v, fmt_input) # C
-                                worksheet.write_number(current_row, 3, t_v, fmt_input) # D
-                                worksheet.write_number(current_row, 4, l_v, fmt_input) # E
-                                worksheet.write_number(current_row, 5, w_v, fmt_input) # F
-                                worksheet.write_number(current_row, 6, q_v, fmt_input) # G
-                                worksheet.write_number(current_row, 8, mat_price, fmt_input) # I
-                                
-                                xl_row = current_row + 1
-                                # Weight Formula (H)
-                                is_pipe = "pipe" in str(r.get("type","")).lower() or "管" in str(r.get("type","")).lower()
-                                if is_pipe:
-                                    formula_weight = f"=(C{xl_row}-D{xl_row})*D{xl_row}*0.02466*E{xl_row}*G{xl_row}/1000"
-                                else:
-                                    formula_weight = f"=D{xl_row}*E{xl_row}*F{xl_row}*7.85*G{xl_row}/1000000"
-                                worksheet.write_formula(current_row, 7, formula_weight, fmt_calc)
-                                
-                                # Cost Formula (J)
-                                worksheet.write_formula(current_row, 9, f"=H{xl_row}*I{xl_row}", fmt_money)
-                                
-                                # Helpers
-                                pi_v = 3.1416
-                                
-                                # Logic Check
-                                if is_pipe:
-                                   # Pipe Area: pi * D * L / 10^6 * Qty
-                                   formula_area = f"=3.1416*C{xl_row}*E{xl_row}/1000000*G{xl_row}"
-                                   val_area = pi_v * d_v * l_v / 1000000 * q_v
-                                   
-                                   formula_weld = f"=3.1416*C{xl_row}*2*G{xl_row}" 
-                                else:
-                                   # Plate Area: 2*(LW+LT+WT)/10^6 * Qty
-                                   formula_area = f"=2*(E{xl_row}*F{xl_row}+E{xl_row}*D{xl_row}+F{xl_row}*D{xl_row})/1000000*G{xl_row}"
-                                   val_area = 2 * (l_v*w_v + l_v*t_v + w_v*t_v) / 1000000 * q_v
-                                   
-                                   formula_weld = f"=(E{xl_row}+F{xl_row})*2*G{xl_row}"
-
-                                # Write Area to K (Visible), Weld to L (Hidden)
-                                worksheet.write_formula(current_row, 10, formula_area, fmt_calc, val_area)
-                                worksheet.write_formula(current_row, 11, formula_weld)
-                                
-                                current_row += 1
-                                
-                            last_data_row = current_row
-                            
-                            # Update Summary Formulas requiring Data Range
-                            rng_weight = f"H{row_data_header+2}:H{last_data_row}"
-                            rng_cost = f"J{row_data_header+2}:J{last_data_row}"
-                            rng_area = f"K{row_data_header+2}:K{last_data_row}"
-                            
-                            # Total Weight
-                            worksheet.write_formula(row_summary+1, 1, f"=SUM({rng_weight})", fmt_num)
-                            cell_total_weight = f"B{row_summary+2}"
-                            
-                            # Material Cost
-                            worksheet.write_formula(row_summary+2, 1, f"=SUM({rng_cost})", fmt_money)
-                            cell_mat_cost = f"B{row_summary+3}"
-                            
-                            # Galv Cost Formula: Total Weight * Unit Price
-                            worksheet.write_formula(row_summary+3, 1, f"={cell_total_weight}*{cell_price_galv}", fmt_money)
-                            cell_galv_cost = f"B{row_summary+4}"
-                            
-                            # 4. Total Area (New)
-                            worksheet.write(row_summary+4, 0, "Total Area (m²)", fmt_label)
-                            worksheet.write_formula(row_summary+4, 1, f"=SUM({rng_area})", fmt_num)
-                            cell_total_area = f"B{row_summary+5}"
-
-                            # 5. Paint Material Cost
-                            worksheet.write(row_summary+5, 0, "Paint Material Cost (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+5, 1, f"={cell_total_area}*{cell_price_paint_mat}", fmt_money)
-                            cell_paint_mat_cost = f"B{row_summary+6}"
-                            
-                            # 6. Welding Cost
-                            worksheet.write(row_summary+6, 0, "Welding Labor Cost (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+6, 1, f"={cell_weld_h}*{cell_rate_weld}", fmt_money)
-                            cell_weld_cost = f"B{row_summary+7}"
-                            
-                            # 7. Painting Cost
-                            worksheet.write(row_summary+7, 0, "Painting Labor Cost (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+7, 1, f"={cell_paint_h}*{cell_rate_paint}", fmt_money)
-                            cell_paint_cost = f"B{row_summary+8}"
-                            
-                            # 8. Total Base Cost
-                            worksheet.write(row_summary+8, 0, "TOTAL BASE COST (製造原価)", fmt_label)
-                            worksheet.write_formula(row_summary+8, 1, f"={cell_mat_cost}+{cell_galv_cost}+{cell_paint_mat_cost}+{cell_weld_cost}+{cell_paint_cost}", fmt_money)
-                            cell_base_cost = f"B{row_summary+9}"
-
-                            # 9. Overhead
-                            worksheet.write(row_summary+9, 0, "Overhead & Profit (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+9, 1, f"={cell_base_cost}*({cell_rate_oh}/100)", fmt_money)
-                            cell_oh_amt = f"B{row_summary+10}"
-
-                            # 10. Risk
-                            worksheet.write(row_summary+10, 0, "Risk Contingency (¥)", fmt_label)
-                            worksheet.write_formula(row_summary+10, 1, f"={cell_base_cost}*({cell_rate_risk}/100)", fmt_money)
-                            cell_risk_amt = f"B{row_summary+11}"
-
-                            # 11. QUOTATION PRICE
-                            worksheet.write(row_summary+11, 0, "QUOTATION PRICE (御見積金額)", fmt_header)
-                            worksheet.write_formula(row_summary+11, 1, f"={cell_base_cost}+{cell_oh_amt}+{cell_risk_amt}", fmt_money_bold)
-
-                            # Column Layout
-                            worksheet.set_column('A:B', 30)
-                            worksheet.set_column('C:G', 10)
-                            worksheet.set_column('H:J', 15)
-                            worksheet.set_column('K:K', 12)
-                            worksheet.set_column('L:L', 2)
-
-                        return output.getvalue()
-
                     # Settings Dict
-                    settings = {
-                        'galv_price': price_galv_process,
-                        'rate_weld': labor_rate_weld,
-                        'rate_paint': labor_rate_paint,
-                        'price_paint_mat': price_paint_mat,
-                        'time_weld': float(f"{weld_time_h:.1f}"),
-                        'time_paint': float(f"{paint_time_h:.1f}"),
-                        'rate_oh': overhead_rate,
-                        'rate_risk': contingency_rate
-                    }
-                    excel_data = generate_report_excel(pattern.get('pattern_name'), final_df, settings)
+                    settings = logic.report_settings(costs, rates)
+                    # Built when clicked, then kept in the session store until the inputs change
+                    report_key = session_store.content_hash(final_df, pattern.get('pattern_name'), sorted(settings.items()))
+                    excel_data = partial(store.memoize, f"report_{i}", report_key,
+                                         partial(reports.generate_report_excel, pattern.get('pattern_name'), final_df, settings))
                     
                     st.download_button(
                         label="📄 Generate Official Report (Excel with Formulas)",
@@ -741,73 +785,87 @@ if uploaded_file:
                     )
 
                     # 3D
-                    with st.expander("Show 3D Preview", expanded=True):
-                        try:
-                            fig_3d = visualizer.generate_3d_preview(final_df, title=f"AxelOn Digital Twin: {pattern.get('pattern_name')}")
-                            st.plotly_chart(fig_3d, use_container_width=True, key=f"3d_{i}")
-                        except Exception as e:
-                            st.error(f"3D Error: {e}")
+                    # Plotly is loaded and the figure built only while the expander is open
+                    preview_3d = st.expander("Show 3D Preview", expanded=False, key=f"show_3d_{i}", on_change="rerun")
+                    if preview_3d.open:
+                        with preview_3d:
+                            try:
+                                import visualizer
+                                title_3d = f"AxelOn Digital Twin: {pattern.get('pattern_name')}"
+                                fig_3d = cached_3d_preview(visualizer.geometry_hash(final_df, title_3d, fast_3d), title_3d, fast_3d, final_df)
+                                st.plotly_chart(fig_3d, use_container_width=True, key=f"3d_{i}")
+                            except Exception as e:
+                                st.error(f"3D Error: {e}")
 
             # Totals Section
-            st.divider()
-            st.subheader("🏁 Total Project Summary (全体集計)")
-            t1, t2 = st.columns(2)
-            t1.metric("Total Project Weight", f"{total_project_weight:,.2f} kg")
-            t2.metric("Total Project Area", f"{total_project_area:,.2f} m²")
+            with summary_area:
+                st.divider()
+                st.subheader("🏁 Total Project Summary (全体集計)")
+                t1, t2 = st.columns(2)
+                t1.metric("Total Project Weight", f"{total_project_weight:,.2f} kg")
+                t2.metric("Total Project Area", f"{total_project_area:,.2f} m²")
+                n_rows = proj.row_count()
+                n_parts = proj.unique_parts()
+                st.caption(f"{n_rows} component rows / {n_parts} unique parts (共通部材は1回のみ計算)")
+
+                if cut_plans:
+                    cut_rows = cutting.summary(cut_plans)
+                    cut_mm = sum(p["cut_mm"] for p in cut_plans.values())
+                    bought_mm = sum(p["purchased_mm"] for p in cut_plans.values())
+                    with st.expander(f"✂️ Pipe Cutting Plan (鋼管切断計画): yield {100 * cut_mm / max(bought_mm, 1):.1f}%, "
+                                     f"offcut {sum(r['Offcut (kg)'] for r in cut_rows):,.1f} kg", expanded=False):
+                        st.dataframe(pd.DataFrame(cut_rows), hide_index=True, use_container_width=True)
+                        st.caption("Cutting list (切断リスト): identical bars merged. Pole quantities from the site view are included.")
+                        st.dataframe(pd.DataFrame(cutting.cutting_list(cut_plans)), hide_index=True, use_container_width=True)
+
+                if nest_plans:
+                    nest_rows = nesting.summary(nest_plans)
+                    net_kg = sum(r["Net (kg)"] for r in nest_rows)
+                    gross_kg = sum(r["Gross (kg)"] for r in nest_rows)
+                    n_sheets = sum(len(p["sheets"]) for p in nest_plans.values())
+                    with st.expander(f"🧩 Plate Nesting (鋼板板取り): {n_sheets} sheets, utilization {100 * net_kg / max(gross_kg, 1e-9):.1f}%, "
+                                     f"gross {gross_kg:,.1f} kg", expanded=False):
+                        st.dataframe(pd.DataFrame(nest_rows), hide_index=True, use_container_width=True)
+                        st.caption("Sheet list (板取りリスト): identical layouts merged; ribs are paired on the diagonal. "
+                                   "Oversize parts are bought cut to size.")
+                        st.dataframe(pd.DataFrame(nesting.sheet_list(nest_plans)), hide_index=True, use_container_width=True)
 
             # 5. Export
             st.subheader("4. Export (出力)")
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                for p_name, final_df in final_dfs_for_export.items():
-                    # Clean sheet name
-                    sheet_name = "".join([c for c in p_name if c.isalnum() or c in (' ','_','-')])[:30]
-                    
-                    excel_cols = [
-                        "type", "name", 
-                        "diameter_mm", "thickness_mm", "length_mm", "width_mm", 
-                        "count", "overlap_count", 
-                        "Unit Weight (kg)", "Total Weight (kg)", 
-                        "Material Unit Price (¥/kg)", "Material Cost (¥)",
-                        "Surface Area (m²)", "notes"
-                    ]
-                    valid_cols = [c for c in excel_cols if c in final_df.columns]
-                    export_df = final_df[valid_cols].copy()
-                    
-                    export_df.to_excel(writer, index=False, sheet_name=sheet_name)
-                    # (Simplified export without formulas for multi-sheet robustness, or we repeat formula logic)
-                    # Users prefer formulas, let's keep it if possible but it complicates the loop.
-                    # Start simplistic: Value only for now as formula injection is complex in loop without careful idx tracking.
-                    # Or reuse the formula logic? 
-                    # Let's add simple formulas if we can.
-                    
-                    worksheet = writer.sheets[sheet_name]
-                    for r_idx, row in enumerate(export_df.itertuples(), start=2):
-                        # Simple value fill already done by to_excel. 
-                        # Overwrite columns J, K, L with Formulas if we want.
-                        # For robustness in this refactor, I will SKIP complex formula injection to ensure stability first.
-                        pass
-
+            export_key = session_store.content_hash(*[x for item in final_dfs_for_export.items() for x in item])
             st.download_button(
                 label="📥 Download Excel Report (Multi-Sheet)",
-                data=output.getvalue(),
+                data=partial(store.memoize, "export_workbook", export_key, partial(reports.export_workbook, dict(final_dfs_for_export))),
                 file_name="steel_pole_estimation.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
+            mem = store.stats()
+            st.caption(f"Session memory (セッションメモリ): {mem['memory_bytes'] / 2**20:,.1f} MB in memory, "
+                       f"{mem['disk_bytes'] / 2**20:,.1f} MB on disk / budget {mem['budget_bytes'] / 2**20:,.0f} MB")
 
             # 6. Asset Management
             st.divider()
             with st.expander("💾 Save to Digital Archive", expanded=False):
                 col_save1, col_save2 = st.columns([2, 1])
                 project_name = col_save1.text_input("Project Name (案件名)", value="Project_Alpha_01")
+                customer_name = col_save1.text_input("Customer (顧客)", value="")
                 import json
                 from datetime import datetime
+                # Purchased / net weight per stored row, so re-pricing charges what was bought
+                factors = [purchase_factors(p.frame()) for p in proj]
                 save_data = {
-                    "meta": { "project_name": project_name, "created_at": datetime.now().isoformat(), "version": "2.0" },
-                    "patterns": st.session_state.extracted_data,
-                    "metrics": { "total_weight": total_project_weight, "total_area": total_project_area }
+                    "meta": { "project_name": project_name, "customer": customer_name, "created_at": datetime.now().isoformat(), "version": "2.0",
+                              "page_hashes": st.session_state.get("page_hashes", []) },
+                    # Shared parts are stored once; components refer to them by key
+                    **parts.pack_patterns(proj.to_patterns()),
+                    "metrics": { "total_weight": total_project_weight, "total_area": total_project_area },
+                    # Price-book version, the rates actually used and the purchase factors, for later re-pricing (pricebook.reprice)
+                    "pricing": dict(price_version.stamp(rates),
+                                    purchase_factors=[None if f is None else np.round(f, 6).tolist() for f in factors]),
                 }
-                st.download_button("💾 Save Asset (JSON)", json.dumps(save_data, indent=2, ensure_ascii=False), f"{project_name}_asset.json", "application/json")
+                # Saving also records the estimate in the analytics store (when pyarrow is installed)
+                st.download_button("💾 Save Asset (JSON)", json.dumps(save_data, indent=2, ensure_ascii=False), f"{project_name}_asset.json", "application/json",
+                                   on_click=record_estimate, args=(project_name, customer_name, list(estimate_frames)))
 else:
     st.info("Please upload a drawing to start.")
 
@@ -0,0 +1,198 @@
+# backends.py
+# Analysis Backends (解析バックエンド)
+# analyze_drawing() talks to one of these instead of calling Gemini directly,
+# so the analysis path can be exercised offline (replay / synthetic load).
+import os
+import glob
+import json
+import time
+import random
+import threading
+from datetime import datetime
+
+MODEL_FAST = "gemini-flash-latest"
+MODEL_ACCURATE = "gemini-pro-latest"
+
+class BackendError(Exception):
+    """Raised by a backend when the (real or simulated) model call fails."""
+
+class GeminiBackend:
+    """Live Google Gemini backend."""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key.strip()
+
+    def generate(self, input_data: list, model_name: str = MODEL_FAST) -> str:
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        model = genai.GenerativeModel(model_name)
+        response = model.generate_content(input_data)
+        return response.text
+
+class ReplayBackend:
+    """
+    Local stand-in for Gemini that replays recorded responses round-robin.
+    Injects configurable latency, errors and truncated output.
+    """
+
+    def __init__(self, responses=None, replay_dir=None, latency_s=0.0, jitter_s=0.0,
+                 error_rate=0.0, truncate_rate=0.0, seed=None):
+        self.responses = list(responses or [])
+        if replay_dir:
+            self.responses += load_recordings(replay_dir)
+        if not self.responses:
+            raise ValueError("ReplayBackend needs at least one recorded response.")
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, input_data: list, model_name: str = MODEL_FAST) -> str:
+        with self._lock:
+            text = self.responses[self.calls % len(self.responses)]
+            self.calls += 1
+            delay = self.latency_s + self._rng.uniform(0, self.jitter_s)
+            fail = self._rng.random() < self.error_rate
+            cut = self._rng.random() < self.truncate_rate
+            cut_at = self._rng.randint(1, max(1, len(text) - 1))
+
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise BackendError("Simulated backend error (503 Service Unavailable)")
+        if cut:
+            return text[:cut_at]
+        return text
+
+class SyntheticBackend(ReplayBackend):
+    """Replay backend whose responses are synthesized pattern sets of a given size."""
+
+    def __init__(self, n_patterns=2, components_per_pattern=6, check_density=0.0,
+                 variants=1, seed=None, **kwargs):
+        rng = random.Random(seed)
+        responses = [
+            json.dumps(synthesize_patterns(n_patterns, components_per_pattern, check_density, rng.random()), ensure_ascii=False)
+            for _ in range(variants)
+        ]
+        super().__init__(responses=responses, seed=seed, **kwargs)
+
+class RecordingBackend:
+    """Wraps another backend and saves every response text for later replay."""
+
+    def __init__(self, inner, record_dir: str):
+        self.inner = inner
+        self.record_dir = record_dir
+        os.makedirs(record_dir, exist_ok=True)
+
+    def generate(self, input_data: list, model_name: str = MODEL_FAST) -> str:
+        text = self.inner.generate(input_data, model_name)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        with open(os.path.join(self.record_dir, f"{stamp}_{model_name}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        return text
+
+def load_recordings(replay_dir: str) -> list:
+    """Reads recorded responses (*.txt / *.json) from a directory, sorted by name."""
+    paths = sorted(glob.glob(os.path.join(replay_dir, "*.txt")) + glob.glob(os.path.join(replay_dir, "*.json")))
+    texts = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+# Typical section sizes (JIS STK pipes / plate thicknesses)
+_PIPE_SIZES = [(139.8, 4.5), (165.2, 4.5), (216.3, 4.5), (267.4, 6.0), (318.5, 6.0), (355.6, 6.4), (406.4, 9.0)]
+_PLATE_THK = [9.0, 12.0, 16.0, 19.0, 22.0, 25.0, 28.0, 32.0]
+
+def synthesize_patterns(n_patterns=2, components_per_pattern=6, check_density=0.0, seed=None,
+                        max_sections=3, rib_rows=1) -> dict:
+    """
+    Generates a raw model-style response: {"patterns": [...]}.
+    check_density is the probability that any dimension is replaced with 0 or "CHECK"
+    (with a matching validation alert), mimicking unclear drawings.
+    max_sections: pole sections per pattern (each joint is an overlap connection);
+    rib_rows: rib plate rows per pattern.
+    """
+    rng = random.Random(seed)
+    patterns = []
+    for p in range(n_patterns):
+        alerts = []
+        components = []
+        n_sections = rng.randint(1, max(1, min(max_sections, len(_PIPE_SIZES))))
+        sizes = sorted(rng.sample(_PIPE_SIZES, n_sections), reverse=True)
+        for s, (d, t) in enumerate(sizes):
+            components.append({
+                "type": "Pipe", "name": f"Pole Section {s + 1}",
+                "diameter_mm": d, "thickness_mm": t,
+                "length_mm": rng.choice([3000, 4000, 4500, 5500, 6000]), "width_mm": 0,
+                "count": 1, "notes": "Overlap connection" if s < n_sections - 1 else "",
+            })
+        base = rng.choice([400, 500, 600, 700])
+        components.append({
+            "type": "Plate", "name": "Base Plate", "diameter_mm": 0,
+            "thickness_mm": rng.choice(_PLATE_THK[3:]), "length_mm": base, "width_mm": base,
+            "count": 1, "notes": "Base Detail",
+        })
+        for r in range(rib_rows):
+            components.append({
+                "type": "Plate", "name": "Standard Rib" if r == 0 else f"Rib {r + 1}", "diameter_mm": 0,
+                "thickness_mm": rng.choice(_PLATE_THK[:3]), "length_mm": rng.choice([150, 200, 250]),
+                "width_mm": rng.choice([80, 100, 120]), "count": rng.choice([4, 8]), "notes": "",
+            })
+        while len(components) < components_per_pattern:
+            k = len(components)
+            if rng.random() < 0.5:
+                d, t = rng.choice(_PIPE_SIZES[:3])
+                components.append({"type": "Pipe", "name": f"Arm {k}", "diameter_mm": d, "thickness_mm": t,
+                                   "length_mm": rng.randint(8, 40) * 100, "width_mm": 0, "count": rng.randint(1, 2), "notes": ""})
+            else:
+                components.append({"type": "Plate", "name": f"Bracket PL {k}", "diameter_mm": 0,
+                                   "thickness_mm": rng.choice(_PLATE_THK), "length_mm": rng.randint(2, 12) * 50,
+                                   "width_mm": rng.randint(2, 8) * 50, "count": rng.randint(1, 6), "notes": ""})
+        components = components[:components_per_pattern]
+
+        if check_density > 0:
+            for c in components:
+                for field in ("diameter_mm", "thickness_mm", "length_mm", "width_mm"):
+                    if c[field] and rng.random() < check_density:
+                        c[field] = rng.choice([0, "CHECK"])
+                        alerts.append(f"{c['name']}: {field} unclear")
+                # Model output sometimes carries comma-formatted numbers
+                if isinstance(c["length_mm"], int) and c["length_mm"] >= 1000 and rng.random() < check_density:
+                    c["length_mm"] = f"{c['length_mm']:,}"
+
+        patterns.append({"pattern_name": f"Type {p + 1}", "validation_alerts": alerts, "components": components})
+    return {"patterns": patterns}
+
+def get_backend(api_key: str = None):
+    """
+    Selects the analysis backend.
+    ESTIMATOR_BACKEND env var: "gemini" (default), "replay:<dir>", "synthetic:<patterns>x<components>"
+    Fault injection: ESTIMATOR_LATENCY_S, ESTIMATOR_ERROR_RATE, ESTIMATOR_TRUNCATE_RATE
+    ESTIMATOR_RECORD_DIR records live responses for later replay.
+    Returns None if no backend is available (no API key for Gemini).
+    """
+    spec = os.environ.get("ESTIMATOR_BACKEND", "gemini").strip()
+    faults = {
+        "latency_s": float(os.environ.get("ESTIMATOR_LATENCY_S", 0) or 0),
+        "error_rate": float(os.environ.get("ESTIMATOR_ERROR_RATE", 0) or 0),
+        "truncate_rate": float(os.environ.get("ESTIMATOR_TRUNCATE_RATE", 0) or 0),
+    }
+
+    if spec.startswith("replay:"):
+        return ReplayBackend(replay_dir=spec[len("replay:"):], **faults)
+    if spec.startswith("synthetic"):
+        size = spec.partition(":")[2] or "2x6"
+        n_p, _, n_c = size.partition("x")
+        return SyntheticBackend(int(n_p), int(n_c or 6), **faults)
+
+    if not api_key:
+        return None
+    backend = GeminiBackend(api_key)
+    record_dir = os.environ.get("ESTIMATOR_RECORD_DIR")
+    if record_dir:
+        backend = RecordingBackend(backend, record_dir)
+    return backend
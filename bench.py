@@ -0,0 +1,332 @@
+# bench.py
+# Benchmark Suite (性能ベンチマーク)
+# Times the hot paths (calculation, validation, editor pipeline, Excel reports,
+# 3D previews) on a synthetic project, records peak memory per stage and
+# compares the results against a committed baseline JSON. Cold-start costs
+# (module imports, first render of the app) are profiled in fresh interpreters.
+#
+#   python bench.py                         # run and compare with bench_baseline.json
+#   python bench.py --save-baseline         # record a new baseline
+#   python bench.py --patterns 40 --components 60 --check-density 0.1
+#   python bench.py --only import           # cold-start profile only
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+import backends
+import schema
+import logic
+import model
+import reports
+import visualizer
+import cutting
+import nesting
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "bench_baseline.json")
+DEFAULT_TOLERANCE = 0.30   # Allowed slowdown / memory growth vs. the baseline (fraction)
+MIN_SECONDS = 0.005        # Faster stages are too noisy to flag
+
+# App defaults (sidebar) used for the cost / report stages; rates: logic.DEFAULT_RATES
+POLE_QUANTITY = 10   # Poles per pattern for the cutting-stock / nesting stages (thousands of pieces)
+SETTINGS = {"galv_price": 85, "rate_weld": 4244, "rate_paint": 12530, "price_paint_mat": 1700,
+            "time_weld": 1.0, "time_paint": 1.0, "rate_oh": 20, "rate_risk": 5}
+
+# Cold imports profiled with python -X importtime (each in a fresh interpreter)
+IMPORT_MODULES = ("streamlit", "pandas", "logic", "model", "reports", "quality", "preview",
+                  "ai_analysis", "visualizer", "streamlit_pdf_viewer", "google.generativeai")
+# Heavy modules that should not be loaded by the login / start page of app.py
+LAZY_MODULES = ("numpy", "PIL.Image", "pandas", "google.generativeai", "streamlit_pdf_viewer", "visualizer", "ai_analysis")
+APP_PASSWORD = "yp2026"
+
+_APP_COLD_START = r'''
+import sys, json, time, logging, warnings
+warnings.simplefilter("ignore")
+logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=300)
+start = time.perf_counter()
+at.run()
+login = time.perf_counter() - start
+loaded_login = [m for m in sys.argv[3:] if m in sys.modules]
+at.text_input[0].input(sys.argv[2])
+at.button[0].click()
+start = time.perf_counter()
+at.run()
+main = time.perf_counter() - start
+print(json.dumps({"login": login, "start": main, "loaded_login": loaded_login,
+                  "loaded_start": [m for m in sys.argv[3:] if m in sys.modules]}))
+'''
+
+def parse_importtime(stderr: str) -> list:
+    """(module, depth, self s, cumulative s) rows of python -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(self_us) / 1e6, int(cum_us) / 1e6))
+    return rows
+
+def import_profile(module: str, repeat: int = 3, top: int = 5) -> dict:
+    """Best-of-repeat cold import time of a module, with its slowest direct dependencies."""
+    best = None
+    for _ in range(max(1, repeat)):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=HERE, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": (proc.stderr.strip().splitlines() or ["import failed"])[-1]}
+        rows = parse_importtime(proc.stderr)
+        # The module and its parent packages; interpreter startup imports are left out
+        total = sum(cum for name, depth, _, cum in rows
+                    if depth == 0 and (name == module or module.startswith(name + ".")))
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    # Children of the module itself (depth 1 directly above its depth-0 line)
+    children = []
+    for name, depth, _, cum in reversed(rows):
+        if depth == 0 and children:
+            break
+        if depth == 1:
+            children.append((name, round(cum, 4)))
+    children.sort(key=lambda c: -c[1])
+    return {"seconds": round(total, 4), "top": children[:top]}
+
+def app_cold_start(repeat: int = 3) -> dict:
+    """First render of the login page and of the start page after login, in fresh interpreters."""
+    best = None
+    for _ in range(max(1, repeat)):
+        proc = subprocess.run([sys.executable, "-c", _APP_COLD_START, os.path.join(HERE, "app.py"),
+                               APP_PASSWORD, *LAZY_MODULES], cwd=HERE, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": (proc.stderr.strip().splitlines() or ["app run failed"])[-1]}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if best is None or result["login"] + result["start"] < best["login"] + best["start"]:
+            best = result
+    return best
+
+def _print_cold(name: str, entry: dict):
+    if "error" in entry:
+        print(f"  {name:<34} {'failed':>11}    {entry['error']}", flush=True)
+        return
+    if "loaded" in entry:
+        detail = "loaded: " + (", ".join(entry["loaded"]) or "-")
+    else:
+        detail = ", ".join(f"{m} {t:.3f}" for m, t in entry["top"])
+    print(f"  {name:<34} {entry['seconds']:>9.4f} s    {detail}", flush=True)
+
+def cold_start(repeat: int = 3, only: str = None) -> dict:
+    """Import profiles and first app renders as {name: {"seconds", ...}}."""
+    results = {}
+    for module in IMPORT_MODULES:
+        name = f"import {module}"
+        if not only or only in name:
+            results[name] = import_profile(module, repeat)
+            _print_cold(name, results[name])
+    app_names = ("app login page (cold)", "app start page (cold)")
+    if not only or any(only in n for n in app_names):
+        app = app_cold_start(repeat)
+        for name, key in zip(app_names, ("login", "start")):
+            results[name] = app if "error" in app else {"seconds": round(app[key], 4), "loaded": app[f"loaded_{key}"]}
+            _print_cold(name, results[name])
+    return results
+
+def synthetic_project(patterns: int = 20, components: int = 40, check_density: float = 0.05,
+                      max_sections: int = 3, rib_rows: int = 1, seed: int = 7) -> list:
+    """Normalized pattern dicts from backends.synthesize_patterns."""
+    raw = backends.synthesize_patterns(patterns, components, check_density, seed=seed,
+                                       max_sections=max_sections, rib_rows=rib_rows)
+    return schema.normalize_patterns(raw["patterns"])
+
+def editor_pipeline(df: pd.DataFrame) -> tuple:
+    """
+    What app.py does per pattern on every rerun: validate, sort, calculate, cost.
+    Returns (priced table, logic.cost_breakdown).
+    """
+    df = df.copy()
+    df["type"] = df["type"].astype(str)
+    df["name"] = df["name"].astype(str)
+    df = logic.validate_frame(df, *logic.rib_context_frame(df)).sort_values(by="_priority")
+    final_df = logic.calculate_frame(logic.calculate_frame(df))   # Before and after the data editor
+    rates = logic.DEFAULT_RATES
+    final_df = model.exact(logic.price_frame(final_df, rates["pipe_price"], rates["plate_price"]))
+    return final_df, logic.cost_breakdown(final_df, rates)
+
+def stages(patterns: list, preview_patterns: int = 5) -> list:
+    """
+    [(name, callable)] of the benchmarked stages. Inputs are prepared here so each
+    stage measures only its own work.
+    """
+    project = model.Project.from_patterns(patterns)
+    frames = [p.frame() for p in project]
+    combined = pd.concat(frames, ignore_index=True)
+    groups = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+    finals = {p["pattern_name"]: editor_pipeline(f)[0] for p, f in zip(patterns, frames)}
+    previews = frames[:preview_patterns]
+    calculated = [logic.calculate_frame(f) for f in frames]
+
+    def validate_groups():
+        logic.validate_frame(combined, *logic.rib_context_groups(combined, groups))
+
+    def calculate_frames():
+        for f in frames:
+            logic.calculate_frame(f)
+
+    def validate_frames():
+        for f in frames:
+            logic.validate_frame(f, *logic.rib_context_frame(f))
+
+    def pipeline():
+        for f in frames:
+            editor_pipeline(f)
+
+    def report_excel():
+        for name, df in finals.items():
+            reports.generate_report_excel(name, df, SETTINGS)
+
+    def export():
+        reports.export_workbook(finals)
+
+    def cut_plan():
+        cutting.optimize(cutting.collect_pieces(calculated, [POLE_QUANTITY] * len(calculated)))
+
+    def nest_plan():
+        nesting.optimize(nesting.collect_pieces(calculated, [POLE_QUANTITY] * len(calculated)))
+
+    def preview_3d():
+        for n, f in enumerate(previews):
+            visualizer.compact_figure(visualizer.generate_3d_preview(f.copy(), title=f"Bench {n}"))
+
+    def site_view():
+        visualizer.compact_figure(visualizer.generate_site_view(patterns))
+
+    return [
+        ("model.from_patterns", lambda: model.Project.from_patterns(patterns)),
+        ("logic.calculate_frame", calculate_frames),
+        ("logic.validate_frame", validate_frames),
+        ("logic.validate_frame (groups)", validate_groups),
+        ("editor pipeline", pipeline),
+        ("reports.generate_report_excel", report_excel),
+        ("reports.export_workbook", export),
+        ("cutting.optimize", cut_plan),
+        ("nesting.optimize", nest_plan),
+        ("visualizer.generate_3d_preview", preview_3d),
+        ("visualizer.generate_site_view", site_view),
+    ]
+
+def measure(fn, repeat: int = 3) -> dict:
+    """Best-of-repeat wall time, then one traced run for peak Python memory."""
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(min(times), 4), "median_s": round(float(np.median(times)), 4),
+            "peak_mb": round(peak / 2**20, 2)}
+
+def run(config: dict, repeat: int = 3, only: str = None, cold: bool = True) -> dict:
+    patterns = synthetic_project(config["patterns"], config["components"], config["check_density"],
+                                 config["max_sections"], config["rib_rows"], config["seed"])
+    results = {}
+    for name, fn in stages(patterns, config["preview_patterns"]):
+        if only and only not in name:
+            continue
+        results[name] = measure(fn, repeat)
+        print(f"  {name:<34} {results[name]['seconds']:>9.4f} s  {results[name]['peak_mb']:>8.2f} MB", flush=True)
+    if cold:
+        print("Cold start (fresh interpreters):")
+    return {
+        "config": config,
+        "rows": sum(len(p["components"]) for p in patterns),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                        "machine": platform.machine()},
+        "stages": results,
+        "cold_start": cold_start(repeat, only) if cold else {},
+    }
+
+def compare(result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """Regressions as (stage, metric, baseline value, current value)."""
+    regressions = []
+    for name, current in result["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if current["seconds"] >= MIN_SECONDS and current["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append((name, "seconds", base["seconds"], current["seconds"]))
+        if current["peak_mb"] > max(base["peak_mb"], 1.0) * (1 + tolerance):
+            regressions.append((name, "peak_mb", base["peak_mb"], current["peak_mb"]))
+    for name, current in result.get("cold_start", {}).items():
+        base = baseline.get("cold_start", {}).get(name)
+        if not base or "error" in base or "error" in current:
+            continue
+        if current["seconds"] >= MIN_SECONDS and current["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append((name, "seconds", base["seconds"], current["seconds"]))
+        eager = sorted(set(current.get("loaded", [])) - set(base.get("loaded", [])))
+        if eager:   # A heavy module is imported before it is needed again
+            regressions.append((name, "loaded", base.get("loaded", []), eager))
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Steel pole estimator benchmarks")
+    parser.add_argument("--patterns", type=int, default=20)
+    parser.add_argument("--components", type=int, default=40, help="Components per pattern")
+    parser.add_argument("--check-density", type=float, default=0.05, help="Share of dimensions replaced by 0 / CHECK")
+    parser.add_argument("--max-sections", type=int, default=3, help="Pole sections per pattern (joints overlap)")
+    parser.add_argument("--rib-rows", type=int, default=1, help="Rib plate rows per pattern")
+    parser.add_argument("--preview-patterns", type=int, default=5, help="Patterns rendered by the 3D preview stage")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="Run only stages whose name contains this text")
+    parser.add_argument("--no-cold-start", action="store_true", help="Skip the import / first-render profile")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    config = {"patterns": args.patterns, "components": args.components, "check_density": args.check_density,
+              "max_sections": args.max_sections, "rib_rows": args.rib_rows,
+              "preview_patterns": args.preview_patterns, "seed": args.seed}
+    print(f"Synthetic project: {args.patterns} patterns x {args.components} components "
+          f"(check density {args.check_density}, best of {args.repeat})")
+    result = run(config, args.repeat, args.only, cold=not args.no_cold_start)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with (run with --save-baseline).")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("Note: baseline was recorded with a different configuration; comparison is indicative only.")
+    regressions = compare(result, baseline, args.tolerance)
+    for name, metric, before, after in regressions:
+        print(f"REGRESSION {name}: {metric} {before} -> {after} (> {args.tolerance:.0%} tolerance)")
+    if not regressions:
+        print(f"OK: no stage regressed by more than {args.tolerance:.0%}.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
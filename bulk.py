@@ -0,0 +1,141 @@
+# bulk.py
+# Bulk Drawing-Package Ingestion (図面パッケージ一括取込)
+# Streams drawings out of ZIPs / multi-file uploads and pipelines
+# decode -> preprocess -> analysis (bounded concurrency) -> validation -> costing.
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from PIL import Image
+import logic
+
+DRAWING_EXTENSIONS = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".pdf": "application/pdf"}
+MAX_IMAGE_PX = 4096   # Larger scans are downscaled before upload (model input is resized anyway)
+
+class DrawingFile(io.BytesIO):
+    """In-memory stand-in for a Streamlit UploadedFile (name / type / getvalue)."""
+
+    def __init__(self, data: bytes, name: str, mime_type: str):
+        super().__init__(data)
+        self.name = name
+        self.type = mime_type
+        self.size = len(data)
+
+def iter_entries(files):
+    """
+    Yields (name, mime_type, read) for every drawing in the uploads.
+    ZIP members are read lazily by read() one at a time, never extracted all at once.
+    """
+    for f in files:
+        name = getattr(f, "name", "upload")
+        ext = os.path.splitext(name)[1].lower()
+        if ext == ".zip":
+            f.seek(0)
+            archive = zipfile.ZipFile(f)
+            for info in archive.infolist():
+                member_ext = os.path.splitext(info.filename)[1].lower()
+                base = os.path.basename(info.filename)
+                if info.is_dir() or member_ext not in DRAWING_EXTENSIONS or base.startswith(".") or "__MACOSX" in info.filename:
+                    continue
+                yield info.filename, DRAWING_EXTENSIONS[member_ext], (lambda a=archive, i=info: a.read(i))
+        elif ext in DRAWING_EXTENSIONS:
+            yield name, DRAWING_EXTENSIONS[ext], f.getvalue
+
+def decode(name: str, mime_type: str, data: bytes):
+    """PDFs stay as file objects; images are decoded with PIL."""
+    if mime_type == "application/pdf":
+        return DrawingFile(data, name, mime_type)
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+def preprocess(drawing):
+    """Normalizes images (RGB, bounded size) before the analysis call."""
+    if not isinstance(drawing, Image.Image):
+        return drawing
+    if drawing.mode not in ("RGB", "L"):
+        drawing = drawing.convert("RGB")
+    if max(drawing.size) > MAX_IMAGE_PX:
+        drawing = drawing.copy()
+        drawing.thumbnail((MAX_IMAGE_PX, MAX_IMAGE_PX))
+    return drawing
+
+def validate(patterns: list) -> int:
+    """Number of rows that still need checking (uncertain values or alerts)."""
+    flagged = 0
+    for p in patterns:
+        flagged += len(p.get("validation_alerts", []))
+        flagged += sum(1 for c in p.get("components", []) if c.get("_uncertain"))
+    return flagged
+
+def cost(patterns: list) -> tuple:
+    """Total (weight kg, surface area m²) of the patterns (logic.calculate_frame, as in the app)."""
+    weight = area = 0.0
+    for p in patterns:
+        components = p.get("components", [])
+        if not components:
+            continue
+        df = logic.calculate_frame(pd.DataFrame(components))
+        weight += float(df["Total Weight (kg)"].sum())
+        area += float(df["Surface Area (m²)"].sum())
+    return round(weight, 2), round(area, 2)
+
+def process_entry(name: str, mime_type: str, data: bytes, analyze, gate=None) -> dict:
+    """
+    Runs one drawing through the full pipeline. Never raises; errors are reported per file.
+    gate: optional callable(data, mime_type) -> (level, reasons); "block" skips the analysis.
+    """
+    result = {"file": name, "status": "ok", "patterns": [], "checks": 0, "weight_kg": 0.0, "area_m2": 0.0, "seconds": 0.0, "error": ""}
+    start = time.perf_counter()
+    try:
+        if gate is not None:
+            level, reasons = gate(data, mime_type)
+            if level == "block":
+                result["status"] = "blocked"
+                result["error"] = "; ".join(reasons)
+                result["seconds"] = round(time.perf_counter() - start, 2)
+                return result
+        drawing = preprocess(decode(name, mime_type, data))
+        patterns = analyze(drawing)
+        if not patterns:
+            result["status"] = "empty"
+        stem = os.path.splitext(os.path.basename(name))[0]
+        for p in patterns:
+            p["pattern_name"] = f"{stem}: {p['pattern_name']}"
+            p["source_file"] = name
+        result["patterns"] = patterns
+        result["checks"] = validate(patterns)
+        result["weight_kg"], result["area_m2"] = cost(patterns)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    return result
+
+def run_pipeline(files, analyze, max_workers: int = 4, gate=None):
+    """
+    Generator yielding one result dict per drawing as soon as it finishes.
+    At most max_workers analyses run at once, and at most 2 x max_workers
+    drawings are held in memory (entries are read only when a slot frees up).
+    analyze: callable(drawing) -> normalized patterns
+    gate: optional quality gate, see process_entry
+    """
+    max_workers = max(1, int(max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        for name, mime_type, read in iter_entries(files):
+            while len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(process_entry, name, mime_type, read(), analyze, gate))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def count_entries(files) -> int:
+    """Number of drawings in the uploads (reads only ZIP directories)."""
+    return sum(1 for _ in iter_entries(files))
@@ -0,0 +1,209 @@
+# cutting.py
+# Pipe Cutting-Stock Optimizer (鋼管定尺材の切断計画)
+# Pipe rows of all patterns are grouped by (diameter, thickness) and cut from
+# standard mill lengths: best-fit decreasing first, then the most wasteful bars
+# are re-planned by a bounded exact search. The purchased / net length ratio of
+# each group feeds the material cost (logic.price_frame).
+import math
+from bisect import bisect_left
+import numpy as np
+import logic
+
+DEFAULT_STOCK_LENGTHS_MM = (6000, 9000, 12000)
+DEFAULT_KERF_MM = 3.0
+EXACT_MAX_PIECES = 40      # Pieces of the worst bars re-planned by the exact search (per group)
+EXACT_MAX_NODES = 5000     # Search budget per group; the best plan found so far is kept
+OVERLAP_MM = logic.OVERLAP_CORRECTION_M * 1000
+
+def parse_lengths(text: str) -> tuple:
+    """Stock lengths from text like "6000, 9000 12000" (mm, sorted, unique). Raises ValueError."""
+    values = [v for v in text.replace(",", " ").replace("、", " ").split() if v]
+    lengths = sorted({int(round(float(v))) for v in values})
+    if not lengths or lengths[0] <= 0:
+        raise ValueError("Enter at least one positive stock length (mm).")
+    return tuple(lengths)
+
+def group_keys(df) -> list:
+    """(diameter, thickness) group of every row, rounded to 0.1 mm."""
+    d = logic.column_values(df, "diameter_mm")
+    t = logic.column_values(df, "thickness_mm")
+    return [(round(a, 1), round(b, 1)) for a, b in zip(d.tolist(), t.tolist())]
+
+def collect_pieces(frames: list, quantities: list = None) -> dict:
+    """
+    {(diameter, thickness): [cut length mm, ...]} of the pipe rows of calculated tables.
+    Lengths include the overlap allowance (logic.OVERLAP_CORRECTION_M per joint);
+    each row is cut count x pattern quantity times.
+    """
+    pieces = {}
+    for n, df in enumerate(frames):
+        quantity = 1 if quantities is None else max(0, int(quantities[n]))
+        if not quantity or not len(df):
+            continue
+        pipe = logic.pipe_mask(df)
+        d = logic.column_values(df, "diameter_mm")
+        t = logic.column_values(df, "thickness_mm")
+        length = logic.column_values(df, "length_mm") + np.trunc(logic.column_values(df, "overlap_count")) * OVERLAP_MM
+        count = np.round(logic.column_values(df, "count", default=1.0)) * quantity
+        keys = group_keys(df)
+        for j in np.flatnonzero(pipe & (d > 0) & (t > 0) & (length > 0) & (count > 0)):
+            pieces.setdefault(keys[j], []).extend([int(math.ceil(length[j]))] * int(count[j]))
+    return pieces
+
+def _best_fit(lengths: list, stock: int, kerf: int) -> list:
+    """Best-fit decreasing onto bars of one stock length. Returns [[piece, ...], ...]."""
+    cap = stock + kerf     # n pieces on a bar need sum + (n - 1) x kerf <= stock
+    bars = []
+    rems, ids = [], []     # Remaining capacity of the open bars, sorted, with their bar index
+    for piece in sorted(lengths, reverse=True):
+        need = piece + kerf
+        k = bisect_left(rems, need)
+        if k < len(rems):
+            rem, b = rems.pop(k), ids.pop(k)
+            bars[b].append(piece)
+        else:
+            rem, b = cap, len(bars)
+            bars.append([piece])
+        rem -= need
+        k = bisect_left(rems, rem)
+        rems.insert(k, rem)
+        ids.insert(k, b)
+    return bars
+
+def _used(bar: list, kerf: int) -> int:
+    return sum(bar) + kerf * (len(bar) - 1)
+
+def _smallest_stock(bar: list, stocks: tuple, kerf: int) -> int:
+    used = _used(bar, kerf)
+    return stocks[bisect_left(stocks, used)]
+
+class _Budget(Exception):
+    pass
+
+def _exact(lengths: list, stocks: tuple, kerf: int, limit: int, max_nodes: int):
+    """
+    Branch-and-bound over bar assignments minimizing purchased length.
+    Returns [(stock, [pieces])] cheaper than limit, or None.
+    """
+    pieces = sorted(lengths, reverse=True)
+    need = [p + kerf for p in pieces]
+    suffix = np.cumsum(need[::-1])[::-1].tolist() + [0]
+    caps = [s + kerf for s in stocks]
+    per_mm = min(s / c for s, c in zip(stocks, caps))   # Cheapest purchase per mm of capacity
+    best = {"cost": limit, "bars": None}
+    bars = []        # [stock index, remaining capacity, pieces]
+    nodes = [0]
+
+    def search(k: int, cost: int):
+        nodes[0] += 1
+        if nodes[0] > max_nodes:
+            raise _Budget
+        if k == len(pieces):
+            if cost < best["cost"]:
+                best["cost"] = cost
+                best["bars"] = [(stocks[s], list(p)) for s, _, p in bars]
+            return
+        free = sum(b[1] for b in bars)
+        if cost + max(0.0, suffix[k] - free) * per_mm >= best["cost"]:
+            return
+        tried = set()
+        for bar in bars:
+            if bar[1] >= need[k] and bar[1] not in tried:
+                tried.add(bar[1])
+                bar[1] -= need[k]
+                bar[2].append(pieces[k])
+                search(k + 1, cost)
+                bar[2].pop()
+                bar[1] += need[k]
+        for s, cap in enumerate(caps):
+            if cap >= need[k]:
+                bars.append([s, cap - need[k], [pieces[k]]])
+                search(k + 1, cost + stocks[s])
+                bars.pop()
+
+    try:
+        search(0, 0)
+    except _Budget:
+        pass
+    return best["bars"]
+
+def plan_group(lengths: list, stock_lengths=DEFAULT_STOCK_LENGTHS_MM, kerf: float = DEFAULT_KERF_MM,
+               exact: bool = True, max_nodes: int = EXACT_MAX_NODES) -> dict:
+    """
+    Cutting plan of one (diameter, thickness) group.
+    Pieces longer than the longest stock are made of full bars plus a remainder (welded joints).
+    Returns {"bars": [(stock, [pieces])], "pieces", "joins", "kerf", "cut_mm", "purchased_mm"}.
+    """
+    stocks = tuple(sorted(int(s) for s in stock_lengths))
+    kerf = int(math.ceil(kerf))
+    longest = stocks[-1]
+    bars, rest, joins = [], [], 0
+    for piece in lengths:
+        while piece > longest:
+            bars.append((longest, [longest]))
+            piece -= longest
+            joins += 1
+        if piece > 0:
+            rest.append(piece)
+
+    packed = [(_smallest_stock(b, stocks, kerf), b) for b in _best_fit(rest, longest, kerf)]
+    if exact and len(packed) > 1:
+        # Re-plan the pieces of the bars with the most offcut
+        packed.sort(key=lambda sb: _used(sb[1], kerf) - sb[0])
+        worst = n = 0
+        while worst < len(packed) and n + len(packed[worst][1]) <= EXACT_MAX_PIECES:
+            n += len(packed[worst][1])
+            worst += 1
+        if worst > 1:
+            limit = sum(s for s, _ in packed[:worst])
+            better = _exact([p for _, b in packed[:worst] for p in b], stocks, kerf, limit, max_nodes)
+            if better:
+                packed = better + packed[worst:]
+    bars.extend(packed)
+    return {"bars": bars, "pieces": len(lengths), "joins": joins, "kerf": kerf,
+            "cut_mm": float(sum(lengths)), "purchased_mm": float(sum(s for s, _ in bars))}
+
+def optimize(pieces: dict, stock_lengths=DEFAULT_STOCK_LENGTHS_MM, kerf: float = DEFAULT_KERF_MM,
+             exact: bool = True) -> dict:
+    """{(diameter, thickness): plan_group(...)} for collect_pieces output."""
+    return {key: plan_group(lengths, stock_lengths, kerf, exact) for key, lengths in sorted(pieces.items())}
+
+def weight_per_mm(key: tuple) -> float:
+    d, t = key
+    return (d - t) * t * logic.PIPE_WEIGHT_FACTOR / 1000.0
+
+def row_factors(df, plans: dict) -> np.ndarray:
+    """Purchased / net weight of every row (1.0 for rows outside the plans, e.g. plates)."""
+    ratio = {key: p["purchased_mm"] / p["cut_mm"] for key, p in plans.items() if p["cut_mm"] > 0}
+    pipe = logic.pipe_mask(df)
+    return np.array([ratio.get(key, 1.0) if is_pipe else 1.0 for key, is_pipe in zip(group_keys(df), pipe)])
+
+def summary(plans: dict) -> list:
+    """One row per group for display: bars bought per stock length, yield and weights."""
+    rows = []
+    for key, p in plans.items():
+        stocks = {}
+        for s, _ in p["bars"]:
+            stocks[s] = stocks.get(s, 0) + 1
+        kg = weight_per_mm(key)
+        rows.append({
+            "Dia (mm)": key[0], "Thk (mm)": key[1], "Pieces": p["pieces"],
+            "Bars (定尺本数)": ", ".join(f"{s:,} mm x {n}" for s, n in sorted(stocks.items(), reverse=True)),
+            "Cut (m)": round(p["cut_mm"] / 1000, 2), "Purchased (m)": round(p["purchased_mm"] / 1000, 2),
+            "Yield (%)": round(100 * p["cut_mm"] / p["purchased_mm"], 1) if p["purchased_mm"] else 0.0,
+            "Purchased (kg)": round(p["purchased_mm"] * kg, 1),
+            "Offcut (kg)": round((p["purchased_mm"] - p["cut_mm"]) * kg, 1),
+            "Joints": p["joins"],
+        })
+    return rows
+
+def cutting_list(plans: dict) -> list:
+    """Identical bars merged: one row per (group, stock, cut pattern) with the number of bars."""
+    counts = {}
+    for key, p in plans.items():
+        for s, bar in p["bars"]:
+            cut = (key, s, tuple(sorted(bar, reverse=True)), p["kerf"])
+            counts[cut] = counts.get(cut, 0) + 1
+    return [{"Dia (mm)": key[0], "Thk (mm)": key[1], "Stock (mm)": s, "Bars": n,
+             "Cuts (mm)": " + ".join(f"{c:,}" for c in cut), "Offcut (mm)": max(0, s - _used(list(cut), kerf))}
+            for (key, s, cut, kerf), n in sorted(counts.items(), key=lambda kv: (kv[0][0], -kv[1]))]
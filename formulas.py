@@ -0,0 +1,214 @@
+# formulas.py
+# Single-Source Part Formulas (計算式の一元定義)
+# Weight, surface area and weld length of a part are defined once as small
+# expression trees. compile_numpy turns a tree into a vectorized function for the
+# app (logic.calculate_frame); excel turns it into a per-row worksheet formula for
+# the reports, with the row's fixed values (type, rib, joints) folded in, so the
+# official report recalculates to the values on screen.
+import math
+import numpy as np
+
+STEEL_DENSITY_PLATE_FACTOR = 7.85  # kg / (m * m * mm)
+PIPE_WEIGHT_FACTOR = 0.02466       # kg / (mm * mm * m) specific factor for pipes
+OVERLAP_CORRECTION_M = 0.400       # 400mm overlap correction per connection
+
+# --- Expression tree ---
+
+class Expr:
+    """Node of a formula. Arithmetic and comparison operators build new nodes."""
+    __slots__ = ()
+
+    def __add__(self, other): return Op("+", self, _wrap(other))
+    def __radd__(self, other): return Op("+", _wrap(other), self)
+    def __sub__(self, other): return Op("-", self, _wrap(other))
+    def __rsub__(self, other): return Op("-", _wrap(other), self)
+    def __mul__(self, other): return Op("*", self, _wrap(other))
+    def __rmul__(self, other): return Op("*", _wrap(other), self)
+    def __truediv__(self, other): return Op("/", self, _wrap(other))
+    def __rtruediv__(self, other): return Op("/", _wrap(other), self)
+    def __gt__(self, other): return Op(">", self, _wrap(other))
+    def __lt__(self, other): return Op("<", self, _wrap(other))
+
+class Var(Expr):
+    """Input column (table column name) or row flag."""
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+class Const(Expr):
+    """Number; excel is an optional worksheet spelling (e.g. PI())."""
+    __slots__ = ("value", "excel")
+
+    def __init__(self, value: float, excel: str = None):
+        self.value = float(value)
+        self.excel = excel
+
+class Op(Expr):
+    __slots__ = ("op", "a", "b")
+
+    def __init__(self, op: str, a: Expr, b: Expr):
+        self.op, self.a, self.b = op, a, b
+
+class All(Expr):
+    """Logical AND of conditions."""
+    __slots__ = ("args",)
+
+    def __init__(self, *args):
+        self.args = tuple(_wrap(a) for a in args)
+
+class Where(Expr):
+    __slots__ = ("cond", "a", "b")
+
+    def __init__(self, cond, a, b):
+        self.cond, self.a, self.b = _wrap(cond), _wrap(a), _wrap(b)
+
+class Round(Expr):
+    """ROUND(x, digits) in Excel; Python round() per element in NumPy."""
+    __slots__ = ("x", "digits")
+
+    def __init__(self, x, digits: int):
+        self.x, self.digits = _wrap(x), int(digits)
+
+def _wrap(value) -> Expr:
+    return value if isinstance(value, Expr) else Const(value)
+
+# --- Definitions ---
+
+D = Var("diameter_mm")
+T = Var("thickness_mm")
+L = Var("length_mm")
+W = Var("width_mm")
+COUNT = Var("count")
+JOINTS = Var("overlap_count")   # Whole joints (truncated)
+PIPE = Var("is_pipe")           # logic.pipe_mask
+RIB = Var("is_rib")             # logic.rib_mask
+UNIT = Var("unit")              # A unit value, for the totals
+PI = Const(math.pi, "PI()")
+
+PIPE_LENGTH_M = L / 1000 + JOINTS * OVERLAP_CORRECTION_M
+RIB_FACTOR = Where(RIB, 0.5, 1)   # Triangular rib: half the L x W rectangle
+
+PIPE_WEIGHT = Where(All(D > 0, T > 0, L > 0), (D - T) * T * PIPE_WEIGHT_FACTOR * PIPE_LENGTH_M, 0)
+PLATE_WEIGHT = Where(All(L > 0, W > 0, T > 0), L / 1000 * (W / 1000) * T * STEEL_DENSITY_PLATE_FACTOR * RIB_FACTOR, 0)
+PIPE_AREA = Where(D > 0, PI * (D / 1000) * PIPE_LENGTH_M, 0)
+PLATE_AREA = 2 * (L / 1000) * (W / 1000) * RIB_FACTOR    # Both faces
+
+UNIT_WEIGHT = Round(Where(PIPE, PIPE_WEIGHT, PLATE_WEIGHT), 2)
+UNIT_AREA = Round(Where(PIPE, PIPE_AREA, PLATE_AREA), 3)
+TOTAL = Round(UNIT * COUNT, 2)
+# Weld length heuristic: two girth welds per pipe, plate perimeter x 2 otherwise
+WELD_LENGTH = Where(D > 0, PI * D * 2, Where(All(L > 0, W > 0), (L + W) * 2, 0)) * COUNT
+
+# --- NumPy ---
+
+def round_half(values, digits: int) -> np.ndarray:
+    """Python round() per element; np.round differs on values like 25.905."""
+    return np.array([round(v, digits) for v in np.atleast_1d(values).tolist()], dtype=np.float64)
+
+def _source(e: Expr) -> str:
+    if isinstance(e, Var):
+        return f"v[{e.name!r}]"
+    if isinstance(e, Const):
+        return repr(e.value)
+    if isinstance(e, Op):
+        return f"({_source(e.a)} {e.op} {_source(e.b)})"
+    if isinstance(e, All):
+        return "(" + " & ".join(_source(a) for a in e.args) + ")"
+    if isinstance(e, Where):
+        return f"np.where({_source(e.cond)}, {_source(e.a)}, {_source(e.b)})"
+    if isinstance(e, Round):
+        return f"round_half({_source(e.x)}, {e.digits})"
+    raise TypeError(f"Unknown formula node {type(e).__name__}")
+
+def compile_numpy(e: Expr):
+    """Vectorized function of a formula: f({column name: array}) -> array."""
+    source = f"def formula(v):\n    return {_source(e)}\n"
+    namespace = {"np": np, "round_half": round_half}
+    exec(compile(source, "<formula>", "exec"), namespace)
+    formula = namespace["formula"]
+    formula.source = source
+    return formula
+
+unit_weight = compile_numpy(UNIT_WEIGHT)
+unit_area = compile_numpy(UNIT_AREA)
+total = compile_numpy(TOTAL)
+weld_length = compile_numpy(WELD_LENGTH)
+pipe_length_m = compile_numpy(PIPE_LENGTH_M)
+
+# --- Excel ---
+
+_PRECEDENCE = {">": 0, "<": 0, "+": 1, "-": 1, "*": 2, "/": 2}
+_APPLY = {"+": float.__add__, "-": float.__sub__, "*": float.__mul__, "/": float.__truediv__,
+          ">": float.__gt__, "<": float.__lt__}
+
+def _number(v) -> str:
+    v = float(v)
+    text = str(int(v)) if v.is_integer() else f"{v:.15g}"
+    return f"({text})" if v < 0 else text
+
+def _text(part) -> str:
+    return _number(part) if isinstance(part, (int, float)) else part[0]
+
+def _excel(e: Expr, refs: dict):
+    """A float when the subtree is constant for this row, else (text, precedence)."""
+    if isinstance(e, Var):
+        ref = refs[e.name]
+        if isinstance(ref, Expr):
+            return _excel(ref, refs)
+        return (ref, 3) if isinstance(ref, str) else float(ref)
+    if isinstance(e, Const):
+        return (e.excel, 3) if e.excel else e.value
+    if isinstance(e, Op):
+        a, b = _excel(e.a, refs), _excel(e.b, refs)
+        if isinstance(a, float) and isinstance(b, float):
+            return float(_APPLY[e.op](a, b))
+        if e.op == "*" and (a == 0.0 or b == 0.0):
+            return 0.0
+        if (e.op in "+-" and b == 0.0) or (e.op in "*/" and b == 1.0):
+            return a
+        if (e.op == "+" and a == 0.0) or (e.op == "*" and a == 1.0):
+            return b
+        p = _PRECEDENCE[e.op]
+        left = _text(a) if isinstance(a, float) or a[1] >= p else f"({a[0]})"
+        right = _text(b) if isinstance(b, float) or b[1] > p or (b[1] == p and e.op in "+*") else f"({b[0]})"
+        return (f"{left}{e.op}{right}", p)
+    if isinstance(e, All):
+        conds = []
+        for arg in e.args:
+            c = _excel(arg, refs)
+            if isinstance(c, float):
+                if not c:
+                    return 0.0
+                continue
+            conds.append(c[0])
+        if not conds:
+            return 1.0
+        return (conds[0], 0) if len(conds) == 1 else (f"AND({','.join(conds)})", 3)
+    if isinstance(e, Where):
+        c = _excel(e.cond, refs)
+        if isinstance(c, float):
+            return _excel(e.a if c else e.b, refs)
+        return (f"IF({c[0]},{_text(_excel(e.a, refs))},{_text(_excel(e.b, refs))})", 3)
+    if isinstance(e, Round):
+        x = _excel(e.x, refs)
+        if isinstance(x, float):
+            return float(round(x, e.digits))
+        return (f"ROUND({x[0]},{e.digits})", 3)
+    raise TypeError(f"Unknown formula node {type(e).__name__}")
+
+def excel(e: Expr, refs: dict) -> str:
+    """
+    Worksheet formula of one row. refs maps every variable to a cell reference
+    ("C26"), a fixed value of the row (folded into the formula) or another Expr (inlined).
+    """
+    return "=" + _text(_excel(e, refs))
+
+def excel_template(e: Expr, columns: dict, fixed: dict) -> str:
+    """
+    excel() for rows of one shape: columns maps variables to column letters, left as
+    "C{0}" so the worksheet row is filled in with str.format; fixed as in excel().
+    """
+    refs = {name: f"{col}{{0}}" for name, col in columns.items()}
+    refs.update(fixed)
+    return excel(e, refs)
@@ -0,0 +1,347 @@
+# journal.py
+# Edit Journal (編集履歴)
+# Editor corrections are recorded as cell-level patches (pattern, row id, column,
+# old, new) instead of copies of the project, so memory grows with the number of
+# edits. Undo / redo apply the patches of one edit backwards / forwards in place.
+# Every CHECKPOINT_EVERY patches a checkpoint of the project is kept for jumping to
+# any step; it copies only the columns changed since the previous checkpoint and
+# shares the rest. The state the journal started from (AI extraction or loaded
+# asset) is checkpoint 0 and is the base of the "diff vs. original" view.
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import model
+
+CHECKPOINT_EVERY = 50
+ROW = "*"     # Column of a row insert / delete patch; old / new are (position, {column: value}) or None
+
+Patch = namedtuple("Patch", "pattern row column old new")
+Entry = namedtuple("Entry", "label patches")
+
+_MODEL_COLUMNS = set(model.CATEGORY_COLUMNS + model.DIM_COLUMNS + model.INT_COLUMNS +
+                     model.OPTIONAL_INT_COLUMNS) | {"notes", model.MASK_COLUMN}
+
+# --- Column helpers (state = (columns, extra, row_ids) of one pattern) ---
+
+def _scalar(v):
+    return v.item() if isinstance(v, np.generic) else v
+
+def _same(a, b) -> bool:
+    return a == b or (a != a and b != b)     # NaN in extra columns
+
+def _values(columns: dict, extra: dict, col: str, n: int):
+    """Column as an array / list; columns missing from a table read as their defaults."""
+    if col in columns:
+        values = columns[col]
+        return np.asarray(values, dtype=object) if isinstance(values, pd.Categorical) else values
+    if col in extra:
+        return extra[col]
+    if col in _MODEL_COLUMNS:
+        return np.zeros(n, dtype=np.int16)
+    return [None] * n
+
+def _names(state: tuple) -> list:
+    columns, extra, _ = state
+    return list(columns) + [c for c in extra if c not in columns]
+
+def _row(state: tuple, pos: int) -> dict:
+    columns, extra, ids = state
+    return {c: _scalar(_values(columns, extra, c, len(ids))[pos]) for c in _names(state)}
+
+def _target(state: tuple, col: str):
+    """Writable column of a state, created with defaults when missing."""
+    columns, extra, ids = state
+    if col in columns:
+        return columns
+    if col not in extra:
+        if col in _MODEL_COLUMNS:
+            columns[col] = np.zeros(len(ids), dtype=np.int16)
+            return columns
+        extra[col] = [None] * len(ids)
+    return extra
+
+def _set_cell(state: tuple, col: str, pos: int, value):
+    store = _target(state, col)
+    values = store[col]
+    if isinstance(values, pd.Categorical):
+        value = str(value)
+        if value not in values.categories:
+            store[col] = values = values.add_categories([value])
+    values[pos] = value
+
+def _delete_row(state: tuple, pos: int):
+    columns, extra, ids = state
+    for col, values in columns.items():
+        if isinstance(values, pd.Categorical):
+            columns[col] = pd.Categorical([v for k, v in enumerate(values) if k != pos])
+        else:
+            columns[col] = np.delete(values, pos)
+    for values in extra.values():
+        del values[pos]
+    del ids[pos]
+
+def _insert_row(state: tuple, pos: int, row_id: int, values: dict):
+    columns, extra, ids = state
+    for col in values:
+        _target(state, col)
+    for col, column in columns.items():
+        value = values.get(col, 0)
+        if isinstance(column, pd.Categorical):
+            items = [str(v) for v in column]
+            items.insert(pos, str(value))
+            columns[col] = pd.Categorical(items)
+        else:
+            columns[col] = np.insert(column, pos, value)
+    for col, column in extra.items():
+        column.insert(pos, values.get(col))
+    ids.insert(pos, row_id)
+
+def apply(state: tuple, patches: list, reverse: bool = False):
+    """Applies patches to one pattern state in place (backwards for undo)."""
+    for p in (reversed(patches) if reverse else patches):
+        old, new = (p.new, p.old) if reverse else (p.old, p.new)
+        ids = state[2]
+        if p.column == ROW:
+            if old is not None:
+                _delete_row(state, ids.index(p.row))
+            if new is not None:
+                _insert_row(state, new[0], p.row, new[1])
+        else:
+            _set_cell(state, p.column, ids.index(p.row), new)
+
+def _copy(state: tuple, columns=None) -> tuple:
+    """Copy of a state; with columns given, only those are copied and the rest shared."""
+    cols, extra, ids = state
+    if columns is None:
+        return {c: v.copy() for c, v in cols.items()}, {c: list(v) for c, v in extra.items()}, list(ids)
+    return ({c: (v.copy() if c in columns else v) for c, v in cols.items()},
+            {c: (list(v) if c in columns else v) for c, v in extra.items()}, list(ids))
+
+def diff_states(old: tuple, new: tuple, source=None, pattern: int = 0, new_ids: list = None) -> list:
+    """
+    Patches turning state old into state new. source gives the old position of every new
+    row (-1 for added rows, which follow the kept ones); None means the same rows in order.
+    """
+    old_cols, old_extra, old_ids = old
+    new_cols, new_extra, _ = new
+    n_old = len(old_ids)
+    source = np.arange(n_old) if source is None else np.asarray(source, dtype=np.int64)
+    kept = source[source >= 0]
+    new_ids = list(old_ids) if new_ids is None else new_ids
+    patches = []
+    for col in dict.fromkeys(_names(old) + _names(new)):
+        a = _values(old_cols, old_extra, col, n_old)
+        b = _values(new_cols, new_extra, col, len(source))
+        if isinstance(a, list) or isinstance(b, list):
+            changed = [k for k, s in enumerate(kept.tolist()) if not _same(a[s], b[k])]
+        else:
+            changed = np.flatnonzero(np.asarray(a)[kept] != np.asarray(b)[:len(kept)]).tolist()
+        patches.extend(Patch(pattern, old_ids[kept[k]], col, _scalar(a[kept[k]]), _scalar(b[k])) for k in changed)
+    for pos in sorted(set(range(n_old)) - set(kept.tolist()), reverse=True):
+        patches.append(Patch(pattern, old_ids[pos], ROW, (pos, _row(old, pos)), None))
+    for pos in range(len(kept), len(source)):
+        patches.append(Patch(pattern, new_ids[pos], ROW, None, (pos, _row((new_cols, new_extra, new_ids), pos))))
+    return patches
+
+def describe(patches: list) -> str:
+    """Short summary like "3 cells, +1 / -0 rows" (uncertainty bits not counted)."""
+    rows = [p for p in patches if p.column == ROW]
+    cells = sum(p.column != ROW and not str(p.column).startswith("_") for p in patches)
+    text = f"{cells} cell" + ("" if cells == 1 else "s")
+    if rows:
+        text += f", +{sum(p.new is not None for p in rows)} / -{sum(p.old is not None for p in rows)} rows"
+    return text
+
+class EditJournal:
+    """Undo / redo history of one model.Project."""
+
+    def __init__(self, project, checkpoint_every: int = CHECKPOINT_EVERY):
+        self.project = project
+        self.checkpoint_every = checkpoint_every
+        self.row_ids = [list(range(len(p))) for p in project]   # Stable id of every live row
+        self.next_id = [len(p) for p in project]
+        self.entries = []
+        self.cursor = 0                  # Entries applied; the rest can be redone
+        self.checkpoints = {0: [_copy(self._live(i)) for i in range(len(project))]}
+
+    def matches(self, project) -> bool:
+        return self.project is project and len(self.row_ids) == len(project)
+
+    def _live(self, i: int) -> tuple:
+        p = self.project[i]
+        return p.columns, p.extra, self.row_ids[i]
+
+    def snapshot(self, patterns=None) -> dict:
+        """{pattern: state copy} before an in-place change (e.g. Project.propagate)."""
+        return {i: _copy(self._live(i)) for i in (range(len(self.project)) if patterns is None else patterns)}
+
+    def record(self, i: int, before: tuple, source, label: str, amend: bool = False) -> int:
+        """
+        Records the change of pattern i stored by PatternTable.set_frame. before is
+        (columns, extra) of the table before the call (set_frame replaces, not mutates,
+        them); source as in diff_states. amend folds a change the user did not make
+        (validation notes) into the last edit, or into the original before any edit.
+        Returns the number of patches.
+        """
+        old_ids = self.row_ids[i]
+        new_ids = []
+        for s in source:
+            if s >= 0:
+                new_ids.append(old_ids[s])
+            else:
+                new_ids.append(self.next_id[i])
+                self.next_id[i] += 1
+        patches = diff_states((before[0], before[1], old_ids), self._live(i), source, i, new_ids)
+        self.row_ids[i] = new_ids
+        if amend:
+            self._amend(patches)
+        else:
+            self._push(label, patches)
+        return len(patches)
+
+    def record_changes(self, before: dict, label: str) -> int:
+        """Records in-place changes of the patterns captured by snapshot(); rows are unchanged."""
+        patches = []
+        for i, state in before.items():
+            patches.extend(diff_states(state, self._live(i), pattern=i))
+        self._push(label, patches)
+        return len(patches)
+
+    def _push(self, label: str, patches: list):
+        if not patches:
+            return
+        del self.entries[self.cursor:]
+        for step in [k for k in self.checkpoints if k > self.cursor]:
+            del self.checkpoints[step]
+        self.entries.append(Entry(f"{label} ({describe(patches)})", patches))
+        self.cursor = len(self.entries)
+        last = max(self.checkpoints)
+        if sum(len(e.patches) for e in self.entries[last:]) >= self.checkpoint_every:
+            self.checkpoints[self.cursor] = self._build(last, self.cursor)
+
+    def _amend(self, patches: list):
+        if not patches:
+            return
+        if self.cursor:
+            entry = self.entries[self.cursor - 1]
+            self.entries[self.cursor - 1] = Entry(entry.label, entry.patches + patches)
+            for step in [k for k in self.checkpoints if k >= self.cursor]:
+                del self.checkpoints[step]
+            return
+        base = list(self.checkpoints[0])   # Later checkpoints may share its arrays: copy what changes
+        touched = {}
+        for p in patches:
+            touched.setdefault(p.pattern, set()).add(p.column)
+        for i, cols in touched.items():
+            base[i] = _copy(base[i], cols)
+        self._apply(patches, lambda i: base[i])
+        self.checkpoints[0] = base
+
+    def _build(self, start: int, stop: int) -> list:
+        """States at step stop from the checkpoint at start, copying only what changed in between."""
+        states = list(self.checkpoints[start])
+        touched = {}
+        for entry in self.entries[start:stop]:
+            for p in entry.patches:
+                cols = touched.setdefault(p.pattern, set())
+                cols.update(states[p.pattern][0] if p.column == ROW else (p.column,))
+                if p.column == ROW:
+                    cols.update(states[p.pattern][1])
+        for i, cols in touched.items():
+            states[i] = _copy(states[i], cols)
+        for entry in self.entries[start:stop]:
+            self._apply(entry.patches, lambda i: states[i])
+        return states
+
+    def _apply(self, patches: list, state_of, reverse: bool = False):
+        by_pattern = {}
+        for p in patches:
+            by_pattern.setdefault(p.pattern, []).append(p)
+        for i, items in by_pattern.items():
+            apply(state_of(i), items, reverse)
+
+    def can_undo(self) -> bool:
+        return self.cursor > 0
+
+    def can_redo(self) -> bool:
+        return self.cursor < len(self.entries)
+
+    def undo(self) -> str:
+        """Reverts the last applied edit; returns its label."""
+        if not self.can_undo():
+            return None
+        self.cursor -= 1
+        entry = self.entries[self.cursor]
+        self._apply(entry.patches, self._live, reverse=True)
+        return entry.label
+
+    def redo(self) -> str:
+        if not self.can_redo():
+            return None
+        entry = self.entries[self.cursor]
+        self._apply(entry.patches, self._live)
+        self.cursor += 1
+        return entry.label
+
+    def goto(self, step: int):
+        """Restores the project as it was after step edits: nearest checkpoint, then replay."""
+        step = max(0, min(int(step), len(self.entries)))
+        start = max(k for k in self.checkpoints if k <= step)
+        for i, state in enumerate(self.checkpoints[start]):
+            columns, extra, ids = _copy(state)
+            self.project[i].columns, self.project[i].extra = columns, extra
+            self.row_ids[i] = ids
+        for entry in self.entries[start:step]:
+            self._apply(entry.patches, self._live)
+        self.cursor = step
+
+    def history(self) -> list:
+        """One row per edit for display."""
+        return [{"Step": n + 1, "Edit (編集)": e.label, "Patches": len(e.patches),
+                 "State": "applied" if n < self.cursor else "undone",
+                 "Checkpoint": "✓" if n + 1 in self.checkpoints else ""}
+                for n, e in enumerate(self.entries)]
+
+    def diff_original(self, names: list = None) -> list:
+        """Changed / added / deleted cells of the live project against checkpoint 0, aligned by row id."""
+        rows = []
+        for i, base in enumerate(self.checkpoints[0]):
+            live = self._live(i)
+            ids = live[2]
+            n_base = len(base[2])
+            pos = {r: k for k, r in enumerate(ids)}
+            source = [r if r < n_base else -1 for r in ids]
+            order = sorted(range(len(ids)), key=lambda k: (source[k] < 0, source[k]))
+            # Live rows in base order (kept first, then added) to reuse diff_states
+            view = ({c: np.asarray(v, dtype=object if isinstance(v, pd.Categorical) else None)[order]
+                     for c, v in live[0].items()},
+                    {c: [v[k] for k in order] for c, v in live[1].items()}, [ids[k] for k in order])
+            name = names[i] if names else f"Pattern {i + 1}"
+            for p in diff_states(base, view, [source[k] for k in order], i, view[2]):
+                if str(p.column).startswith("_"):
+                    continue
+                if p.column == ROW:
+                    values = (p.new or p.old)[1]
+                    row = pos[p.row] + 1 if p.new else p.old[0] + 1
+                    rows.append({"Pattern": name, "Row": row, "Part (部材名)": values.get("name", ""),
+                                 "Column": "(row)", "Original (元)": "" if p.new else "deleted",
+                                 "Current (現在)": "added" if p.new else ""})
+                else:
+                    row = pos[p.row]
+                    rows.append({"Pattern": name, "Row": row + 1,
+                                 "Part (部材名)": str(_values(live[0], live[1], "name", len(ids))[row]),
+                                 "Column": p.column, "Original (元)": str(p.old), "Current (現在)": str(p.new)})
+        return rows
+
+    def stats(self) -> dict:
+        """Sizes for display; checkpoint arrays shared between checkpoints are counted once."""
+        seen, nbytes = set(), 0
+        for states in self.checkpoints.values():
+            for columns, _, _ in states:
+                for v in columns.values():
+                    if id(v) not in seen:
+                        seen.add(id(v))
+                        nbytes += v.nbytes if hasattr(v, "nbytes") else 0
+        return {"edits": len(self.entries), "applied": self.cursor,
+                "patches": sum(len(e.patches) for e in self.entries),
+                "checkpoints": len(self.checkpoints), "checkpoint_bytes": nbytes}
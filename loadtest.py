@@ -0,0 +1,297 @@
+# loadtest.py
+# Concurrent-Session Load Test (同時接続負荷テスト)
+# Drives simulated estimator sessions through app.py with Streamlit's AppTest:
+# log in, upload a drawing and analyze it (dummy / replay / synthetic data),
+# edit cells, move sliders and build the Excel downloads. Reports latency
+# percentiles per interaction and process memory growth.
+#
+#   python loadtest.py --sessions 8                       # 8 sessions, one process each
+#   python loadtest.py --sessions 8 --workers 1           # 8 sessions held by one process
+#   ESTIMATOR_BACKEND=synthetic:6x40 python loadtest.py --sessions 4 --rounds 5
+#
+# AppTest installs a process-wide mock runtime per run, so sessions cannot run
+# concurrently on threads of one process. Concurrent sessions run in worker
+# processes (CPU contention, like users sharing a server); sessions of the same
+# worker are interleaved step by step, so --workers 1 shows how one server
+# process grows as sessions accumulate.
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import multiprocessing
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PASSWORD = "yp2026"
+EDIT_COLUMNS = ("diameter_mm", "thickness_mm", "length_mm", "width_mm", "count")
+PERCENTILES = (50, 90, 95, 99)
+
+def rss_mb() -> float:
+    """Resident memory of this process (MB)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def sample_drawing() -> tuple:
+    """(name, bytes, mime) of a synthetic A3 scan that passes the quality gate."""
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (3300, 2300), "white")
+    draw = ImageDraw.Draw(img)
+    for x in range(0, 3300, 150):
+        draw.line([(x, 100), (x, 2200)], fill="black", width=3)
+    for y in range(100, 2300, 150):
+        draw.line([(0, y), (3300, y)], fill="black", width=3)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return "loadtest.png", buf.getvalue(), "image/png"
+
+def read_drawing(path: str) -> tuple:
+    mime = "application/pdf" if path.lower().endswith(".pdf") else \
+        "image/png" if path.lower().endswith(".png") else "image/jpeg"
+    with open(path, "rb") as f:
+        return os.path.basename(path), f.read(), mime
+
+class _DeferredDownloads:
+    """
+    Records the callables behind deferred download buttons into the session that
+    is running, so an export can be triggered the way the browser does after a
+    click (the file is fetched separately).
+    """
+
+    def __init__(self):
+        from streamlit.runtime.media_file_manager import MediaFileManager
+        self.current = None
+        original = MediaFileManager.add_deferred
+        recorder = self
+
+        def add_deferred(mgr, data_callable, *args, **kwargs):
+            file_id = original(mgr, data_callable, *args, **kwargs)
+            if recorder.current is not None:
+                recorder.current.deferred[file_id] = data_callable
+            return file_id
+
+        MediaFileManager.add_deferred = add_deferred
+
+class Session:
+    """One simulated user. Each step is one interaction (one script run)."""
+
+    def __init__(self, n: int, drawing: tuple, rng: random.Random, timeout: float):
+        from streamlit.testing.v1 import AppTest
+        self.n = n
+        self.drawing = drawing
+        self.rng = rng
+        self.deferred = {}   # file id -> callable, from the latest run
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def _check(self):
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def open(self):
+        self.at.run()
+        self._check()
+
+    def login(self):
+        self.at.text_input[0].input(PASSWORD)
+        self.at.button[0].click()
+        self.at.run()
+        self._check()
+
+    def upload(self):
+        self.at.file_uploader[0].set_value(self.drawing)
+        self.at.run()
+        self._check()
+
+    def analyze(self):
+        button = [b for b in self.at.button if "Analyze Drawing" in b.label][0]
+        button.click()
+        self.at.run()
+        self._check()
+        if not self._editors():
+            raise RuntimeError("No patterns after analysis (set ESTIMATOR_BACKEND or use an image drawing)")
+
+    def rerun(self):
+        self.at.run()
+        self._check()
+
+    def _editors(self):
+        return [d for d in self.at.dataframe if d.key and d.key.startswith("editor_")]
+
+    def edit(self):
+        """Changes one dimension cell; the editor state is sent like the browser does."""
+        editor = self.rng.choice(self._editors())
+        table = editor.value
+        row = self.rng.randrange(len(table))
+        column = self.rng.choice([c for c in EDIT_COLUMNS if c in table.columns])
+        value = float(table[column].iloc[row] or 0) * self.rng.choice([0.9, 1.1]) + 1
+        state = {"edited_rows": {str(row): {column: round(value, 1)}}, "added_rows": [], "deleted_rows": []}
+        # AppTest has no data_editor API: add the widget state to the next run directly
+        states = self.at._tree.get_widget_states()
+        widget = states.widgets.add()
+        widget.id = editor.proto.id
+        widget.string_value = json.dumps(state)
+        self.at._run(states)
+        self._check()
+        if not self.at.session_state[editor.key]["edited_rows"]:
+            raise RuntimeError("Edit was not applied (editor changed since the last run)")
+
+    def slider(self):
+        sliders = [s for s in self.at.slider if "%" in s.label]
+        s = self.rng.choice(sliders)
+        s.set_value(self.rng.randint(int(s.min), int(s.max)))
+        self.at.run()
+        self._check()
+
+    def export(self):
+        """Builds every Excel download of the page (per-pattern reports and the multi-sheet export)."""
+        ids = [b.proto.deferred_file_id for b in self.at.get("download_button") if b.proto.deferred_file_id]
+        built = 0
+        for file_id in ids:
+            fn = self.deferred.get(file_id)
+            if fn is not None:
+                data = fn()
+                built += len(data) if data else 0
+        if not built:
+            raise RuntimeError("No deferred downloads found")
+
+def scenario(rounds: int, edits: int) -> list:
+    steps = ["open", "login", "upload", "analyze"]
+    for _ in range(rounds):
+        for _ in range(edits):
+            steps += ["rerun", "edit"]
+        steps += ["slider", "export"]
+    return steps
+
+def worker(worker_id: int, n_sessions: int, args: dict) -> dict:
+    """Runs n_sessions sessions interleaved step by step. Returns samples and memory."""
+    import logging
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    rng = random.Random(args["seed"] + worker_id)
+    drawing = read_drawing(args["drawing"]) if args["drawing"] else sample_drawing()
+    downloads = _DeferredDownloads()
+    rss_start = rss_mb()
+    sessions = [Session(worker_id * 1000 + k, drawing, random.Random(rng.random()), args["timeout"])
+                for k in range(n_sessions)]
+    alive = list(sessions)
+    samples, errors = {}, {}
+    rss_after_load = None
+    for step in scenario(args["rounds"], args["edits"]):
+        for s in list(alive):
+            downloads.current = s
+            if step != "export":      # A new run replaces the page's downloads
+                s.deferred = {}
+            start = time.perf_counter()
+            try:
+                getattr(s, step)()
+                samples.setdefault(step, []).append(time.perf_counter() - start)
+            except Exception as e:
+                errors.setdefault(step, []).append(f"{type(e).__name__}: {e}"[:200])
+                if step in ("open", "login", "upload", "analyze"):
+                    alive.remove(s)   # Cannot continue without data
+            if args["think_s"]:
+                time.sleep(rng.uniform(0, args["think_s"]))
+        if step == "analyze":
+            rss_after_load = rss_mb()
+    return {"worker": worker_id, "sessions": n_sessions, "completed": len(alive), "samples": samples,
+            "errors": errors, "rss_start_mb": rss_start, "rss_loaded_mb": rss_after_load, "rss_end_mb": rss_mb()}
+
+def _worker_entry(worker_id, n_sessions, args, queue):
+    try:
+        queue.put(worker(worker_id, n_sessions, args))
+    except Exception as e:
+        queue.put({"worker": worker_id, "sessions": n_sessions, "completed": 0, "samples": {},
+                   "errors": {"worker": [f"{type(e).__name__}: {e}"]}, "rss_start_mb": 0, "rss_loaded_mb": 0, "rss_end_mb": 0})
+
+def summarize(results: list, wall_s: float) -> dict:
+    samples, errors = {}, {}
+    for r in results:
+        for step, values in r["samples"].items():
+            samples.setdefault(step, []).extend(values)
+        for step, messages in r["errors"].items():
+            errors.setdefault(step, []).extend(messages)
+    order = list(dict.fromkeys(scenario(1, 1) + list(samples) + list(errors)))
+    latency = {}
+    for step in order:
+        values = samples.get(step, [])
+        entry = {"count": len(values), "errors": len(errors.get(step, []))}
+        if values:
+            arr = np.array(values) * 1000
+            entry.update({f"p{p}_ms": round(float(np.percentile(arr, p)), 1) for p in PERCENTILES})
+            entry.update({"mean_ms": round(float(arr.mean()), 1), "max_ms": round(float(arr.max()), 1)})
+        latency[step] = entry
+    sessions = sum(r["sessions"] for r in results)
+    memory = [{"worker": r["worker"], "sessions": r["sessions"],
+               "start_mb": round(r["rss_start_mb"], 1), "loaded_mb": round(r["rss_loaded_mb"] or 0, 1),
+               "end_mb": round(r["rss_end_mb"], 1),
+               "growth_per_session_mb": round((r["rss_end_mb"] - r["rss_start_mb"]) / max(r["sessions"], 1), 1)}
+              for r in results]
+    return {"sessions": sessions, "completed": sum(r["completed"] for r in results), "wall_s": round(wall_s, 1),
+            "latency": latency, "memory": memory,
+            "error_samples": {step: sorted(set(msgs))[:3] for step, msgs in errors.items()}}
+
+def print_report(summary: dict):
+    print(f"\n{summary['completed']}/{summary['sessions']} sessions completed in {summary['wall_s']} s")
+    header = f"{'interaction':<10} {'n':>5} {'err':>4} " + " ".join(f"{'p' + str(p):>8}" for p in PERCENTILES) + f" {'max':>8}  (ms)"
+    print(header)
+    for step, e in summary["latency"].items():
+        if not e["count"] and not e["errors"]:
+            continue
+        cells = " ".join(f"{e.get(f'p{p}_ms', float('nan')):>8.0f}" for p in PERCENTILES)
+        print(f"{step:<10} {e['count']:>5} {e['errors']:>4} {cells} {e.get('max_ms', float('nan')):>8.0f}")
+    print("\nMemory (RSS MB): worker sessions start -> after analysis -> end, growth per session")
+    for m in summary["memory"]:
+        print(f"  #{m['worker']:<3} {m['sessions']:>3}  {m['start_mb']:>8.1f} -> {m['loaded_mb']:>8.1f} -> {m['end_mb']:>8.1f}"
+              f"   +{m['growth_per_session_mb']:.1f}")
+    for step, msgs in summary["error_samples"].items():
+        print(f"Errors in {step}: " + " | ".join(msgs))
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py")
+    parser.add_argument("--sessions", type=int, default=4, help="Simulated users")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (default: one per session)")
+    parser.add_argument("--rounds", type=int, default=3, help="Edit / slider / export rounds per session")
+    parser.add_argument("--edits", type=int, default=2, help="Cell edits per round")
+    parser.add_argument("--drawing", help="Drawing to upload (default: a synthetic scan)")
+    parser.add_argument("--think-s", type=float, default=0.0, help="Random pause between interactions (s)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-run AppTest timeout (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write the summary to this file")
+    args = parser.parse_args(argv)
+
+    n_workers = max(1, min(args.workers or args.sessions, args.sessions))
+    per_worker = [args.sessions // n_workers + (1 if k < args.sessions % n_workers else 0) for k in range(n_workers)]
+    options = {"rounds": args.rounds, "edits": args.edits, "drawing": args.drawing, "think_s": args.think_s,
+               "timeout": args.timeout, "seed": args.seed}
+    print(f"{args.sessions} sessions on {n_workers} worker process(es), {args.rounds} rounds x {args.edits} edits; "
+          f"backend: {os.environ.get('ESTIMATOR_BACKEND', 'dummy data (no API key)')}")
+
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker_entry, args=(k, n, options, queue)) for k, n in enumerate(per_worker)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    summary = summarize(sorted(results, key=lambda r: r["worker"]), time.perf_counter() - start)
+    summary["config"] = dict(options, sessions=args.sessions, workers=n_workers)
+
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    return 0 if summary["completed"] == summary["sessions"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,86 +2,257 @@
 # logic.py
 # Steel Pole Material Estimation Logic
 import math
+import numpy as np
+import pandas as pd
+import schema
+import formulas
+# Factors are defined with the formulas (formulas.py)
+from formulas import STEEL_DENSITY_PLATE_FACTOR, PIPE_WEIGHT_FACTOR, OVERLAP_CORRECTION_M
 
-STEEL_DENSITY_PLATE_FACTOR = 7.85  # kg / (m * m * mm)
-PIPE_WEIGHT_FACTOR = 0.02466       # kg / (mm * mm * m) specific factor for pipes
-OVERLAP_CORRECTION_M = 0.400       # 400mm overlap correction per connection
+# Sidebar defaults of the cost settings (see cost_breakdown); prices by date / size band: pricebook.py
+from pricebook import DEFAULT_RATES
 
-def calculate_pipe_weight(diameter_mm: float, thickness_mm: float, length_mm: float, overlap_count: int = 0) -> float:
+# --- Component tables (DataFrames) ---
+
+def column_values(df: pd.DataFrame, col: str, default: float = 0.0) -> np.ndarray:
+    """Column as float64; object columns (strings, "CHECK", None) go through schema.to_float."""
+    if col not in df.columns:
+        return np.full(len(df), default)
+    values = df[col]
+    if values.dtype == object:
+        return np.array([schema.to_float(v) for v in values], dtype=np.float64)
+    return np.nan_to_num(values.to_numpy(dtype=np.float64, na_value=0.0), nan=0.0, posinf=0.0, neginf=0.0)
+
+def _lowered(df: pd.DataFrame, col: str) -> list:
+    """Lower-cased text of a column ("" for missing); plain Python is faster than .str on short tables."""
+    if col not in df.columns:
+        return [""] * len(df)
+    return ["" if v is None or v is pd.NA or v != v else str(v).lower() for v in df[col].tolist()]
+
+def _text(df: pd.DataFrame, col: str) -> pd.Series:
+    return pd.Series(_lowered(df, col), index=df.index, dtype=object)
+
+_round = formulas.round_half
+
+def pipe_mask(df: pd.DataFrame) -> np.ndarray:
+    """Rows calculated as pipes (type contains "pipe" or 管)."""
+    return np.array([("pipe" in v or "管" in v) for v in _lowered(df, "type")], dtype=bool)
+
+def rib_mask(df: pd.DataFrame) -> np.ndarray:
+    """Rows calculated as triangular ribs (name contains "rib"; half of the L x W rectangle)."""
+    return np.array(["rib" in v for v in _lowered(df, "name")], dtype=bool)
+
+def calculate_frame(df: pd.DataFrame, cache: dict = None) -> pd.DataFrame:
     """
-    Calculate weight of a cylindrical steel pipe (素管).
-    Formula: (D - t) * t * 0.02466 * (L(m) + Correction(m))
+    Adds "Unit Weight (kg)", "Total Weight (kg)" and "Surface Area (m²)" (formulas.py).
+    Unit values are computed once per unique part (type, rib, dimensions, overlap)
+    and broadcast to its rows. Returns a new DataFrame with the three result columns.
+    cache: optional {part: (unit weight, unit area)} shared by several calls, so parts
+           common to many patterns are calculated once per project.
     """
-    try:
-        if diameter_mm <= 0 or thickness_mm <= 0 or length_mm <= 0:
-            return 0.0
-        
-        # Convert length to meters
-        length_m = length_mm / 1000.0
-        
-        # Apply Overlap Correction
-        total_length_m = length_m + (overlap_count * OVERLAP_CORRECTION_M)
-        
-        # Calculate Weight
-        # (Outer Diameter - Thickness) * Thickness * Factor * Length
-        weight = (diameter_mm - thickness_mm) * thickness_mm * PIPE_WEIGHT_FACTOR * total_length_m
-        return round(weight, 2)
-    except Exception as e:
-        print(f"Error calculating pipe weight: {e}")
-        return 0.0
+    out = df.copy(deep=False)
+    if len(df) == 0:
+        for col in ("Unit Weight (kg)", "Total Weight (kg)", "Surface Area (m²)"):
+            out[col] = pd.Series(dtype=np.float64)
+        return out
+    is_pipe = pipe_mask(df)
+    is_rib = rib_mask(df)
+    d, t, l, w = (column_values(df, c) for c in ("diameter_mm", "thickness_mm", "length_mm", "width_mm"))
+    overlap = np.trunc(column_values(df, "overlap_count"))
+    count = column_values(df, "count", default=1.0)
 
-def calculate_plate_weight(length_mm: float, width_mm: float, thickness_mm: float, is_rib: bool = False) -> float:
+    codes, uniq = pd.factorize(pd.MultiIndex.from_arrays([is_pipe, is_rib, d, t, l, w, overlap]))
+    u_pipe, u_rib, u_d, u_t, u_l, u_w, u_ov = (uniq.get_level_values(n).to_numpy() for n in range(7))
+    u_pipe = u_pipe.astype(bool)
+    u_rib = u_rib.astype(bool)
+    u_d, u_t, u_l, u_w, u_ov = (a.astype(np.float64) for a in (u_d, u_t, u_l, u_w, u_ov))
+
+    parts = {"is_pipe": u_pipe, "is_rib": u_rib, "diameter_mm": u_d, "thickness_mm": u_t,
+             "length_mm": u_l, "width_mm": u_w, "overlap_count": u_ov}
+    if cache is None:
+        unit_weight = formulas.unit_weight(parts)[codes]
+        unit_area = formulas.unit_area(parts)[codes]
+    else:
+        keys = list(zip(*(a.tolist() for a in parts.values())))
+        missing = np.array([k for k, key in enumerate(keys) if key not in cache], dtype=np.int64)
+        if len(missing):
+            new = {n: a[missing] for n, a in parts.items()}
+            for k, uw, ua in zip(missing.tolist(), formulas.unit_weight(new).tolist(), formulas.unit_area(new).tolist()):
+                cache[keys[k]] = (uw, ua)
+        units = np.array([cache[key] for key in keys], dtype=np.float64).reshape(-1, 2)
+        unit_weight = units[codes, 0]
+        unit_area = units[codes, 1]
+
+    out["Unit Weight (kg)"] = unit_weight
+    out["Total Weight (kg)"] = formulas.total({"unit": unit_weight, "count": count})
+    out["Surface Area (m²)"] = formulas.total({"unit": unit_area, "count": count})
+    return out
+
+def rib_context_frame(df: pd.DataFrame) -> tuple:
     """
-    Calculate weight of a flat steel plate (平板).
-    Formula: L(m) * W(m) * t(mm) * 7.85
-    If is_rib is True, assumes triangular shape and multiplies by 0.5.
+    Returns (base_plate_size_mm, largest_pipe_diameter_mm) of a pattern's table,
+    used to derive missing rib widths.
     """
-    try:
-        if length_mm <= 0 or width_mm <= 0 or thickness_mm <= 0:
-            return 0.0
-            
-        # Convert dimensions to meters
-        length_m = length_mm / 1000.0
-        width_m = width_mm / 1000.0
-        
-        weight = length_m * width_m * thickness_mm * STEEL_DENSITY_PLATE_FACTOR
-        
-        if is_rib:
-            weight *= 0.5
-            
-        return round(weight, 2)
-    except Exception as e:
-        print(f"Error calculating plate weight: {e}")
-        return 0.0
+    if len(df) == 0:
+        return 0.0, 0.0
+    name, ctype = _text(df, "name"), _text(df, "type")
+    base = (name.str.contains("base", regex=False) & ctype.str.contains("plate", regex=False)).to_numpy()
+    pipe = ctype.str.contains("pipe", regex=False).to_numpy()
+    base_w = 0.0
+    if base.any():
+        last = np.flatnonzero(base)[-1]
+        base_w = max(column_values(df, "width_mm")[last], column_values(df, "length_mm")[last])
+    d = column_values(df, "diameter_mm")
+    pole_max_d = float(max(d[pipe].max(), 0.0)) if pipe.any() else 0.0
+    return float(base_w), pole_max_d
 
-def calculate_surface_area(diameter_mm: float, length_mm: float, width_mm: float = 0, type_str: str = "pipe", overlap_count: int = 0, is_rib: bool = False) -> float:
+def rib_context_groups(df: pd.DataFrame, groups) -> tuple:
     """
-    Calculate Surface Area (Painting Area).
-    For Pipes: S = pi * D(m) * L(m)
-    For Plates: S = 2 * (L(m) * W(m)) 
-    If is_rib is True (Triangle): S approx L(m) * W(m) (2 sides)
+    rib_context_frame for a table holding several patterns; groups is the pattern
+    id of every row. Returns per-row (base_w, pole_max_d) arrays for validate_frame.
     """
-    try:
-        length_m = length_mm / 1000.0
-        
-        if "pipe" in type_str.lower():
-            if diameter_mm <= 0: return 0.0
-            total_length_m = length_m + (overlap_count * OVERLAP_CORRECTION_M)
-            diameter_m = diameter_mm / 1000.0
-            # S = pi * D * L
-            area = math.pi * diameter_m * total_length_m
-            return round(area, 3)
-        
-        elif "plate" in type_str.lower():
-            # For plates, usually painting area is surface area (2 sides) + edges
-            width_m = width_mm / 1000.0
-            area = 2 * (length_m * width_m)
-            
-            if is_rib:
-                area *= 0.5
-                
-            return round(area, 3)
-            
-        return 0.0
-    except Exception:
+    n = len(df)
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    codes, uniq = pd.factorize(np.asarray(groups))
+    name, ctype = _text(df, "name"), _text(df, "type")
+    base = (name.str.contains("base", regex=False) & ctype.str.contains("plate", regex=False)).to_numpy()
+    pipe = ctype.str.contains("pipe", regex=False).to_numpy()
+    base_w = np.zeros(len(uniq))
+    if base.any():
+        size = np.maximum(column_values(df, "width_mm"), column_values(df, "length_mm"))[base]
+        last = pd.Series(size).groupby(codes[base]).last()     # Last base plate of each pattern
+        base_w[last.index.to_numpy()] = last.to_numpy()
+    pole_max_d = np.zeros(len(uniq))
+    np.maximum.at(pole_max_d, codes[pipe], column_values(df, "diameter_mm")[pipe])
+    return base_w[codes], pole_max_d[codes]
+
+def validate_frame(df: pd.DataFrame, base_w=0.0, pole_max_d=0.0) -> pd.DataFrame:
+    """
+    Fills rib defaults (count 4, width from base plate and pole diameter) and
+    flags rows with missing critical dimensions ("_priority" 1 = check first).
+    Returns a new DataFrame. base_w / pole_max_d are scalars (one pattern) or per-row arrays (rib_context_groups).
+    """
+    out = df.copy(deep=False)
+    n = len(df)
+    is_rib = rib_mask(df)
+    notes = ["" if (v is None or (isinstance(v, float) and math.isnan(v)) or not v) else str(v)
+             for v in (df["notes"] if "notes" in df.columns else [""] * n)]
+
+    # 1. Rib Logic
+    count = column_values(df, "count")
+    default_count = is_rib & (count == 0)
+    if default_count.any():
+        out["count"] = np.where(default_count, 4, count).astype(df["count"].dtype if "count" in df.columns and df["count"].dtype != object else np.float64)
+    width = column_values(df, "width_mm")
+    base_w = np.broadcast_to(np.asarray(base_w, dtype=np.float64), (n,))
+    pole_max_d = np.broadcast_to(np.asarray(pole_max_d, dtype=np.float64), (n,))
+    calc_w = (base_w - pole_max_d) / 2
+    fill_width = is_rib & (width == 0) & (base_w > 0) & (pole_max_d > 0) & (calc_w > 0)
+    if fill_width.any():
+        width = np.where(fill_width, _round(calc_w, 1), width)
+        out["width_mm"] = width.astype(df["width_mm"].dtype if "width_mm" in df.columns and df["width_mm"].dtype.kind == "f" else np.float64)
+    for j in np.flatnonzero(default_count):
+        notes[j] += " [Default: 4]"
+    for j in np.flatnonzero(fill_width):
+        notes[j] += f" [Calc. Width: {calc_w[j]:.1f}]"
+
+    # 2. Unclear Data Check (CHECK strings parse to 0, so <= 0 covers both)
+    is_plate = _text(df, "type").str.contains("plate", regex=False).to_numpy()
+    missing = {
+        "diameter_mm": column_values(df, "diameter_mm") <= 0,
+        "thickness_mm": column_values(df, "thickness_mm") <= 0,
+        "length_mm": column_values(df, "length_mm") <= 0,
+        "width_mm": is_plate & (width <= 0),
+    }
+    for col in ("diameter_mm", "thickness_mm", "length_mm", "width_mm"):
+        if col in df.columns and df[col].dtype == object:
+            is_check = np.array([isinstance(v, str) and "CHECK" in v.upper() for v in df[col]])
+            if col == "width_mm":
+                is_check &= is_plate & ~fill_width    # Filled rib widths are no longer "CHECK"
+            missing[col] |= is_check
+    needs_check = missing["diameter_mm"] | missing["thickness_mm"] | missing["length_mm"] | missing["width_mm"]
+    for j in np.flatnonzero(needs_check):
+        if "⚠️" not in notes[j]:
+            cols = [c for c in ("diameter_mm", "thickness_mm", "length_mm", "width_mm") if missing[c][j]]
+            notes[j] = f"⚠️ CHECK: {', '.join(cols)} " + notes[j]
+    out["notes"] = [s.strip() for s in notes]
+    out["_priority"] = np.where(needs_check, 1, 2)
+    return out
+
+# --- Costs (shared by the app and the HTTP API) ---
+
+def price_frame(df: pd.DataFrame, pipe_price: float, plate_price: float, purchase_factor=None,
+                unit_prices=None) -> pd.DataFrame:
+    """
+    Adds "Material Unit Price (¥/kg)" and "Material Cost (¥)" to a calculated table.
+    purchase_factor: optional per-row purchased / net weight (stock-length yield, see
+    cutting.row_factors and nesting.row_factors); material is then charged on "Purchased Weight (kg)".
+    unit_prices: optional per-row ¥/kg (pricebook.Version.unit_prices) instead of pipe / plate price.
+    """
+    out = df.copy(deep=False)
+    if unit_prices is not None:
+        out["Material Unit Price (¥/kg)"] = np.asarray(unit_prices, dtype=np.float64)
+    else:
+        out["Material Unit Price (¥/kg)"] = np.where(pipe_mask(df), pipe_price, plate_price)
+    weight = out["Total Weight (kg)"]
+    if purchase_factor is not None:
+        weight = out["Purchased Weight (kg)"] = weight * np.asarray(purchase_factor, dtype=np.float64)
+    out["Material Cost (¥)"] = weight * out["Material Unit Price (¥/kg)"]
+    return out
+
+def weld_length_mm(df: pd.DataFrame) -> float:
+    """Total weld length of a table (formulas.WELD_LENGTH)."""
+    if len(df) == 0:
         return 0.0
+    values = {c: column_values(df, c) for c in ("diameter_mm", "length_mm", "width_mm")}
+    values["count"] = column_values(df, "count", default=1.0)
+    return float(formulas.weld_length(values).sum())
+
+def cost_breakdown(df: pd.DataFrame, rates: dict = None) -> dict:
+    """
+    Base cost and quotation of one pattern from its priced table (price_frame).
+    rates: see DEFAULT_RATES (missing keys use the defaults).
+    """
+    weight = df["Total Weight (kg)"].sum()
+    purchased = df["Purchased Weight (kg)"].sum() if "Purchased Weight (kg)" in df.columns else weight
+    return cost_totals(weight, df["Surface Area (m²)"].sum(), df["Material Cost (¥)"].sum(),
+                       weld_length_mm(df), rates, purchased)
+
+def cost_totals(weight, area, material, weld_len, rates: dict = None, purchased=None) -> dict:
+    """
+    cost_breakdown from a pattern's totals. Totals may be arrays (one entry per pattern,
+    e.g. pricebook.reprice); rates are scalars.
+    """
+    r = dict(DEFAULT_RATES, **(rates or {}))
+    purchased = weight if purchased is None else purchased
+    galvanizing = weight * r["galv_price"]
+    weld_h = (weld_len / (r["weld_speed_mm_min"] * 60)) if r["weld_speed_mm_min"] > 0 else 0
+    paint_h = (area / r["paint_eff_m2_h"]) if r["paint_eff_m2_h"] > 0 else 0
+    weld = weld_h * r["rate_weld"]
+    paint = paint_h * r["rate_paint"]
+    paint_material = area * r["price_paint_mat"]
+    base = material + galvanizing + (weld + paint) + paint_material
+    overhead = base * (r["rate_oh"] / 100)
+    contingency = base * (r["rate_risk"] / 100)
+    return {
+        "weight_kg": weight, "purchased_weight_kg": purchased, "area_m2": area, "material": material, "galvanizing": galvanizing,
+        "weld_length_mm": weld_len, "weld_hours": weld_h, "paint_hours": paint_h,
+        "weld": weld, "paint": paint, "labor": weld + paint, "paint_material": paint_material,
+        "base": base, "overhead": overhead, "contingency": contingency,
+        "quotation": base + overhead + contingency,
+    }
+
+def report_settings(costs: dict, rates: dict = None) -> dict:
+    """Settings of reports.generate_report_excel for a pattern's cost_breakdown."""
+    r = dict(DEFAULT_RATES, **(rates or {}))
+    return {
+        'galv_price': r["galv_price"],
+        'rate_weld': r["rate_weld"],
+        'rate_paint': r["rate_paint"],
+        'price_paint_mat': r["price_paint_mat"],
+        'time_weld': float(f"{costs['weld_hours']:.1f}"),
+        'time_paint': float(f"{costs['paint_hours']:.1f}"),
+        'rate_oh': r["rate_oh"],
+        'rate_risk': r["rate_risk"],
+    }
@@ -0,0 +1,257 @@
+# model.py
+# Typed Project Model (型付きプロジェクトデータ)
+# Components are kept as per-pattern column arrays (float32 dimensions, int16
+# counts, categorical type/name, uint8 uncertainty mask) instead of lists of
+# dicts. The editor, calculator, exporter and visualizer read DataFrame views.
+import numpy as np
+import pandas as pd
+import schema
+import parts
+
+DIM_COLUMNS = ("diameter_mm", "thickness_mm", "length_mm", "width_mm")
+INT_COLUMNS = ("count", "overlap_count")
+OPTIONAL_INT_COLUMNS = ("source_page", "region")   # 0 = not set; only shown when used
+CATEGORY_COLUMNS = ("type", "name")
+TRACE_COLUMNS = ("source_page", "source_bbox")     # Where a row was read from; not shown in the editor
+MASK_COLUMN = "_uncertain"
+EXACT_DECIMALS = 3   # float32 dimensions are reported back rounded to this
+
+# Calculated / display-only columns that are never stored
+DERIVED_COLUMNS = ("Unit Weight (kg)", "Total Weight (kg)", "Surface Area (m²)", "Purchased Weight (kg)",
+                   "Material Unit Price (¥/kg)", "Material Cost (¥)")
+
+def _int16(values) -> np.ndarray:
+    f = np.array([schema.to_float(v) for v in values], dtype=np.float64)
+    return np.clip(np.round(f), -32768, 32767).astype(np.int16)
+
+def _float32(values) -> np.ndarray:
+    return np.array([schema.to_float(v) for v in values], dtype=np.float32)
+
+def _column_float32(series: pd.Series) -> np.ndarray:
+    if series.dtype == object:
+        return _float32(series)
+    return np.nan_to_num(series.to_numpy(dtype=np.float32, na_value=0.0), nan=0.0, posinf=0.0, neginf=0.0)
+
+def _column_int16(series: pd.Series) -> np.ndarray:
+    if series.dtype == object:
+        return _int16(series)
+    f = np.nan_to_num(series.to_numpy(dtype=np.float64, na_value=0.0), nan=0.0, posinf=0.0, neginf=0.0)
+    return np.clip(np.round(f), -32768, 32767).astype(np.int16)
+
+def _text_values(series) -> list:
+    return ["" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v) for v in series]
+
+def exact(df: pd.DataFrame) -> pd.DataFrame:
+    """Copy with float32 columns widened and rounded, for exports (139.8 instead of 139.80000305)."""
+    out = df.copy()
+    for col in out.columns:
+        if out[col].dtype == np.float32:
+            out[col] = out[col].astype(np.float64).round(EXACT_DECIMALS)
+    return out
+
+class PatternTable:
+    """
+    One pattern: metadata dict (name, alerts, pages, quantity, ...) plus typed
+    component columns. Metadata is reachable like a dict (pattern["pattern_name"]).
+    """
+
+    def __init__(self, meta: dict, columns: dict, extra: dict = None):
+        self.meta = meta
+        self.columns = columns
+        self.extra = extra or {}     # Unknown per-row keys, kept as object lists
+
+    @classmethod
+    def from_pattern(cls, pattern: dict) -> "PatternTable":
+        meta = {k: v for k, v in pattern.items() if k != "components"}
+        table = cls(meta, {})
+        table.set_records(pattern.get("components", []))
+        return table
+
+    def set_records(self, components: list):
+        df = pd.DataFrame(components) if components else pd.DataFrame(columns=list(schema.COMPONENT_FIELDS))
+        if "overlap_count" not in df.columns:
+            df["overlap_count"] = [1 if "Overlap" in str(n) else 0 for n in df.get("notes", pd.Series([""] * len(df)))]
+        self.set_frame(df)
+
+    def mask_for(self, index) -> np.ndarray:
+        """
+        Uncertainty bits carried over to an edited table: rows keep the mask of the
+        stored row their index label points to; added rows start clean.
+        """
+        old = self.columns.get(MASK_COLUMN, np.zeros(0, dtype=np.uint8))
+        return np.array([old[k] if isinstance(k, (int, np.integer)) and 0 <= k < len(old) else 0 for k in index],
+                        dtype=np.uint8)
+
+    def trace_for(self, index) -> dict:
+        """
+        TRACE_COLUMNS carried over to an edited table like mask_for: rows keep the values
+        of the stored row their index label points to; added rows have none.
+        Returns {column: values aligned with index} for the columns the pattern has.
+        """
+        n = len(self)
+        out = {}
+        for col in TRACE_COLUMNS:
+            old = self.columns[col] if col in self.columns else self.extra.get(col)
+            if old is None:
+                continue
+            empty = 0 if col in self.columns else None
+            out[col] = [old[k] if isinstance(k, (int, np.integer)) and 0 <= k < n else empty for k in index]
+        return out
+
+    def set_frame(self, df: pd.DataFrame):
+        """Stores an (edited) component table, converting every column to its typed form."""
+        n = len(df)
+        cols = {}
+        for col in CATEGORY_COLUMNS:
+            cols[col] = pd.Categorical(_text_values(df[col]) if col in df.columns else [""] * n)
+        for col in DIM_COLUMNS:
+            cols[col] = _column_float32(df[col]) if col in df.columns else np.zeros(n, dtype=np.float32)
+        for col in INT_COLUMNS:
+            cols[col] = _column_int16(df[col]) if col in df.columns else np.full(n, 1 if col == "count" else 0, dtype=np.int16)
+        for col in OPTIONAL_INT_COLUMNS:
+            if col in df.columns:
+                cols[col] = _column_int16(df[col])
+        cols["notes"] = np.array(_text_values(df["notes"]) if "notes" in df.columns else [""] * n, dtype=object)
+        if MASK_COLUMN in df.columns:
+            cols[MASK_COLUMN] = _column_int16(df[MASK_COLUMN]).astype(np.uint8)
+        else:
+            cols[MASK_COLUMN] = np.zeros(n, dtype=np.uint8)
+
+        known = set(cols) | set(DERIVED_COLUMNS)
+        self.extra = {c: df[c].tolist() for c in df.columns
+                      if c not in known and not str(c).startswith("_")}
+        self.columns = cols
+
+    def __len__(self):
+        return len(self.columns.get("notes", ()))
+
+    # Dict-style access to the metadata (components are materialized on request)
+    def get(self, key, default=None):
+        if key == "components":
+            return self.records()
+        return self.meta.get(key, default)
+
+    def __getitem__(self, key):
+        if key == "components":
+            return self.records()
+        return self.meta[key]
+
+    def __setitem__(self, key, value):
+        if key == "components":
+            self.set_records(value)
+        else:
+            self.meta[key] = value
+
+    def frame(self, with_mask: bool = False) -> pd.DataFrame:
+        """
+        DataFrame over the stored arrays without copying them. Treat it as
+        read-only and write changes back with set_frame.
+        """
+        data = {c: self.columns[c] for c in CATEGORY_COLUMNS + DIM_COLUMNS + INT_COLUMNS}
+        data["notes"] = self.columns["notes"]
+        for col in OPTIONAL_INT_COLUMNS:
+            if col in self.columns and self.columns[col].any():
+                data[col] = self.columns[col]
+        for col, values in self.extra.items():
+            data[col] = values
+        if with_mask:
+            data[MASK_COLUMN] = self.columns[MASK_COLUMN]
+        return pd.DataFrame(data, copy=False)
+
+    def records(self) -> list:
+        """Plain component dicts (Python types), e.g. for saving or legacy helpers."""
+        n = len(self)
+        out = []
+        for j in range(n):
+            comp = {c: str(self.columns[c][j]) for c in CATEGORY_COLUMNS}
+            for c in DIM_COLUMNS:
+                comp[c] = round(float(self.columns[c][j]), EXACT_DECIMALS)
+            comp["count"] = float(self.columns["count"][j])
+            comp["notes"] = self.columns["notes"][j]
+            comp["overlap_count"] = int(self.columns["overlap_count"][j])
+            for c in OPTIONAL_INT_COLUMNS:
+                if c in self.columns and self.columns[c][j]:
+                    comp[c] = int(self.columns[c][j])
+            for c, values in self.extra.items():
+                comp[c] = values[j]
+            comp[MASK_COLUMN] = int(self.columns[MASK_COLUMN][j])
+            out.append(comp)
+        return out
+
+    def to_pattern(self) -> dict:
+        return dict(self.meta, components=self.records())
+
+    def signatures(self) -> list:
+        """parts.signature of every row, computed column-wise."""
+        text = []
+        for c in CATEGORY_COLUMNS:
+            cat = self.columns[c]
+            lowered = [str(v).strip().lower() for v in cat.categories]
+            text.append([lowered[k] if k >= 0 else "" for k in cat.codes])
+        dims = [[round(v, 1) for v in self.columns[c].tolist()] for c in DIM_COLUMNS]
+        return list(zip(*text, *dims))
+
+    def part_keys(self) -> list:
+        return [parts.key_of(sig) for sig in self.signatures()]
+
+    def nbytes(self) -> int:
+        total = 0
+        for values in self.columns.values():
+            total += values.nbytes if hasattr(values, "nbytes") else 0
+        return total
+
+class Project:
+    """The patterns of one estimation, each stored as a PatternTable."""
+
+    def __init__(self, patterns: list = None):
+        self.patterns = patterns or []
+
+    @classmethod
+    def from_patterns(cls, patterns: list) -> "Project":
+        """From normalized pattern dicts (analysis results, saved assets)."""
+        return cls([PatternTable.from_pattern(p) for p in patterns])
+
+    def to_patterns(self) -> list:
+        return [p.to_pattern() for p in self.patterns]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __getitem__(self, i):
+        return self.patterns[i]
+
+    def uses(self, key: str) -> list:
+        """(pattern index, row index) of every row that uses the part (see parts.part_key)."""
+        return [(i, j) for i, p in enumerate(self.patterns) for j, k in enumerate(p.part_keys()) if k == key]
+
+    def propagate(self, old_key: str, new_values: dict, skip_pattern: int = None) -> int:
+        """
+        Applies an edited part's signature fields to every other row with the old
+        signature, in place. Count and notes stay per pattern. Returns the number of rows changed.
+        """
+        changed = 0
+        for i, j in self.uses(old_key):
+            if i == skip_pattern:
+                continue
+            cols = self.patterns[i].columns
+            for c in CATEGORY_COLUMNS:
+                value = str(new_values.get(c, ""))
+                if value not in cols[c].categories:
+                    cols[c] = cols[c].add_categories([value])
+                cols[c][j] = value
+            for c in DIM_COLUMNS:
+                cols[c][j] = schema.to_float(new_values.get(c))
+            changed += 1
+        return changed
+
+    def unique_parts(self) -> int:
+        return len({sig for p in self.patterns for sig in p.signatures()})
+
+    def row_count(self) -> int:
+        return sum(len(p) for p in self.patterns)
+
+    def nbytes(self) -> int:
+        return sum(p.nbytes() for p in self.patterns)
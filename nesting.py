@@ -0,0 +1,202 @@
+# nesting.py
+# Plate Nesting on Standard Sheets (鋼板定尺の板取り)
+# Plate and rib rows of all patterns are grouped by thickness and nested on
+# standard sheets with a guillotine shelf packer: parts are laid in shelves of
+# decreasing height and the space above shorter parts is reused. Every sheet
+# size is tried per thickness and the cheapest is kept; the last sheet is
+# downsized when its parts fit a smaller one. The gross / net weight ratio of
+# each thickness feeds the material cost (logic.price_frame).
+import numpy as np
+import logic
+
+DEFAULT_SHEET_SIZES_MM = ((1219, 2438), (1524, 3048), (1829, 6096))   # 4x8, 5x10, 6x20 ft
+DEFAULT_GAP_MM = 5.0    # Cutting allowance between parts (gas / plasma kerf)
+
+def parse_sheets(text: str) -> tuple:
+    """Sheet sizes from text like "1219x2438, 1524 x 3048" (mm, long side second). Raises ValueError."""
+    sizes = set()
+    for item in text.replace("、", ",").replace(";", ",").split(","):
+        item = item.strip().lower().replace("×", "x").replace("*", "x")
+        if not item:
+            continue
+        parts = [v for v in item.replace(" ", "").split("x") if v]
+        if len(parts) != 2:
+            raise ValueError(f"'{item}' is not W x L.")
+        a, b = (int(round(float(v))) for v in parts)
+        if a <= 0 or b <= 0:
+            raise ValueError("Sheet sizes must be positive.")
+        sizes.add((min(a, b), max(a, b)))
+    if not sizes:
+        raise ValueError("Enter at least one sheet size (e.g. 1524x3048).")
+    return tuple(sorted(sizes, key=lambda s: (s[0] * s[1], s)))
+
+def group_keys(df) -> list:
+    """Thickness group of every row, rounded to 0.1 mm."""
+    return [round(t, 1) for t in logic.column_values(df, "thickness_mm").tolist()]
+
+def collect_pieces(frames: list, quantities: list = None) -> dict:
+    """
+    {thickness: {"items": {(w, l): count}, "net_mm2": area}} of the plate rows of calculated tables.
+    Triangular ribs of the same size are paired into one rectangle (two cuts on the diagonal);
+    net_mm2 counts ribs as half rectangles like logic.calculate_frame.
+    """
+    groups = {}
+    for n, df in enumerate(frames):
+        quantity = 1 if quantities is None else max(0, int(quantities[n]))
+        if not quantity or not len(df):
+            continue
+        plate = ~logic.pipe_mask(df)
+        rib = logic.rib_mask(df)
+        l = logic.column_values(df, "length_mm")
+        w = logic.column_values(df, "width_mm")
+        t = logic.column_values(df, "thickness_mm")
+        count = np.round(logic.column_values(df, "count", default=1.0)) * quantity
+        keys = group_keys(df)
+        for j in np.flatnonzero(plate & (l > 0) & (w > 0) & (t > 0) & (count > 0)):
+            g = groups.setdefault(keys[j], {"items": {}, "ribs": {}, "net_mm2": 0.0})
+            size = (int(np.ceil(min(l[j], w[j]))), int(np.ceil(max(l[j], w[j]))))
+            target = g["ribs"] if rib[j] else g["items"]
+            target[size] = target.get(size, 0) + int(count[j])
+            g["net_mm2"] += l[j] * w[j] * count[j] * (0.5 if rib[j] else 1.0)
+    for g in groups.values():
+        for size, n in g.pop("ribs").items():
+            g["items"][size] = g["items"].get(size, 0) + (n + 1) // 2
+    return groups
+
+def _orient(w: int, h: int, width: int, height: int):
+    """(across, up) of a part on a width x height sheet, short side up when it fits; None if too big."""
+    a, b = max(w, h), min(w, h)
+    if a <= width and b <= height:
+        return a, b
+    if b <= width and a <= height:
+        return b, a
+    return None
+
+def _pack(items: dict, sheet: tuple, gap: int) -> tuple:
+    """
+    Shelf packing of {(w, l): count} onto sheets of one size.
+    Returns ([[(x, y, w, h), ...] per sheet], {oversize (w, l): count}).
+    """
+    width, height = sheet[1] + gap, sheet[0] + gap      # Long side across; n parts need sum + (n - 1) x gap
+    laid, oversize = {}, {}
+    for (w, l), n in items.items():
+        o = _orient(w + gap, l + gap, width, height)
+        if o is None:
+            oversize[(w, l)] = oversize.get((w, l), 0) + n
+        else:
+            laid[o] = laid.get(o, 0) + n
+    sheets, tops = [], []       # Placements and used height of every sheet
+    shelves = []                # [sheet index, height, free slots [x, y, w, h]]
+    for w, h in sorted(laid, key=lambda wh: (wh[1], wh[0]), reverse=True):
+        n = laid[(w, h)]
+        k = 0
+        while n:
+            if k == len(shelves):
+                # New shelf as tall as this part on the first sheet with room, else a new sheet
+                s = next((i for i, top in enumerate(tops) if height - top >= h), len(tops))
+                if s == len(tops):
+                    sheets.append([])
+                    tops.append(0)
+                shelves.append([s, h, [[0, tops[s], width, h]]])
+                tops[s] += h
+            s, shelf_h, slots = shelves[k]
+            if shelf_h >= h:
+                i = 0
+                while n and i < len(slots):
+                    x, y, sw, sh = slots[i]
+                    if sw < w or sh < h:
+                        i += 1
+                        continue
+                    m = min(n, sw // w)
+                    sheets[s].extend((x + j * w, y, w - gap, h - gap) for j in range(m))
+                    n -= m
+                    # Guillotine split: the strip above the row and the rest of the slot
+                    slots[i:i + 1] = [r for r in ([x, y + h, m * w, sh - h], [x + m * w, y, sw - m * w, sh])
+                                      if r[2] > 0 and r[3] > 0]
+            k += 1
+    return sheets, oversize
+
+def _pieces_of(placed: list) -> dict:
+    items = {}
+    for _, _, w, h in placed:
+        size = (min(w, h), max(w, h))
+        items[size] = items.get(size, 0) + 1
+    return items
+
+def plan_group(group: dict, sheet_sizes=DEFAULT_SHEET_SIZES_MM, gap: float = DEFAULT_GAP_MM) -> dict:
+    """
+    Nesting plan of one thickness: every sheet size is packed and the one buying the least
+    area kept. Parts larger than every sheet are bought as cut-to-size plates.
+    Returns {"sheets": [(size, [(x, y, w, h)])], "oversize", "pieces", "gap", "net_mm2", "gross_mm2"}.
+    """
+    gap = int(np.ceil(gap))
+    sizes = sorted(sheet_sizes, key=lambda s: s[0] * s[1])
+    items = group["items"]
+    best = None
+    for size in sizes:
+        sheets, oversize = _pack(items, size, gap)
+        oversize_mm2 = sum(w * l * n for (w, l), n in oversize.items())
+        gross = len(sheets) * size[0] * size[1] + oversize_mm2
+        if best is None or (len(oversize), gross) < (len(best[2]), best[0]):
+            best = (gross, [(size, placed) for placed in sheets], oversize, oversize_mm2)
+    gross, sheets, oversize, oversize_mm2 = best
+    if sheets:
+        # The emptiest sheet moves to the smallest size holding all of its parts
+        last = min(range(len(sheets)), key=lambda i: sum(w * h for _, _, w, h in sheets[i][1]))
+        size, placed = sheets[last]
+        for smaller in sizes:
+            if smaller[0] * smaller[1] >= size[0] * size[1]:
+                break
+            repacked, over = _pack(_pieces_of(placed), smaller, gap)
+            if len(repacked) == 1 and not over:
+                sheets[last] = (smaller, repacked[0])
+                break
+    return {"sheets": sheets, "oversize": oversize, "pieces": sum(items.values()), "gap": gap,
+            "net_mm2": float(group["net_mm2"]),
+            "gross_mm2": float(sum(s[0] * s[1] for s, _ in sheets) + oversize_mm2)}
+
+def optimize(groups: dict, sheet_sizes=DEFAULT_SHEET_SIZES_MM, gap: float = DEFAULT_GAP_MM) -> dict:
+    """{thickness: plan_group(...)} for collect_pieces output."""
+    return {t: plan_group(g, sheet_sizes, gap) for t, g in sorted(groups.items())}
+
+def weight_per_mm2(thickness: float) -> float:
+    return thickness * logic.STEEL_DENSITY_PLATE_FACTOR / 1e6
+
+def row_factors(df, plans: dict) -> np.ndarray:
+    """Gross / net weight of every row (1.0 for rows outside the plans, e.g. pipes)."""
+    ratio = {t: p["gross_mm2"] / p["net_mm2"] for t, p in plans.items() if p["net_mm2"] > 0}
+    pipe = logic.pipe_mask(df)
+    return np.array([1.0 if is_pipe else ratio.get(t, 1.0) for t, is_pipe in zip(group_keys(df), pipe)])
+
+def summary(plans: dict) -> list:
+    """One row per thickness for display: sheets bought per size, utilization and weights."""
+    rows = []
+    for t, p in plans.items():
+        sizes = {}
+        for s, _ in p["sheets"]:
+            sizes[s] = sizes.get(s, 0) + 1
+        kg = weight_per_mm2(t)
+        rows.append({
+            "Thk (mm)": t, "Parts": p["pieces"],
+            "Sheets (定尺枚数)": ", ".join(f"{a:,} x {b:,} x {n}" for (a, b), n in sorted(sizes.items(), reverse=True)),
+            "Oversize (特寸)": sum(p["oversize"].values()),
+            "Utilization (%)": round(100 * p["net_mm2"] / p["gross_mm2"], 1) if p["gross_mm2"] else 0.0,
+            "Net (kg)": round(p["net_mm2"] * kg, 1), "Gross (kg)": round(p["gross_mm2"] * kg, 1),
+            "Offcut (kg)": round((p["gross_mm2"] - p["net_mm2"]) * kg, 1),
+        })
+    return rows
+
+def sheet_list(plans: dict) -> list:
+    """Identical sheet layouts merged: one row per (thickness, size, parts) with the number of sheets."""
+    counts = {}
+    for t, p in plans.items():
+        for s, placed in p["sheets"]:
+            layout = (t, s, tuple(sorted(_pieces_of(placed).items(), reverse=True)))
+            counts[layout] = counts.get(layout, 0) + 1
+    rows = []
+    for (t, s, parts), n in sorted(counts.items(), key=lambda kv: (kv[0][0], -kv[1])):
+        used = sum(w * l * k for (w, l), k in parts)
+        rows.append({"Thk (mm)": t, "Sheet (mm)": f"{s[0]:,} x {s[1]:,}", "Sheets": n,
+                     "Parts (mm)": " + ".join(f"{w:,} x {l:,} x {k}" for (w, l), k in parts),
+                     "Used (%)": round(100 * used / (s[0] * s[1]), 1)})
+    return rows
@@ -0,0 +1,51 @@
+# parts.py
+# Shared Component Catalog (共通部材の共有化)
+# The model repeats common details (e.g. "Standard Rib") in every pattern.
+# Components are keyed by their dimension signature: saved assets store each
+# unique part once and patterns refer to it with their own count / notes
+# (pack_patterns). Finding and editing shared parts: model.Project.uses / propagate.
+import hashlib
+import schema
+
+# Fields that define a part; count, notes, page / region references stay per pattern
+SIGNATURE_FIELDS = ("type", "name", "diameter_mm", "thickness_mm", "length_mm", "width_mm")
+
+def signature(comp) -> tuple:
+    """Dimension signature of a component (dict or pandas Series)."""
+    return (
+        str(comp.get("type", "") or "").strip().lower(),
+        str(comp.get("name", "") or "").strip().lower(),
+    ) + tuple(round(schema.to_float(comp.get(f)), 1) for f in SIGNATURE_FIELDS[2:])
+
+def key_of(sig: tuple) -> str:
+    return hashlib.sha1(repr(sig).encode()).hexdigest()[:12]
+
+def part_key(comp) -> str:
+    return key_of(signature(comp))
+
+def pack_patterns(patterns: list) -> dict:
+    """
+    Reference form for saving: {"parts": {key: part}, "patterns": [...]} where each
+    component is {"part": key, ...its own non-signature fields}.
+    """
+    parts = {}
+    packed = []
+    for p in patterns:
+        refs = []
+        for comp in p.get("components", []):
+            ref = {k: v for k, v in comp.items() if k not in SIGNATURE_FIELDS}
+            ref["part"] = key = part_key(comp)
+            if key not in parts:
+                parts[key] = {f: comp.get(f) for f in SIGNATURE_FIELDS}
+            refs.append(ref)
+        packed.append(dict(p, components=refs))
+    return {"parts": parts, "patterns": packed}
+
+def unpack_patterns(data: dict) -> list:
+    """Inverse of pack_patterns; plain {"patterns": [...]} data is returned unchanged."""
+    parts = data.get("parts")
+    if not parts:
+        return data.get("patterns", [])
+    return [dict(p, components=[dict(parts.get(ref.get("part"), {}), **{k: v for k, v in ref.items() if k != "part"})
+                                for ref in p.get("components", [])])
+            for p in data.get("patterns", [])]
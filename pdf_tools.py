@@ -0,0 +1,210 @@
+# pdf_tools.py
+# PDF Text-Layer Extraction (PDFテキスト層からの直接拾い出し)
+# CAD-exported PDFs carry dimensions like "φ318.5×6.0 L=5500" as real text.
+# These are parsed locally in milliseconds; only scanned / unclear pages go to the model.
+import io
+import re
+import hashlib
+import schema
+
+MIN_TEXT_CHARS = 40   # Fewer characters than this = no usable text layer (scan)
+MIN_COVERAGE = 0.9    # Share of a page's dimension-like tokens that must be parsed to skip the model
+
+_NUM = r"(\d+(?:,\d{3})*(?:\.\d+)?)"
+_X = r"\s*[×xX*＊]\s*"
+
+# φ318.5×6.0 L=5500 / Φ318.5x6 / STK400 318.5×6.0
+PIPE_RE = re.compile(
+    r"(?:[φΦøØ⌀]|STKR?\s*\d{3}\s*[-φΦ]?)\s*" + _NUM + _X + r"t?\s*=?\s*" + _NUM +
+    r"(?:[^\S\n]*[-,]?[^\S\n]*L\s*=\s*" + _NUM + r")?"
+)
+# PL-25×600×600 / PL25x600x600 (thickness × width × length)
+PLATE_RE = re.compile(r"PL\s*[-ー]?\s*" + _NUM + _X + _NUM + _X + _NUM, re.IGNORECASE)
+# Quantity right after a notation: "-8枚", " 2本", " x 4 pcs", " n=8"
+QTY_RE = re.compile(r"^[^\S\n]*(?:[-×xX][^\S\n]*)?(\d+)[^\S\n]*(?:枚|本|個|ヶ所|箇所|pcs|PCS|EA)|^[^\S\n]*[nN]\s*=\s*(\d+)")
+# Pattern headers: "TYPE-A", "Type B", "Mk-1", "MK.2", "A型"
+PATTERN_RE = re.compile(r"\b(?:TYPE|Type)[\s\-]*([A-Z0-9]{1,4})\b|\b(?:MK|Mk|mk)[\s\-\.]*(\d{1,3}[A-Z]?)\b|([A-Z]{1,2}\d{0,2})型")
+
+# Dimension-like tokens, parsed or not: "φ318", "PL-25", "6.0×600", "L=5500", "t=9", "450mm"
+DIM_TOKEN_RE = re.compile(r"[φΦøØ⌀]\s*\d|(?i:PL)\s*[-ー]?\s*\d|\d\s*[×xX*＊]\s*\d|\b[LtT]\s*=\s*\d|\d\s*mm\b")
+
+_RIB_WORDS = ("RIB", "リブ")
+_BASE_WORDS = ("BASE", "ベース", "B.PL", "BPL")
+
+def _pypdf():
+    try:
+        import pypdf
+        return pypdf
+    except ImportError:
+        return None
+
+def page_texts(pdf_bytes: bytes):
+    """Returns the text layer of each page, or None if pypdf is not installed / the PDF is unreadable."""
+    pypdf = _pypdf()
+    if pypdf is None:
+        return None
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+        return [page.extract_text() or "" for page in reader.pages]
+    except Exception:
+        return None
+
+def subset_pdf(pdf_bytes: bytes, pages: list) -> bytes:
+    """Builds a new PDF containing only the given 1-based pages."""
+    pypdf = _pypdf()
+    reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    writer = pypdf.PdfWriter()
+    for n in pages:
+        writer.add_page(reader.pages[n - 1])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+def page_hashes(pdf_bytes: bytes):
+    """
+    Content hash of each page: drawing operators, page size and embedded images.
+    Independent of page order and of metadata/producer changes in the file.
+    Returns None if the PDF cannot be read.
+    """
+    pypdf = _pypdf()
+    if pypdf is None:
+        return None
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+        hashes = []
+        for page in reader.pages:
+            h = hashlib.sha256()
+            contents = page.get_contents()
+            h.update(contents.get_data() if contents is not None else b"")
+            h.update(repr([float(v) for v in page.mediabox]).encode())
+            resources = page.get("/Resources")
+            xobjects = resources.get_object().get("/XObject") if resources else None
+            if xobjects:
+                for name in sorted(xobjects.get_object().keys()):
+                    h.update(name.encode())
+                    h.update(xobjects.get_object()[name].get_object().get_data())
+            hashes.append(h.hexdigest())
+        return hashes
+    except Exception:
+        return None
+
+def _quantity(line: str, end: int) -> int:
+    m = QTY_RE.match(line[end:end + 16])
+    if not m:
+        return 1
+    return int(m.group(1) or m.group(2))
+
+def _line_label(line: str, start: int) -> str:
+    """Text before the notation on the same line, used as the component name."""
+    label = line[:start].strip(" :：-・\t")
+    return label[-40:] if label else ""
+
+def parse_components(text: str, page: int = 1) -> list:
+    """
+    Parses pipe / plate / rib dimension notations from one page of text.
+    Returns [(pattern_name or None, raw component dict)] in reading order.
+    """
+    found = []
+    current = None
+    for line in text.splitlines():
+        header = PATTERN_RE.search(line)
+        if header:
+            key = next(g for g in header.groups() if g)
+            current = f"Type {key}" if "型" not in header.group(0) else f"{key}型"
+            if header.group(0).upper().startswith("MK"):
+                current = f"Mk-{key}"
+
+        for m in PIPE_RE.finditer(line):
+            d, t, l = (schema.to_float(g) if g else 0.0 for g in m.groups())
+            label = _line_label(line, m.start())
+            found.append((current, {
+                "type": "Pipe", "name": label or "Pipe",
+                "diameter_mm": d, "thickness_mm": t, "length_mm": l, "width_mm": 0,
+                "count": _quantity(line, m.end()),
+                "notes": "Overlap connection" if ("差込" in line or "OVERLAP" in line.upper()) else "",
+                "source_page": page,
+            }))
+
+        for m in PLATE_RE.finditer(line):
+            t, w, l = (schema.to_float(g) for g in m.groups())
+            label = _line_label(line, m.start())
+            upper = line.upper()
+            if any(k in upper for k in _RIB_WORDS):
+                name = label or "Rib"
+                if "rib" not in name.lower():
+                    name = f"Rib {name}".strip()
+            elif any(k in upper for k in _BASE_WORDS):
+                name = "Base Plate"
+            else:
+                name = label or "Plate"
+            found.append((current, {
+                "type": "Plate", "name": name,
+                "diameter_mm": 0, "thickness_mm": t, "length_mm": l, "width_mm": w,
+                "count": _quantity(line, m.end()), "notes": "", "source_page": page,
+            }))
+    return found
+
+def dimension_coverage(text: str) -> tuple:
+    """(parsed, total) dimension-like tokens of a page; parsed ones lie inside a pipe / plate notation."""
+    parsed = total = 0
+    for line in text.splitlines():
+        spans = [m.span() for regex in (PIPE_RE, PLATE_RE) for m in regex.finditer(line)]
+        for token in DIM_TOKEN_RE.finditer(line):
+            total += 1
+            parsed += any(start <= token.start() < end for start, end in spans)
+    return parsed, total
+
+def extract_patterns(pdf_bytes: bytes):
+    """
+    Local extraction from the PDF text layer.
+    Returns None if no text layer can be read, else:
+        {"patterns": [normalized patterns], "pages": [{"page", "chars", "hits", "coverage", "confident"}]}
+    A page is confident when it has a text layer, at least MIN_COVERAGE of its
+    dimension-like tokens were parsed and no critical value is uncertain (0).
+    """
+    texts = page_texts(pdf_bytes)
+    if texts is None:
+        return None
+
+    patterns = {}
+    order = []
+    pages = []
+    last_name = None
+    for n, text in enumerate(texts, start=1):
+        chars = len(text.strip())
+        hits = parse_components(text, page=n) if chars >= MIN_TEXT_CHARS else []
+        parsed, total = dimension_coverage(text) if hits else (0, 0)
+        coverage = parsed / total if total else 0.0
+        page_ok = bool(hits) and coverage >= MIN_COVERAGE
+        for name, comp in hits:
+            # Components before any header continue the previous page's pattern
+            name = name or last_name or f"Page {n}"
+            last_name = name
+            if name not in patterns:
+                patterns[name] = {"pattern_name": name, "validation_alerts": [], "components": [], "source_pages": []}
+                order.append(name)
+            norm = schema.normalize_component(comp)
+            if norm["_uncertain"]:
+                page_ok = False
+                patterns[name]["validation_alerts"].append(f"Page {n}: {norm['name']} {', '.join(schema.uncertain_fields(norm))} unclear")
+            patterns[name]["components"].append(norm)
+            if n not in patterns[name]["source_pages"]:
+                patterns[name]["source_pages"].append(n)
+        pages.append({"page": n, "chars": chars, "hits": len(hits), "coverage": round(coverage, 3), "confident": page_ok})
+
+    return {"patterns": schema.normalize_patterns([patterns[k] for k in order]), "pages": pages}
+
+def merge_pattern_lists(primary: list, extra: list) -> list:
+    """Appends components of same-named patterns; new pattern names are added at the end."""
+    merged = [dict(p, components=list(p.get("components", []))) for p in primary]
+    by_name = {p["pattern_name"].strip().lower(): p for p in merged}
+    for p in extra:
+        target = by_name.get(p["pattern_name"].strip().lower())
+        if target is None:
+            merged.append(p)
+            by_name[p["pattern_name"].strip().lower()] = p
+            continue
+        target["components"].extend(p.get("components", []))
+        target["source_pages"] = sorted(set(target.get("source_pages", [])) | set(p.get("source_pages", [])))
+        target["validation_alerts"] = list(target.get("validation_alerts", [])) + list(p.get("validation_alerts", []))
+    return merged
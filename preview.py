@@ -0,0 +1,95 @@
+# preview.py
+# Drawing Preview Rendering (図面プレビュー)
+# Decodes an upload once, downscales it to display size and renders PDF pages
+# one at a time, so reruns never re-send the full-resolution file to the browser.
+import io
+import hashlib
+from PIL import Image
+import pdf_tools
+
+PREVIEW_MAX_PX = 1400   # Long side of the main preview
+THUMB_PX = 160          # Long side of a page thumbnail
+THUMB_WINDOW = 6        # Thumbnails shown around the selected page
+
+def _pdfium():
+    """pypdfium2 renders vector pages to images; optional."""
+    try:
+        import pypdfium2
+        return pypdfium2
+    except ImportError:
+        return None
+
+def content_key(data: bytes) -> str:
+    """Stable cache key for an upload's content."""
+    return hashlib.sha1(data).hexdigest()
+
+def _to_jpeg(image: Image.Image, max_px: int) -> bytes:
+    image = image.copy()
+    image.thumbnail((max_px, max_px))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=88)
+    return out.getvalue()
+
+def image_preview(data: bytes, max_px: int = PREVIEW_MAX_PX) -> bytes:
+    """Downscaled JPEG of an image upload."""
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (max_px, max_px))   # JPEG: decode at reduced size directly
+    return _to_jpeg(image, max_px)
+
+def pdf_page_count(data: bytes) -> int:
+    pypdf = pdf_tools._pypdf()
+    if pypdf is None:
+        return 0
+    try:
+        return len(pypdf.PdfReader(io.BytesIO(data)).pages)
+    except Exception:
+        return 0
+
+def render_pdf_page(data: bytes, page: int, max_px: int = PREVIEW_MAX_PX):
+    """
+    Renders one 1-based page.
+    Returns ("image", jpeg bytes) with pypdfium2, else ("pdf", single-page PDF bytes)
+    for the PDF viewer, or (None, None) if the page cannot be read.
+    """
+    pdfium = _pdfium()
+    if pdfium is not None:
+        try:
+            doc = pdfium.PdfDocument(data)
+            pdf_page = doc[page - 1]
+            w, h = pdf_page.get_size()
+            bitmap = pdf_page.render(scale=max_px / max(w, h))
+            return "image", _to_jpeg(bitmap.to_pil(), max_px)
+        except Exception:
+            pass
+    try:
+        return "pdf", pdf_tools.subset_pdf(data, [page])
+    except Exception:
+        return None, None
+
+def pdf_thumbnail(data: bytes, page: int, max_px: int = THUMB_PX):
+    """
+    JPEG thumbnail of one page, or None when it cannot be rendered.
+    Without pypdfium2, scanned pages use their embedded image and vector pages get none.
+    """
+    kind, content = render_pdf_page(data, page, max_px) if _pdfium() is not None else (None, None)
+    if kind == "image":
+        return content
+    pypdf = pdf_tools._pypdf()
+    if pypdf is None:
+        return None
+    try:
+        pdf_page = pypdf.PdfReader(io.BytesIO(data)).pages[page - 1]
+        best = None
+        for img in pdf_page.images:
+            if best is None or img.image.size[0] * img.image.size[1] > best.size[0] * best.size[1]:
+                best = img.image
+        return _to_jpeg(best, max_px) if best is not None else None
+    except Exception:
+        return None
+
+def thumbnail_window(selected: int, n_pages: int, size: int = THUMB_WINDOW) -> list:
+    """1-based pages of the thumbnail strip, centred on the selected page."""
+    start = max(1, min(selected - size // 2, n_pages - size + 1))
+    return list(range(start, min(n_pages, start + size - 1) + 1))
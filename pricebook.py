@@ -0,0 +1,282 @@
+# pricebook.py
+# Versioned Price Book (単価表・改定履歴)
+# Unit prices by effective date, material (pipe / plate) and size band: pipes
+# are banded by diameter, plates and ribs by thickness. Versions are looked up
+# by date with bisect and bands with a vectorized searchsorted; the version used
+# is stamped onto saved assets, and whole archives can be re-priced against
+# another version in one pass with a before / after delta report. numpy is
+# loaded on the first band lookup, so the app's sidebar can read the book cheaply.
+#
+#   python pricebook.py reprice archive/*.json --version 2026-10 --out delta.xlsx
+import os
+import json
+import argparse
+from bisect import bisect_right
+from datetime import date
+
+PRICE_BOOK_FILE = os.environ.get("ESTIMATOR_PRICE_BOOK") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_book.json")
+
+# Sidebar defaults of the cost settings (the built-in version when there is no price-book file)
+DEFAULT_RATES = {
+    "pipe_price": 311,          # ¥/kg
+    "plate_price": 396,         # ¥/kg
+    "galv_price": 85,           # ¥/kg
+    "rate_weld": 4244,          # ¥/h
+    "rate_paint": 12530,        # ¥/h
+    "price_paint_mat": 1700,    # ¥/m²
+    "weld_speed_mm_min": 50,
+    "paint_eff_m2_h": 1.5,
+    "rate_oh": 20,              # %
+    "rate_risk": 5,             # %
+}
+BAND_COLUMNS = {"pipe": "diameter_mm", "plate": "thickness_mm"}   # Plates include ribs
+UNSTAMPED = "(unstamped)"
+
+class Version:
+    """
+    One price-book version: rates (DEFAULT_RATES keys; pipe / plate prices are the fallback)
+    and bands {"pipe" | "plate": [{"max_mm": upper bound or None, "price": ¥/kg}, ...]}.
+    """
+
+    def __init__(self, name: str, effective: str, rates: dict = None, bands: dict = None):
+        self.name = str(name)
+        self.effective = date.fromisoformat(str(effective)[:10])
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.bands = {}
+        self._index = {}    # material -> (upper bounds, prices) arrays, built on the first unit_prices call
+        for material, rows in (bands or {}).items():
+            if material not in BAND_COLUMNS:
+                raise ValueError(f"Unknown band material '{material}' (use {', '.join(BAND_COLUMNS)}).")
+            rows = sorted(({"max_mm": r.get("max_mm"), "price": float(r["price"])} for r in rows),
+                          key=lambda r: float("inf") if r["max_mm"] is None else float(r["max_mm"]))
+            self.bands[material] = rows
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Version":
+        return cls(data["name"], data["effective"], data.get("rates"), data.get("bands"))
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "effective": self.effective.isoformat(), "rates": self.rates, "bands": self.bands}
+
+    @classmethod
+    def from_stamp(cls, stamp: dict) -> "Version":
+        """Pricing stamped on a saved asset (the built-in defaults for assets saved before stamping)."""
+        if not stamp:
+            return cls(UNSTAMPED, "2000-01-01")
+        return cls(stamp.get("name") or UNSTAMPED, stamp.get("effective") or "2000-01-01",
+                   stamp.get("rates"), stamp.get("bands"))
+
+    def stamp(self, rates: dict = None) -> dict:
+        """Asset "pricing" entry; rates are the values actually used (sidebar edits included)."""
+        return dict(self.to_dict(), rates=dict(self.rates, **(rates or {})))
+
+    def with_rates(self, rates: dict) -> "Version":
+        return Version(self.name, self.effective.isoformat(), dict(self.rates, **rates), self.bands)
+
+    def band_label(self, material: str) -> str:
+        unit = "Ø" if material == "pipe" else "t"
+        parts, low = [], 0.0
+        for r in self.bands.get(material, []):
+            high = r["max_mm"]
+            parts.append(f"{unit}{low:g}-{'' if high is None else f'{high:g}'}: ¥{r['price']:g}")
+            low = high if high is not None else low
+        return ", ".join(parts)
+
+    def unit_prices(self, df):
+        """Material ¥/kg of every row (ndarray): its band price, else the version's pipe / plate price."""
+        import numpy as np
+        import logic
+        if len(self._index) != len(self.bands):
+            self._index = {m: (np.array([np.inf if r["max_mm"] is None else float(r["max_mm"]) for r in rows]),
+                               np.array([r["price"] for r in rows])) for m, rows in self.bands.items()}
+        pipe = logic.pipe_mask(df)
+        prices = np.where(pipe, float(self.rates["pipe_price"]), float(self.rates["plate_price"]))
+        for material, rows in (("pipe", pipe), ("plate", ~pipe)):
+            if material not in self._index:
+                continue
+            bounds, band_prices = self._index[material]
+            size = logic.column_values(df, BAND_COLUMNS[material])
+            k = np.searchsorted(bounds, size, side="left")     # First band with max_mm >= size
+            hit = rows & (size > 0) & (k < len(bounds))
+            prices[hit] = band_prices[k[hit]]
+        return prices
+
+class PriceBook:
+    """Versions sorted by effective date."""
+
+    def __init__(self, versions: list):
+        if not versions:
+            versions = [Version("standard", "2000-01-01")]
+        self.versions = sorted(versions, key=lambda v: (v.effective, v.name))
+        self._dates = [v.effective for v in self.versions]
+        names = [v.name for v in self.versions]
+        if len(set(names)) != len(names):
+            raise ValueError("Price-book version names must be unique.")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceBook":
+        return cls([Version.from_dict(v) for v in data.get("versions", [])])
+
+    def to_dict(self) -> dict:
+        return {"versions": [v.to_dict() for v in self.versions]}
+
+    def names(self) -> list:
+        return [v.name for v in self.versions]
+
+    def get(self, name: str) -> Version:
+        for v in self.versions:
+            if v.name == name:
+                return v
+        raise KeyError(f"No price-book version '{name}' (have {', '.join(self.names())}).")
+
+    def version_at(self, when: date = None) -> Version:
+        """The version in effect on a date (the earliest one before any effective date)."""
+        k = bisect_right(self._dates, when or date.today())
+        return self.versions[max(k - 1, 0)]
+
+def load(path: str = PRICE_BOOK_FILE) -> PriceBook:
+    """Price book from JSON ({"versions": [...]}); the built-in defaults when the file does not exist."""
+    if not os.path.exists(path):
+        return PriceBook([])
+    with open(path, encoding="utf-8") as f:
+        return PriceBook.from_dict(json.load(f))
+
+_cache = {}
+
+def load_cached(path: str = PRICE_BOOK_FILE) -> PriceBook:
+    """load(), re-read only when the file changes (app reruns)."""
+    key = (path, os.path.getmtime(path)) if os.path.exists(path) else (path, None)
+    if _cache.get("key") != key:
+        _cache["book"], _cache["key"] = load(path), key
+    return _cache["book"]
+
+# --- Bulk re-pricing of saved assets ---
+
+def reprice(assets: list, version: Version, names: list = None) -> tuple:
+    """
+    Before / after costs of saved assets ({"meta", "patterns", "pricing"}, see app Save Asset)
+    against a price-book version. All rows of all assets are calculated and priced in one
+    pass; "before" uses each asset's stamped pricing. Material is charged on the purchased
+    weight stamped with the asset (pricing "purchase_factors"), net weight for older assets.
+    names: asset ids for the report (file names), "Asset 1", ... by default.
+    Returns (per-pattern DataFrame, per-asset DataFrame).
+    """
+    import numpy as np
+    import pandas as pd
+    import logic
+    import schema
+    import parts
+    import formulas
+
+    records, patterns, olds, factors = [], [], {}, []
+    for a, asset in enumerate(assets):
+        stamp = asset.get("pricing")
+        old = Version.from_stamp(stamp)
+        old_key = json.dumps(old.to_dict(), sort_keys=True)
+        olds.setdefault(old_key, old)
+        asset_id = names[a] if names else f"Asset {a + 1}"
+        project = asset.get("meta", {}).get("project_name") or asset_id
+        stamped = (stamp or {}).get("purchase_factors") or []
+        for k, pattern in enumerate(parts.unpack_patterns(asset)):
+            pid = len(patterns)
+            components = pattern.get("components", [])
+            patterns.append({"Asset": asset_id, "Project": project, "Pattern": pattern.get("pattern_name", f"Pattern {pid + 1}"),
+                             "Qty": max(0, int(schema.to_float(pattern.get("quantity", 1)))),
+                             "Old Version": old.name, "_old": old_key})
+            records += [dict(c, _pattern=pid) for c in components]
+            f = stamped[k] if k < len(stamped) else None
+            factors += f if f and len(f) == len(components) else [1.0] * len(components)
+    columns = ["Asset", "Project", "Pattern", "Qty", "Weight (kg)", "Old Version", "New Version",
+               "Old Material (¥)", "New Material (¥)", "Old Quote (¥)", "New Quote (¥)", "Delta (¥)", "Delta (%)"]
+    if not patterns:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=[c for c in columns if c not in ("Pattern", "Qty")])
+
+    df = pd.DataFrame(records) if records else pd.DataFrame({"_pattern": []})
+    pid = df["_pattern"].to_numpy(dtype=np.int64)
+    if len(df):
+        df = logic.calculate_frame(logic.validate_frame(df, *logic.rib_context_groups(df, pid)))
+    n = len(patterns)
+    old_key_of_row = np.array([patterns[p]["_old"] for p in pid.tolist()], dtype=object)
+
+    def per_pattern(values):
+        return np.bincount(pid, weights=values, minlength=n)
+
+    weight = logic.column_values(df, "Total Weight (kg)")
+    purchased = weight * np.asarray(factors, dtype=np.float64)
+    values = {c: logic.column_values(df, c) for c in ("diameter_mm", "length_mm", "width_mm")}
+    values["count"] = logic.column_values(df, "count", default=1.0)
+    totals = {"weight": per_pattern(weight), "area": per_pattern(logic.column_values(df, "Surface Area (m²)")),
+              "weld": per_pattern(formulas.weld_length(values)) if len(df) else np.zeros(n)}
+
+    # New prices: one vectorized lookup over every row
+    new_material = per_pattern(purchased * version.unit_prices(df)) if len(df) else np.zeros(n)
+    new = logic.cost_totals(totals["weight"], totals["area"], new_material, totals["weld"], version.rates)
+
+    # Old prices: one lookup per distinct stamped version
+    old_material, old_quote = np.zeros(n), np.zeros(n)
+    pattern_old = np.array([p["_old"] for p in patterns], dtype=object)
+    for key, old in olds.items():
+        rows = old_key_of_row == key
+        material = per_pattern(np.where(rows, purchased * old.unit_prices(df), 0.0)) if len(df) else np.zeros(n)
+        sel = pattern_old == key
+        quote = logic.cost_totals(totals["weight"], totals["area"], material, totals["weld"], old.rates)["quotation"]
+        old_material[sel], old_quote[sel] = material[sel], np.asarray(quote)[sel]
+
+    qty = np.array([p["Qty"] for p in patterns], dtype=np.float64)
+    out = pd.DataFrame([{k: v for k, v in p.items() if k != "_old"} for p in patterns])
+    out["Weight (kg)"] = np.round(totals["weight"] * qty, 1)
+    out["New Version"] = version.name
+    out["Old Material (¥)"] = np.round(old_material * qty)
+    out["New Material (¥)"] = np.round(new_material * qty)
+    out["Old Quote (¥)"] = np.round(old_quote * qty)
+    out["New Quote (¥)"] = np.round(np.asarray(new["quotation"]) * qty)
+    out["Delta (¥)"] = out["New Quote (¥)"] - out["Old Quote (¥)"]
+    out["Delta (%)"] = (100 * out["Delta (¥)"] / out["Old Quote (¥)"].where(out["Old Quote (¥)"] != 0)).round(2)
+    out = out[columns]
+
+    sums = ["Weight (kg)", "Old Material (¥)", "New Material (¥)", "Old Quote (¥)", "New Quote (¥)", "Delta (¥)"]
+    # Per asset: saved projects often share a name (e.g. the default one)
+    projects = out.groupby("Asset", sort=False).agg(
+        {"Project": "first", **{c: "sum" for c in sums}, "Old Version": "first", "New Version": "first"}).reset_index()
+    projects["Delta (%)"] = (100 * projects["Delta (¥)"] / projects["Old Quote (¥)"].where(projects["Old Quote (¥)"] != 0)).round(2)
+    projects = projects[["Asset", "Project", "Weight (kg)", "Old Version", "New Version", *sums[1:], "Delta (%)"]]
+    return out, projects
+
+def delta_workbook(patterns, projects) -> bytes:
+    """Re-pricing delta report (Excel): projects and patterns sheets."""
+    import pandas as pd
+    from io import BytesIO
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        projects.to_excel(writer, sheet_name="Projects", index=False)
+        patterns.to_excel(writer, sheet_name="Patterns", index=False)
+        for sheet in writer.sheets.values():
+            sheet.set_column(0, 2, 24)
+            sheet.set_column(3, 13, 15)
+    return output.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Price book tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rp = sub.add_parser("reprice", help="Re-price saved assets against a price-book version")
+    rp.add_argument("assets", nargs="+", help="Saved asset JSON files")
+    rp.add_argument("--version", help="Version name (default: the one in effect today)")
+    rp.add_argument("--book", default=PRICE_BOOK_FILE)
+    rp.add_argument("--out", default="reprice_delta.xlsx")
+    args = parser.parse_args()
+
+    book = load(args.book)
+    version = book.get(args.version) if args.version else book.version_at()
+    assets = []
+    for path in args.assets:
+        with open(path, encoding="utf-8") as f:
+            assets.append(json.load(f))
+    patterns, projects = reprice(assets, version, [os.path.basename(p) for p in args.assets])
+    with open(args.out, "wb") as f:
+        f.write(delta_workbook(patterns, projects))
+    total_old, total_new = projects["Old Quote (¥)"].sum(), projects["New Quote (¥)"].sum()
+    print(f"{len(projects)} assets / {len(patterns)} patterns re-priced with '{version.name}': "
+          f"¥{total_old:,.0f} -> ¥{total_new:,.0f} ({total_new - total_old:+,.0f}). Report: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# quality.py
+# Drawing Quality Gate (図面品質チェック)
+# Cheap local metrics (sharpness, effective DPI, contrast) computed before an
+# AI call, so blurry photos and low-DPI scans are caught on upload. numpy and
+# PIL are loaded on the first measurement; the thresholds are read by the sidebar.
+import io
+import pdf_tools
+
+MAX_WORK_PX = 2000              # Metrics are computed on at most this many px (long side)
+ASSUMED_SHEET_MM = 420.0        # Long side of an A3 sheet, used when the file has no DPI info
+
+# (warn below, block below)
+DEFAULT_THRESHOLDS = {
+    "sharpness": (25.0, 8.0),    # RMS Laplacian response on edge pixels
+    "dpi": (150.0, 72.0),        # Effective scan resolution
+    "contrast": (80.0, 35.0),    # Paper (90th pct) minus ink (0.1th pct) grey level
+}
+
+LABELS = {
+    "sharpness": "Sharpness (鮮明度)",
+    "dpi": "Effective DPI (解像度)",
+    "contrast": "Contrast (コントラスト)",
+}
+
+def edge_sharpness(gray) -> float:
+    """
+    RMS of the Laplacian over edge pixels only (gray: uint8 ndarray). Unlike the plain
+    Laplacian variance this does not depend on how much of the sheet is blank paper.
+    """
+    import numpy as np
+    g = gray.astype(np.float32)
+    lap = g[:-2, 1:-1] + g[2:, 1:-1] + g[1:-1, :-2] + g[1:-1, 2:] - 4.0 * g[1:-1, 1:-1]
+    edges = np.abs(lap) > 4.0
+    if not edges.any():
+        return 0.0
+    return float(np.sqrt(np.mean(lap[edges] ** 2)))
+
+def image_metrics(image, sheet_long_side_in: float = None) -> dict:
+    """
+    Measures one PIL image. sheet_long_side_in is the physical long side of the page
+    (from the PDF page size); otherwise the file's DPI tag or an A3 sheet is assumed.
+    """
+    import numpy as np
+    from PIL import Image
+    w, h = image.size
+    if sheet_long_side_in:
+        dpi = max(w, h) / sheet_long_side_in
+    elif image.info.get("dpi"):
+        dpi = float(min(image.info["dpi"]))
+    else:
+        dpi = max(w, h) / (ASSUMED_SHEET_MM / 25.4)
+
+    gray = image.convert("L")
+    scale = min(1.0, MAX_WORK_PX / max(w, h))
+    if scale < 1.0:
+        gray = gray.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
+    arr = np.asarray(gray, dtype=np.uint8)
+    ink, paper = np.percentile(arr, [0.1, 90]) if arr.size else (0, 0)
+    return {
+        "sharpness": round(edge_sharpness(arr), 1) if min(arr.shape) > 2 else 0.0,
+        "dpi": round(dpi, 0),
+        "contrast": round(float(paper - ink), 1),
+        "size_px": (w, h),
+    }
+
+def grade(metrics: dict, thresholds: dict = None) -> dict:
+    """
+    Returns {"level": "ok" | "warn" | "block", "reasons": [...], "metrics": metrics}.
+    Vector pages (text layer) are always ok.
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    if metrics.get("vector"):
+        return {"level": "ok", "reasons": [], "metrics": metrics}
+    if metrics.get("empty"):
+        return {"level": "warn", "reasons": ["No text layer or scanned image found on this page"], "metrics": metrics}
+    level = "ok"
+    reasons = []
+    for key, (warn_below, block_below) in thresholds.items():
+        value = metrics.get(key)
+        if value is None:
+            continue
+        if value < block_below:
+            level = "block"
+            reasons.append(f"{LABELS[key]}: {value:g} < {block_below:g}")
+        elif value < warn_below:
+            level = "warn" if level == "ok" else level
+            reasons.append(f"{LABELS[key]}: {value:g} < {warn_below:g}")
+    return {"level": level, "reasons": reasons, "metrics": metrics}
+
+def pdf_page_metrics(pdf_bytes: bytes) -> list:
+    """
+    Per-page metrics of a PDF. Pages with a text layer count as vector (always ok);
+    scanned pages are measured on their largest embedded image.
+    """
+    pypdf = pdf_tools._pypdf()
+    if pypdf is None:
+        return []
+    reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    results = []
+    for n, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if len(text.strip()) >= pdf_tools.MIN_TEXT_CHARS:
+            results.append({"page": n, "vector": True})
+            continue
+        long_side_in = max(float(page.mediabox.width), float(page.mediabox.height)) / 72.0
+        best = None
+        try:
+            for img in page.images:
+                if best is None or img.image.size[0] * img.image.size[1] > best.size[0] * best.size[1]:
+                    best = img.image
+        except Exception:
+            best = None
+        if best is None:
+            results.append({"page": n, "empty": True})
+            continue
+        m = image_metrics(best, sheet_long_side_in=long_side_in)
+        m["page"] = n
+        results.append(m)
+    return results
+
+def assess(data: bytes, mime_type: str, thresholds: dict = None) -> list:
+    """Grades every page of an upload. Returns [{"page", "level", "reasons", "metrics"}]."""
+    if mime_type == "application/pdf":
+        pages = pdf_page_metrics(data)
+    else:
+        from PIL import Image
+        image = Image.open(io.BytesIO(data))
+        m = image_metrics(image)
+        m["page"] = 1
+        pages = [m]
+    graded = []
+    for m in pages:
+        g = grade(m, thresholds)
+        g["page"] = m["page"]
+        graded.append(g)
+    return graded
+
+def gate(data: bytes, mime_type: str, thresholds: dict = None) -> tuple:
+    """(worst level, reasons with page numbers) for a whole upload."""
+    graded = assess(data, mime_type, thresholds)
+    reasons = [f"p.{g['page']}: {r}" for g in graded for r in g["reasons"]]
+    return worst_level(graded), reasons
+
+def worst_level(graded: list) -> str:
+    levels = [g["level"] for g in graded]
+    if "block" in levels:
+        return "block"
+    if "warn" in levels:
+        return "warn"
+    return "ok"
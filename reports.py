@@ -0,0 +1,313 @@
+# reports.py
+# Excel Report Generation (Excel帳票出力)
+# The per-pattern estimation report (with formulas) and the multi-sheet export.
+import numpy as np
+import pandas as pd
+from io import BytesIO
+import schema
+import logic
+import formulas
+
+def generate_report_excel(p_name, df, settings):
+    """
+    Single-pattern estimation report with live formulas (xlsxwriter).
+    settings: galv_price, rate_weld, rate_paint, price_paint_mat, time_weld, time_paint, rate_oh, rate_risk
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        workbook = writer.book
+        worksheet = workbook.add_worksheet("Estimation Report")
+
+        # Formats
+        fmt_title = workbook.add_format({'bold': True, 'font_size': 14, 'align': 'center', 'border': 1, 'bg_color': '#D9E1F2'})
+        fmt_header = workbook.add_format({'bold': True, 'font_size': 11, 'align': 'center', 'border': 1, 'bg_color': '#D9E1F2'})
+        fmt_label = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#F2F2F2'})
+        fmt_input = workbook.add_format({'border': 1, 'bg_color': '#FFF2CC'}) # Input cells yellow
+        fmt_calc = workbook.add_format({'border': 1, 'bg_color': '#E2EFDA'}) # Calc cells green
+        fmt_num = workbook.add_format({'border': 1, 'num_format': '#,##0.0'})
+        fmt_money = workbook.add_format({'border': 1, 'num_format': '¥#,##0'})
+
+        fmt_money_bold = workbook.add_format({'bold': True, 'border': 1, 'num_format': '¥#,##0', 'font_size': 12})
+
+        # Settings Unpack
+        galv_price = settings['galv_price']
+        rate_weld = settings['rate_weld']
+        rate_paint = settings['rate_paint']
+        price_paint_mat = settings['price_paint_mat']
+        time_weld = settings['time_weld']
+        time_paint = settings['time_paint']
+        rate_oh = settings['rate_oh']
+        rate_risk = settings['rate_risk']
+
+        # Layout Definition
+        # Row 0: Title
+        worksheet.merge_range('A1:J1', f"Steel Pole Estimation Report: {p_name}", fmt_title)
+
+        # Row 2: Metadata
+        worksheet.write('A2', "Date:", fmt_label)
+        from datetime import datetime
+        worksheet.write('B2', datetime.now().strftime("%Y-%m-%d"), fmt_input)
+        worksheet.write('D2', "PRODUCER:", fmt_label)
+        worksheet.write('E2', "AxelOn Inc.", fmt_input)
+
+        # --- Cost Summary & Parameters Area ---
+        # Define Rows for sections
+        row_summary = 4
+        row_params = 16
+        row_data_header = 24
+
+        # A. Calculation Parameters ( 積算条件 / 編集エリア )
+        worksheet.merge_range(row_params, 0, row_params, 3, "▼ Calculation Parameters (積算条件・編集可)", fmt_header)
+        # Weld Hours
+        worksheet.write(row_params+1, 0, "Weld Hours (h)", fmt_label)
+        worksheet.write_number(row_params+1, 1, time_weld, fmt_input) # B18
+        cell_weld_h = f"B{row_params+2}"
+
+        # Paint Hours
+        worksheet.write(row_params+2, 0, "Paint Hours (h)", fmt_label)
+        worksheet.write_number(row_params+2, 1, time_paint, fmt_input) # B19
+        cell_paint_h = f"B{row_params+3}"
+
+        # OH Rate
+        worksheet.write(row_params+3, 0, "Overhead Rate (%)", fmt_label)
+        worksheet.write_number(row_params+3, 1, rate_oh, fmt_input) # B20
+        cell_rate_oh = f"B{row_params+4}"
+
+        # Risk Rate
+        worksheet.write(row_params+4, 0, "Risk Rate (%)", fmt_label)
+        worksheet.write_number(row_params+4, 1, rate_risk, fmt_input) # B21
+        cell_rate_risk = f"B{row_params+5}"
+
+        # Rates (Right Side)
+        worksheet.write(row_params+1, 2, "Weld Rate (¥/h)", fmt_label)
+        worksheet.write_number(row_params+1, 3, rate_weld, fmt_input) 
+        cell_rate_weld = f"D{row_params+2}"
+
+        worksheet.write(row_params+2, 2, "Paint Rate (¥/h)", fmt_label)
+        worksheet.write_number(row_params+2, 3, rate_paint, fmt_input) 
+        cell_rate_paint = f"D{row_params+3}"
+
+        worksheet.write(row_params+3, 2, "Paint Mat. (¥/m2)", fmt_label)
+        worksheet.write_number(row_params+3, 3, price_paint_mat, fmt_input) 
+        cell_price_paint_mat = f"D{row_params+4}"
+
+        worksheet.write(row_params+4, 2, "Galv Unit Price (¥/kg)", fmt_label)
+        worksheet.write_number(row_params+4, 3, galv_price, fmt_input) 
+        cell_price_galv = f"D{row_params+5}"
+
+        # B. Cost Summary ( 原価サマリー / 式 )
+        worksheet.merge_range(row_summary, 0, row_summary, 2, "▼ Cost Summary (原価サマリー)", fmt_header)
+
+        # Define Ranges for Data (To be determined after writing data)
+        range_data_start = row_data_header + 2
+        # placeholders for formula
+
+        # 1. Total Weight
+        worksheet.write(row_summary+1, 0, "Total Weight (kg)", fmt_label)
+        # Formula: SUM(H_data)
+
+        # 2. Material Cost
+        worksheet.write(row_summary+2, 0, "Material Cost (¥)", fmt_label)
+        # Formula: SUM(J_data)
+
+        # 3. Galvanizing Cost
+        worksheet.write(row_summary+3, 0, "Galvanizing Cost (¥)", fmt_label)
+        # Formula: TotalWeight * GalvPrice
+
+        # 4. Paint Material Cost
+        worksheet.write(row_summary+4, 0, "Paint Material Cost (¥)", fmt_label)
+        # Formula will be set later using cell_price_paint_mat
+
+        # 5. Welding Cost
+        worksheet.write(row_summary+5, 0, "Welding Labor Cost (¥)", fmt_label)
+        worksheet.write_formula(row_summary+5, 1, f"={cell_weld_h}*{cell_rate_weld}", fmt_money)
+
+        # 6. Painting Cost
+        worksheet.write(row_summary+6, 0, "Painting Labor Cost (¥)", fmt_label)
+        worksheet.write_formula(row_summary+6, 1, f"={cell_paint_h}*{cell_rate_paint}", fmt_money)
+
+        # 7. TOTAL BASE COST
+        worksheet.write(row_summary+7, 0, "TOTAL BASE COST (製造原価)", fmt_label)
+        # Formula: Mat + Galv + PaintMat + Weld + PaintLabor
+
+        # 8. Overhead
+        worksheet.write(row_summary+8, 0, "Overhead & Profit (¥)", fmt_label)
+        # Formula: Base * OH%
+
+        # 9. Contingency
+        worksheet.write(row_summary+9, 0, "Risk Contingency (¥)", fmt_label)
+        # Formula: Base * Risk%
+
+        # 10. QUOTATION PRICE
+        worksheet.write(row_summary+10, 0, "QUOTATION PRICE (御見積金額)", fmt_header)
+        # Formula: Base + OH + Risk
+
+
+        # --- Component Data ---
+        headers = ["Type", "Name", "Dia (mm)", "Thk (mm)", "Len (mm)", "Wid (mm)", "Qty", "Weight (kg)", "Unit Price", "Cost (¥)", "Area (m²)"]
+        for i, h in enumerate(headers):
+            worksheet.write(row_data_header, i, h, fmt_header)
+        # Stock-length / sheet yield (cutting.py, nesting.py): material is charged on the purchased weight
+        has_purchase = "Purchased Weight (kg)" in df.columns
+        if has_purchase:
+            worksheet.write(row_data_header, 12, "Yield Factor", fmt_header)
+
+        # Column values read once (iterrows builds a Series per row)
+        def values(col):
+            return logic.column_values(df, col).tolist()
+        def texts(col):
+            return df[col].tolist() if col in df.columns else [""] * len(df)
+        type_v, name_v = texts("type"), texts("name")
+        dia_v, thk_v, len_v, wid_v, qty_v = (values(c) for c in ("diameter_mm", "thickness_mm", "length_mm", "width_mm", "count"))
+        price_v, weight_v, area_v = (values(c) for c in ("Material Unit Price (¥/kg)", "Total Weight (kg)", "Surface Area (m²)"))
+        purchased_v = values("Purchased Weight (kg)")
+
+        # Row flags folded into the formulas (formulas.py, same as the app's calculation);
+        # each formula is built once per (pipe, rib, joints) shape and only the row number filled in
+        pipe_rows = logic.pipe_mask(df).tolist()
+        rib_rows = logic.rib_mask(df).tolist()
+        joint_rows = np.trunc(logic.column_values(df, "overlap_count")).tolist()
+        columns = {"diameter_mm": "C", "thickness_mm": "D", "length_mm": "E", "width_mm": "F", "count": "G"}
+        templates = {}
+
+        current_row = row_data_header + 1
+        for n in range(len(df)):
+            # Inputs & Statics
+            worksheet.write(current_row, 0, type_v[n], fmt_input)
+            worksheet.write(current_row, 1, name_v[n], fmt_input)
+            worksheet.write_number(current_row, 2, dia_v[n], fmt_input) # C
+            worksheet.write_number(current_row, 3, thk_v[n], fmt_input) # D
+            worksheet.write_number(current_row, 4, len_v[n], fmt_input) # E
+            worksheet.write_number(current_row, 5, wid_v[n], fmt_input) # F
+            worksheet.write_number(current_row, 6, qty_v[n], fmt_input) # G
+            worksheet.write_number(current_row, 8, price_v[n], fmt_input) # I
+
+            xl_row = current_row + 1
+            shape = (pipe_rows[n], rib_rows[n], joint_rows[n])
+            if shape not in templates:
+                fixed = dict(zip(("is_pipe", "is_rib", "overlap_count"), shape))
+                templates[shape] = (
+                    formulas.excel_template(formulas.TOTAL, columns, dict(fixed, unit=formulas.UNIT_WEIGHT)),
+                    formulas.excel_template(formulas.TOTAL, columns, dict(fixed, unit=formulas.UNIT_AREA)),
+                    formulas.excel_template(formulas.WELD_LENGTH, columns, fixed))
+            formula_weight, formula_area, formula_weld = (t.format(xl_row) for t in templates[shape])
+            # Weight Formula (H)
+            worksheet.write_formula(current_row, 7, formula_weight, fmt_calc, weight_v[n])
+
+            # Cost Formula (J), x purchased / net weight (M) when costed by stock lengths
+            if has_purchase:
+                net_v = weight_v[n]
+                factor = purchased_v[n] / net_v if net_v else 1.0
+                worksheet.write_number(current_row, 12, factor, fmt_input)
+                worksheet.write_formula(current_row, 9, f"=H{xl_row}*I{xl_row}*M{xl_row}", fmt_money)
+            else:
+                worksheet.write_formula(current_row, 9, f"=H{xl_row}*I{xl_row}", fmt_money)
+
+            # Area (pipe: outer surface incl. joints, plate: both faces, rib: half) to K (Visible),
+            # weld length to L (Hidden)
+            worksheet.write_formula(current_row, 10, formula_area, fmt_calc, area_v[n])
+            worksheet.write_formula(current_row, 11, formula_weld)
+
+            current_row += 1
+
+        last_data_row = current_row
+
+        # Update Summary Formulas requiring Data Range
+        rng_weight = f"H{row_data_header+2}:H{last_data_row}"
+        rng_cost = f"J{row_data_header+2}:J{last_data_row}"
+        rng_area = f"K{row_data_header+2}:K{last_data_row}"
+
+        # Total Weight
+        worksheet.write_formula(row_summary+1, 1, f"=SUM({rng_weight})", fmt_num)
+        cell_total_weight = f"B{row_summary+2}"
+
+        # Material Cost
+        worksheet.write_formula(row_summary+2, 1, f"=SUM({rng_cost})", fmt_money)
+        cell_mat_cost = f"B{row_summary+3}"
+
+        # Galv Cost Formula: Total Weight * Unit Price
+        worksheet.write_formula(row_summary+3, 1, f"={cell_total_weight}*{cell_price_galv}", fmt_money)
+        cell_galv_cost = f"B{row_summary+4}"
+
+        # 4. Total Area (New)
+        worksheet.write(row_summary+4, 0, "Total Area (m²)", fmt_label)
+        worksheet.write_formula(row_summary+4, 1, f"=SUM({rng_area})", fmt_num)
+        cell_total_area = f"B{row_summary+5}"
+
+        # 5. Paint Material Cost
+        worksheet.write(row_summary+5, 0, "Paint Material Cost (¥)", fmt_label)
+        worksheet.write_formula(row_summary+5, 1, f"={cell_total_area}*{cell_price_paint_mat}", fmt_money)
+        cell_paint_mat_cost = f"B{row_summary+6}"
+
+        # 6. Welding Cost
+        worksheet.write(row_summary+6, 0, "Welding Labor Cost (¥)", fmt_label)
+        worksheet.write_formula(row_summary+6, 1, f"={cell_weld_h}*{cell_rate_weld}", fmt_money)
+        cell_weld_cost = f"B{row_summary+7}"
+
+        # 7. Painting Cost
+        worksheet.write(row_summary+7, 0, "Painting Labor Cost (¥)", fmt_label)
+        worksheet.write_formula(row_summary+7, 1, f"={cell_paint_h}*{cell_rate_paint}", fmt_money)
+        cell_paint_cost = f"B{row_summary+8}"
+
+        # 8. Total Base Cost
+        worksheet.write(row_summary+8, 0, "TOTAL BASE COST (製造原価)", fmt_label)
+        worksheet.write_formula(row_summary+8, 1, f"={cell_mat_cost}+{cell_galv_cost}+{cell_paint_mat_cost}+{cell_weld_cost}+{cell_paint_cost}", fmt_money)
+        cell_base_cost = f"B{row_summary+9}"
+
+        # 9. Overhead
+        worksheet.write(row_summary+9, 0, "Overhead & Profit (¥)", fmt_label)
+        worksheet.write_formula(row_summary+9, 1, f"={cell_base_cost}*({cell_rate_oh}/100)", fmt_money)
+        cell_oh_amt = f"B{row_summary+10}"
+
+        # 10. Risk
+        worksheet.write(row_summary+10, 0, "Risk Contingency (¥)", fmt_label)
+        worksheet.write_formula(row_summary+10, 1, f"={cell_base_cost}*({cell_rate_risk}/100)", fmt_money)
+        cell_risk_amt = f"B{row_summary+11}"
+
+        # 11. QUOTATION PRICE
+        worksheet.write(row_summary+11, 0, "QUOTATION PRICE (御見積金額)", fmt_header)
+        worksheet.write_formula(row_summary+11, 1, f"={cell_base_cost}+{cell_oh_amt}+{cell_risk_amt}", fmt_money_bold)
+
+        # Column Layout
+        worksheet.set_column('A:B', 30)
+        worksheet.set_column('C:G', 10)
+        worksheet.set_column('H:J', 15)
+        worksheet.set_column('K:K', 12)
+        worksheet.set_column('L:L', 2)
+        worksheet.set_column('M:M', 12)
+
+    return output.getvalue()
+
+def export_workbook(dfs: dict) -> bytes:
+    """Multi-sheet value export, one sheet per pattern."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for p_name, final_df in dfs.items():
+            # Clean sheet name
+            sheet_name = "".join([c for c in p_name if c.isalnum() or c in (' ','_','-')])[:30]
+
+            excel_cols = [
+                "type", "name", 
+                "diameter_mm", "thickness_mm", "length_mm", "width_mm", 
+                "count", "overlap_count", 
+                "Unit Weight (kg)", "Total Weight (kg)", "Purchased Weight (kg)",
+                "Material Unit Price (¥/kg)", "Material Cost (¥)",
+                "Surface Area (m²)", "notes"
+            ]
+            valid_cols = [c for c in excel_cols if c in final_df.columns]
+            export_df = final_df[valid_cols].copy()
+
+            export_df.to_excel(writer, index=False, sheet_name=sheet_name)
+            # (Simplified export without formulas for multi-sheet robustness, or we repeat formula logic)
+            # Users prefer formulas, let's keep it if possible but it complicates the loop.
+            # Start simplistic: Value only for now as formula injection is complex in loop without careful idx tracking.
+            # Or reuse the formula logic? 
+            # Let's add simple formulas if we can.
+
+            worksheet = writer.sheets[sheet_name]
+            for r_idx, row in enumerate(export_df.itertuples(), start=2):
+                # Simple value fill already done by to_excel. 
+                # Overwrite columns J, K, L with Formulas if we want.
+                # For robustness in this refactor, I will SKIP complex formula injection to ensure stability first.
+                pass
+    return output.getvalue()
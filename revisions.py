@@ -0,0 +1,110 @@
+# revisions.py
+# Incremental Re-analysis of Drawing Revisions (改訂図面の差分解析)
+# Each analysis stores a content hash per page. A new revision only re-analyzes
+# pages whose hash is new, and untouched patterns (with their manual edits) are kept.
+import hashlib
+import pdf_tools
+
+def file_page_hashes(uploaded_file) -> list:
+    """Per-page content hashes of an upload. Images count as a single page."""
+    data = uploaded_file.getvalue()
+    if getattr(uploaded_file, "type", "") == "application/pdf":
+        hashes = pdf_tools.page_hashes(data)
+        if hashes:
+            return hashes
+    return [hashlib.sha256(data).hexdigest()]
+
+def changed_pages(old_hashes: list, new_hashes: list) -> list:
+    """
+    1-based pages of the new revision whose content does not appear anywhere
+    in the previous revision (so re-ordered or inserted sheets are handled).
+    """
+    known = set(old_hashes or [])
+    return [n for n, h in enumerate(new_hashes, start=1) if h not in known]
+
+def stamp_hashes(patterns: list, hashes: list, analyzed_pages: list = None) -> list:
+    """
+    Records the content hash of each pattern's source pages ("source_hashes").
+    Patterns without page attribution are stamped with every analyzed page.
+    """
+    analyzed_pages = analyzed_pages or list(range(1, len(hashes) + 1))
+    for pattern in patterns:
+        pages = pattern.get("source_pages") or sorted({
+            c["source_page"] for c in pattern.get("components", []) if c.get("source_page")
+        }) or analyzed_pages
+        pattern["source_pages"] = pages
+        pattern["source_hashes"] = [hashes[n - 1] for n in pages if 0 < n <= len(hashes)]
+    return patterns
+
+def _component_key(comp: dict) -> tuple:
+    return comp.get("source_page") or 0, str(comp.get("name", "")).strip().lower()
+
+def merge_revision(previous: list, updates: list, new_hashes: list) -> list:
+    """
+    Merges the re-analysis of changed pages into the previous result.
+    - Components read from pages that are still present are kept as-is, including manual
+      edits (renumbered to the new page order); components of changed or removed pages are
+      replaced by the re-analyzed ones of the same pattern. Components without a page (the
+      usual model output for multi-page patterns) are kept unless the re-analysis returns
+      a component of the same name, since it only saw the changed pages.
+    - Re-analyzed components matching a kept one by page and name are dropped (the kept
+      row may carry edits), so repeated revisions do not duplicate rows.
+    - Patterns read from changed pages that the re-analysis does not return (changed or
+      removed sheet) are kept with a validation alert.
+    - New pattern names are appended.
+    """
+    current = set(new_hashes)
+    page_of = {h: n for n, h in enumerate(new_hashes, start=1)}
+    updates_by_name = {p["pattern_name"].strip().lower(): p for p in updates}
+    merged = []
+    used = set()
+    for pattern in previous:
+        key = pattern["pattern_name"].strip().lower()
+        source = pattern.get("source_hashes", [])
+        untouched = all(h in current for h in source)
+        update = updates_by_name.get(key)
+        # Hash of every previous page of the pattern (stamp_hashes keeps the lists aligned)
+        pages = pattern.get("source_pages", [])
+        hash_of = dict(zip(pages, source)) if len(pages) == len(source) else {}
+        kept, stale, unplaced = [], [], []
+        for comp in pattern.get("components", []):
+            page = comp.get("source_page") or (pages[0] if len(pages) == 1 else 0)
+            if page and page in hash_of:
+                if hash_of[page] in current:
+                    kept.append(dict(comp, source_page=page_of[hash_of[page]]))
+                else:
+                    stale.append(comp)
+            elif untouched:
+                kept.append(comp)
+            else:
+                unplaced.append(comp)
+        if update is None:
+            pattern = dict(pattern, components=kept + stale + unplaced)
+            if not untouched:
+                # Changed or removed sheet: cannot tell from hashes alone, so keep it for review
+                pattern["validation_alerts"] = list(pattern.get("validation_alerts", [])) + [
+                    "Source page changed in this revision but the pattern was not found in the re-analysis. Please verify."
+                ]
+            merged.append(pattern)
+            continue
+        used.add(key)
+        update_names = {_component_key(c)[1] for c in update.get("components", [])}
+        kept += [c for c in unplaced if _component_key(c)[1] not in update_names]
+        names = {_component_key(c)[1] for c in kept}
+        keys = {_component_key(c) for c in kept}
+        added = [c for c in update.get("components", [])
+                 if (_component_key(c) not in keys if c.get("source_page") else _component_key(c)[1] not in names)]
+        hashes = [h for h in source if h in current]
+        pattern = dict(pattern, components=kept + added,
+                       source_hashes=hashes + [h for h in update.get("source_hashes", []) if h not in hashes])
+        if not untouched:
+            pattern["validation_alerts"] = list(update.get("validation_alerts", []))
+        merged.append(pattern)
+    merged.extend(p for p in updates if p["pattern_name"].strip().lower() not in used)
+
+    # Page numbers follow the new revision's page order (hashes re-ordered to match)
+    for pattern in merged:
+        hashes = sorted((h for h in pattern.get("source_hashes", []) if h in page_of), key=page_of.get)
+        pattern["source_hashes"] = hashes + [h for h in pattern.get("source_hashes", []) if h not in page_of]
+        pattern["source_pages"] = [page_of[h] for h in hashes]
+    return merged
@@ -0,0 +1,144 @@
+# roi.py
+# Region-of-Interest Detection (表・詳細図の領域抽出)
+# Finds bill-of-materials tables, the title block and framed detail views on a
+# drawing sheet using plain NumPy line detection, so only those crops are sent to the model.
+import numpy as np
+from PIL import Image
+
+WORK_MAX_PX = 1600          # Detection runs on a downscaled copy
+MIN_LINE_FRAC = 0.04        # Shortest ruled line, as a fraction of the page width/height
+FRAME_LINE_FRAC = 0.80      # Lines longer than this are the sheet frame, not a table
+CELL_PX = 12                # Grid cell size for grouping line pixels into regions
+MAX_COVERAGE = 0.85         # If regions cover more than this, just send the whole sheet
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Binarize with a simple Otsu threshold. True = ink."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    cum_w = np.cumsum(hist)
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mean_all = cum_mean[-1]
+    w0 = cum_w[:-1]
+    w1 = total - w0
+    valid = (w0 > 0) & (w1 > 0)
+    between = np.zeros(255)
+    between[valid] = (mean_all * w0[valid] / total - cum_mean[:-1][valid]) ** 2 / (w0[valid] * w1[valid])
+    threshold = int(np.argmax(between)) if valid.any() else 128
+    return gray <= threshold
+
+def _run_mask(mask: np.ndarray, k: int, axis: int) -> np.ndarray:
+    """Marks pixels that lie on a straight run of at least k ink pixels along axis."""
+    m = mask if axis == 1 else mask.T
+    c = np.cumsum(m, axis=1, dtype=np.int32)
+    c = np.pad(c, ((0, 0), (1, 0)))
+    full = (c[:, k:] - c[:, :-k]) == k       # window [j, j+k) fully inked
+    # Spread the window hits back over the k pixels they cover
+    hits = np.zeros((m.shape[0], m.shape[1] + 1), dtype=np.int32)
+    hits[:, :full.shape[1]] += full
+    hits[:, k:k + full.shape[1]] -= full
+    out = np.cumsum(hits, axis=1)[:, :-1] > 0
+    return out if axis == 1 else out.T
+
+def _drop_frame_lines(lines: np.ndarray, axis: int, frac: float) -> np.ndarray:
+    """Removes rows (axis=1) / columns (axis=0) whose line length spans most of the sheet."""
+    length = lines.sum(axis=axis)
+    limit = frac * lines.shape[axis]
+    lines = lines.copy()
+    if axis == 1:
+        lines[length > limit, :] = False
+    else:
+        lines[:, length > limit] = False
+    return lines
+
+def _label_cells(cells: np.ndarray) -> list:
+    """4-connected components on a small boolean grid. Returns list of (r0, c0, r1, c1)."""
+    seen = np.zeros_like(cells, dtype=bool)
+    rows, cols = cells.shape
+    boxes = []
+    for r, c in zip(*np.nonzero(cells)):
+        if seen[r, c]:
+            continue
+        stack = [(r, c)]
+        seen[r, c] = True
+        r0 = r1 = r
+        c0 = c1 = c
+        while stack:
+            y, x = stack.pop()
+            r0, r1, c0, c1 = min(r0, y), max(r1, y), min(c0, x), max(c1, x)
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < rows and 0 <= nx < cols and cells[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        boxes.append((r0, c0, r1 + 1, c1 + 1))
+    return boxes
+
+def _count_lines(profile: np.ndarray, min_len: int) -> int:
+    """Counts separate ruled lines in a projection profile (runs of rows/cols with long lines)."""
+    on = profile >= min_len
+    return int(np.count_nonzero(on[1:] & ~on[:-1]) + (1 if on.size and on[0] else 0))
+
+def find_regions(image: Image.Image, page: int = 1, max_regions: int = 8) -> list:
+    """
+    Detects table-like (ruled grid) and framed (detail view) regions.
+    Returns a list of dicts sorted by area (largest first):
+        {"id", "page", "kind": "table" | "detail", "bbox": (x0, y0, x1, y1)}  # bbox in original pixels
+    Returns [] when nothing useful is found or the regions cover almost the whole sheet.
+    """
+    w0, h0 = image.size
+    scale = min(1.0, WORK_MAX_PX / max(w0, h0))
+    work = image.convert("L")
+    if scale < 1.0:
+        work = work.resize((max(1, int(w0 * scale)), max(1, int(h0 * scale))), Image.BILINEAR)
+    gray = np.asarray(work, dtype=np.uint8)
+    h, w = gray.shape
+
+    ink = _ink_mask(gray)
+    k_h = max(8, int(w * MIN_LINE_FRAC))
+    k_v = max(8, int(h * MIN_LINE_FRAC))
+    horiz = _drop_frame_lines(_run_mask(ink, k_h, axis=1), axis=1, frac=FRAME_LINE_FRAC)
+    vert = _drop_frame_lines(_run_mask(ink, k_v, axis=0), axis=0, frac=FRAME_LINE_FRAC)
+    lines = horiz | vert
+
+    # Group line pixels on a coarse grid (this also bridges small gaps at line joints)
+    gh, gw = -(-h // CELL_PX), -(-w // CELL_PX)
+    padded = np.zeros((gh * CELL_PX, gw * CELL_PX), dtype=bool)
+    padded[:h, :w] = lines
+    cells = padded.reshape(gh, CELL_PX, gw, CELL_PX).any(axis=(1, 3))
+
+    regions = []
+    for r0, c0, r1, c1 in _label_cells(cells):
+        y0, x0 = r0 * CELL_PX, c0 * CELL_PX
+        y1, x1 = min(h, r1 * CELL_PX), min(w, c1 * CELL_PX)
+        if (x1 - x0) < k_h or (y1 - y0) < k_v:
+            continue
+        n_h = _count_lines(horiz[y0:y1, x0:x1].sum(axis=1), k_h)
+        n_v = _count_lines(vert[y0:y1, x0:x1].sum(axis=0), k_v)
+        if n_h < 2 or n_v < 2:
+            continue
+        kind = "table" if n_h >= 3 and n_v >= 3 else "detail"
+        bbox = (int(x0 / scale), int(y0 / scale), min(w0, int(x1 / scale)), min(h0, int(y1 / scale)))
+        regions.append({"page": page, "kind": kind, "bbox": bbox})
+
+    regions.sort(key=lambda r: (r["bbox"][2] - r["bbox"][0]) * (r["bbox"][3] - r["bbox"][1]), reverse=True)
+    regions = regions[:max_regions]
+
+    covered = sum((r["bbox"][2] - r["bbox"][0]) * (r["bbox"][3] - r["bbox"][1]) for r in regions)
+    if not regions or covered > MAX_COVERAGE * w0 * h0:
+        return []
+    for i, r in enumerate(regions):
+        r["id"] = i + 1
+    return regions
+
+def crop_regions(image: Image.Image, regions: list, pad_px: int = 8) -> list:
+    """Returns [(region, cropped PIL image)] with a small margin around each bbox."""
+    w, h = image.size
+    crops = []
+    for r in regions:
+        x0, y0, x1, y1 = r["bbox"]
+        box = (max(0, x0 - pad_px), max(0, y0 - pad_px), min(w, x1 + pad_px), min(h, y1 + pad_px))
+        crops.append((r, image.crop(box)))
+    return crops
+
+def region_label(region: dict) -> str:
+    x0, y0, x1, y1 = region["bbox"]
+    return f"[Region {region['id']}] {region['kind']} on page {region['page']}, bbox px=({x0},{y0})-({x1},{y1})"
@@ -0,0 +1,176 @@
+# schema.py
+# AI Output Schema & Normalization (AI出力の検証・正規化)
+import json
+import math
+import re
+
+SCHEMA_VERSION = 1
+
+# Component field definitions: (field, kind, default)
+# kind: "text" or "number"
+COMPONENT_SCHEMA = (
+    ("type", "text", ""),
+    ("name", "text", ""),
+    ("diameter_mm", "number", 0.0),
+    ("thickness_mm", "number", 0.0),
+    ("length_mm", "number", 0.0),
+    ("width_mm", "number", 0.0),
+    ("count", "number", 1.0),
+    ("notes", "text", ""),
+)
+
+COMPONENT_FIELDS = tuple(f for f, _, _ in COMPONENT_SCHEMA)
+NUMERIC_FIELDS = tuple(f for f, kind, _ in COMPONENT_SCHEMA if kind == "number")
+
+# Bit position of each field in the per-component "_uncertain" mask
+FIELD_BITS = {f: 1 << i for i, f in enumerate(COMPONENT_FIELDS)}
+
+# Dimensions that must be non-zero for the weight to be meaningful
+CRITICAL_PIPE_FIELDS = ("diameter_mm", "thickness_mm", "length_mm")
+CRITICAL_PLATE_FIELDS = ("thickness_mm", "length_mm", "width_mm")
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_DECODER = json.JSONDecoder()
+
+def _compile_schema():
+    """Pre-build the per-field converters once at import time."""
+    compiled = []
+    for field, kind, default in COMPONENT_SCHEMA:
+        convert = _parse_number if kind == "number" else _parse_text
+        compiled.append((field, convert, default, FIELD_BITS[field]))
+    return tuple(compiled)
+
+def _parse_number(val):
+    """Returns (value, ok). ok=False for missing, 'CHECK' or unparseable values."""
+    if val is None or isinstance(val, bool):
+        return None, False
+    if isinstance(val, (int, float)):
+        f = float(val)
+        if math.isnan(f) or math.isinf(f):
+            return None, False
+        return f, True
+    s = str(val).replace(",", "").strip()
+    if not s or "CHECK" in s.upper():
+        return None, False
+    m = _NUMBER_RE.search(s)
+    if not m:
+        return None, False
+    return float(m.group(0)), True
+
+def _parse_text(val):
+    if val is None:
+        return None, False
+    s = str(val).strip()
+    if not s or s.upper() == "CHECK":
+        return s, False
+    return s, True
+
+_COMPILED = _compile_schema()
+
+def to_float(val) -> float:
+    """
+    Single numeric coercion used across the app.
+    Handles comma-formatted strings, "CHECK", None, NaN/inf -> 0.0
+    """
+    if type(val) is float:
+        return val if math.isfinite(val) else 0.0
+    f, ok = _parse_number(val)
+    return f if ok else 0.0
+
+def is_pipe_type(type_str) -> bool:
+    t = str(type_str).lower()
+    return "pipe" in t or "管" in t
+
+def normalize_component(raw: dict) -> dict:
+    """
+    Converts one raw component dict into typed values.
+    Unknown values become 0 / "" and are flagged in the "_uncertain" bitmask.
+    Extra keys (e.g. overlap_count, part ids) are preserved.
+    """
+    comp = dict(raw)
+    critical = CRITICAL_PIPE_FIELDS if is_pipe_type(raw.get("type", "")) else CRITICAL_PLATE_FIELDS
+    mask = 0
+    for field, convert, default, bit in _COMPILED:
+        raw_val = raw.get(field)
+        value, ok = convert(raw_val)
+        if field == "notes":
+            # Empty notes are normal, never flagged
+            comp[field] = value or ""
+            continue
+        if not ok:
+            # Missing width on a pipe (or diameter on a plate) is expected;
+            # only flag those when the model explicitly wrote "CHECK"
+            explicit = isinstance(raw_val, str) and "CHECK" in raw_val.upper()
+            if field not in NUMERIC_FIELDS or field in critical or field == "count" or explicit:
+                mask |= bit
+            value = value if isinstance(value, str) else default
+        elif field in critical and value <= 0:
+            # A 0 in a critical dimension means "unknown" per the prompt rules
+            mask |= bit
+        comp[field] = value
+
+    comp["_uncertain"] = mask
+    return comp
+
+def uncertain_fields(component: dict) -> list:
+    mask = component.get("_uncertain", 0) or 0
+    return [f for f in COMPONENT_FIELDS if mask & FIELD_BITS[f]]
+
+def normalize_pattern(raw: dict, index: int = 0) -> dict:
+    pattern = dict(raw)
+    name = raw.get("pattern_name")
+    pattern["pattern_name"] = str(name).strip() if name else f"Pattern {index + 1}"
+
+    alerts = raw.get("validation_alerts") or []
+    if isinstance(alerts, str):
+        alerts = [alerts]
+    pattern["validation_alerts"] = [str(a) for a in alerts if a]
+
+    pages = raw.get("source_pages")
+    if pages:
+        if not isinstance(pages, list):
+            pages = [pages]
+        pattern["source_pages"] = sorted({int(to_float(n)) for n in pages if to_float(n) > 0})
+
+    # Number of identical poles of this pattern in the project (基数)
+    pattern["quantity"] = max(1, int(to_float(raw.get("quantity")) or 1))
+
+    components = raw.get("components") or []
+    pattern["components"] = [normalize_component(c) for c in components if isinstance(c, dict)]
+    pattern["_schema"] = SCHEMA_VERSION
+    return pattern
+
+def normalize_patterns(data) -> list:
+    """
+    Accepts any of the shapes the model (or older assets) produce:
+    - {"patterns": [...]}
+    - [pattern, ...]
+    - [component, ...] (old prompt style -> wrapped in one pattern)
+    Returns a list of normalized patterns.
+    """
+    if isinstance(data, dict):
+        data = data.get("patterns", [])
+    if not isinstance(data, list):
+        return []
+    if data and isinstance(data[0], dict) and "pattern_name" not in data[0] and "components" not in data[0]:
+        data = [{"pattern_name": "Detected Pattern", "components": data}]
+    return [normalize_pattern(p, i) for i, p in enumerate(data) if isinstance(p, dict)]
+
+def is_normalized(patterns) -> bool:
+    return bool(patterns) and all(isinstance(p, dict) and p.get("_schema") == SCHEMA_VERSION for p in patterns)
+
+def parse_model_output(text: str) -> list:
+    """
+    Extracts the JSON payload from raw model text (with or without ```json fences
+    or surrounding prose) and returns normalized patterns.
+    Raises ValueError if no JSON object can be found.
+    """
+    m = _FENCE_RE.search(text)
+    if m:
+        text = m.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object found in model output.")
+    data, _ = _DECODER.raw_decode(text, min(starts))
+    return normalize_patterns(data)
@@ -0,0 +1,207 @@
+# session_store.py
+# Per-Session Artifact Store (セッション別メモリ管理)
+# Large per-session artifacts (report workbooks, bulk reports, project data) are
+# tracked by byte size. The most recently used ones stay in memory under a budget;
+# colder ones are spilled to a local disk directory keyed by content hash and
+# read back on demand. The directory is removed when the session ends.
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+DEFAULT_BUDGET_MB = float(os.environ.get("ESTIMATOR_SESSION_BUDGET_MB", 64))
+SPILL_ROOT = os.environ.get("ESTIMATOR_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "estimator_spill")
+STALE_SECONDS = 24 * 3600   # Spill directories left behind by a crashed server are removed after this
+
+_MISSING = object()
+
+def size_of(value) -> int:
+    """Approximate in-memory size of an artifact in bytes."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):            # numpy arrays
+        return nbytes
+    if callable(nbytes):                   # model.Project / PatternTable
+        return int(nbytes())
+    if hasattr(value, "memory_usage"):     # pandas DataFrame
+        return int(value.memory_usage(deep=True).sum())
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+def content_hash(*parts) -> str:
+    """sha1 over bytes, DataFrames (by content) and reprs of everything else."""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            h.update(part)
+        elif hasattr(part, "to_numpy") and hasattr(part, "columns"):
+            import pandas as pd
+            h.update(repr(list(part.columns)).encode())
+            h.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+        else:
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def sweep_stale(root: str = SPILL_ROOT, max_age: float = STALE_SECONDS) -> int:
+    """Removes session directories older than max_age seconds. Returns the number removed."""
+    removed = 0
+    if not os.path.isdir(root):
+        return 0
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+class _Entry:
+    __slots__ = ("value", "size", "digest", "key", "pinned")
+
+    def __init__(self, value, size, key, pinned):
+        self.value = value
+        self.size = size
+        self.digest = None   # Set once spilled; name of the file on disk
+        self.key = key
+        self.pinned = pinned
+
+class SessionStore:
+    """
+    Named artifacts of one session with an LRU memory budget.
+    put / get / memoize are thread-safe (deferred downloads run on another thread).
+    Pinned entries (e.g. the project being edited) are counted but never spilled.
+    """
+
+    def __init__(self, budget_mb: float = DEFAULT_BUDGET_MB, root: str = SPILL_ROOT):
+        self.budget = int(budget_mb * 1024 * 1024)
+        os.makedirs(root, exist_ok=True)
+        sweep_stale(root)
+        self.path = tempfile.mkdtemp(prefix="session_", dir=root)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.spills = 0
+        self.loads = 0
+        # Runs when the session state (and with it this store) is dropped, or at exit
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_budget(self, budget_mb: float):
+        with self._lock:
+            self.budget = int(budget_mb * 1024 * 1024)
+            self._enforce()
+
+    def put(self, name: str, value, key=None, pin: bool = False):
+        """Stores (or replaces) an artifact. key is an optional content key for memoize."""
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._drop_file(old)
+            self._entries[name] = _Entry(value, size_of(value), key, pin)
+            self._enforce(keep=name)
+        return value
+
+    def get(self, name: str, default=None):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return default
+            self._entries.move_to_end(name)
+            if entry.value is None and entry.digest is not None:
+                try:
+                    with open(self._file(entry.digest), "rb") as f:
+                        entry.value = pickle.load(f)
+                except OSError:
+                    del self._entries[name]    # Swept as stale; the caller rebuilds it
+                    return default
+                self.loads += 1
+                self._enforce(keep=name)
+            return entry.value
+
+    def memoize(self, name: str, key, build):
+        """The stored artifact if it was built for the same key, else build() stored under name."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.key == key:
+                value = self.get(name, _MISSING)
+                if value is not _MISSING:
+                    return value
+        return self.put(name, build(), key=key)
+
+    def discard(self, name: str):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self._drop_file(entry)
+
+    def close(self):
+        """Removes all artifacts and the spill directory."""
+        with self._lock:
+            self._entries.clear()
+        self._finalizer()
+
+    def stats(self) -> dict:
+        with self._lock:
+            memory = sum(e.size for e in self._entries.values() if e.value is not None)
+            disk = sum(e.size for e in self._entries.values() if e.value is None)
+            return {"items": len(self._entries), "memory_bytes": memory, "disk_bytes": disk,
+                    "budget_bytes": self.budget, "spills": self.spills, "loads": self.loads}
+
+    # --- internals ---
+    def _file(self, digest: str) -> str:
+        return os.path.join(self.path, digest)
+
+    def _spill(self, entry: _Entry):
+        payload = pickle.dumps(entry.value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(payload).hexdigest()
+        if entry.digest not in (None, digest):
+            self._drop_file(entry)      # Content changed since the last spill
+        path = self._file(digest)
+        if not os.path.exists(path):    # Identical content is stored once
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        entry.digest = digest
+        entry.value = None
+        self.spills += 1
+
+    def _drop_file(self, entry: _Entry):
+        digest = entry.digest
+        if digest is None or any(e is not entry and e.digest == digest for e in self._entries.values()):
+            return
+        try:
+            os.remove(self._file(digest))
+        except OSError:
+            pass
+
+    def _enforce(self, keep: str = None):
+        """Spills least recently used entries until the in-memory total fits the budget."""
+        used = sum(e.size for e in self._entries.values() if e.value is not None)
+        for name, entry in list(self._entries.items()):
+            if used <= self.budget:
+                break
+            if name == keep or entry.pinned or entry.value is None:
+                continue
+            try:
+                self._spill(entry)
+            except Exception:
+                continue   # Unpicklable artifacts simply stay in memory
+            used -= entry.size
@@ -1,18 +1,56 @@
 
+import hashlib
 import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
+import schema
 
-def create_cylinder_mesh(diameter, height, z_start, color='lightsteelblue', opacity=0.95):
+# Level of detail (LOD) for cylinders
+MAX_SEGMENTS = 36           # Angular samples of a close-up pipe (the original look)
+MIN_SEGMENTS = 10           # Never coarser than this
+FAST_SEGMENTS = 16          # Cap in fast preview mode
+SEGMENT_PX = 2.0            # Target on-screen length of one facet edge
+VIEW_PX = 800               # Approximate height of the 3D view in pixels
+VERTEX_BUDGET = 6000        # Total cylinder vertices per scene
+CONTOUR_MAX_CYLINDERS = 8   # Wireframe contours only for scenes with at most this many cylinders
+FAST_PREVIEW_CYLINDERS = 24 # Scenes with more cylinders than this switch to fast preview automatically
+
+def plan_cylinder_lod(diameters, scene_extent, vertex_budget=VERTEX_BUDGET, fast=False):
+    """
+    Picks (angular samples, vertical samples, contours) for each cylinder.
+    Tessellation follows the on-screen size of each part (diameter relative to the
+    scene extent); if the total exceeds the vertex budget, all parts are scaled down.
+    """
+    if not diameters:
+        return []
+    fast = fast or len(diameters) > FAST_PREVIEW_CYLINDERS
+    contours = not fast and len(diameters) <= CONTOUR_MAX_CYLINDERS
+    n_z = 5 if contours else 2        # Straight walls only need extra rows for the contour lines
+    cap = FAST_SEGMENTS if fast else MAX_SEGMENTS
+    extent = max(scene_extent, 1.0)
+
+    segments = []
+    for d in diameters:
+        projected_px = d / extent * VIEW_PX
+        segments.append(int(np.clip(np.pi * projected_px / SEGMENT_PX, MIN_SEGMENTS, cap)))
+
+    total = sum(segments) * n_z
+    if total > vertex_budget:
+        factor = vertex_budget / total
+        segments = [max(MIN_SEGMENTS, int(n * factor)) for n in segments]
+    return [(n, n_z, contours) for n in segments]
+
+def create_cylinder_mesh(diameter, height, z_start, color='lightsteelblue', opacity=0.95,
+                         segments=MAX_SEGMENTS, rows=5, contours=True):
     """
     Create a cylindrical surface using go.Surface.
+    segments / rows: angular and vertical samples (see plan_cylinder_lod).
     """
     if diameter <= 0 or height <= 0: return None
     
     radius = diameter / 2.0
-    # Higher Resolution for smoothness
-    theta = np.linspace(0, 2*np.pi, 36)
-    z = np.linspace(z_start, z_start + height, 5)
+    theta = np.linspace(0, 2*np.pi, segments)
+    z = np.linspace(z_start, z_start + height, rows)
     
     theta_grid, z_grid = np.meshgrid(theta, z)
     x_grid = radius * np.cos(theta_grid)
@@ -26,7 +64,7 @@ def create_cylinder_mesh(diameter, height, z_start, color='lightsteelblue', opac
         showscale=False,
         opacity=opacity,
         # White contours for wireframe effect on dark bg - Enhanced for visibility
-        contours_z=dict(show=True, usecolormap=False, highlightcolor="#00ffff", project_z=True, color="white", width=2)
+        contours_z=dict(show=contours, usecolormap=False, highlightcolor="#00ffff", project_z=True, color="white", width=2)
     )
     return surface
 
@@ -209,13 +247,16 @@ def create_text_annotation(x, y, z, text):
         showlegend=False
     )
 
-def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin"):
+def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin", fast: bool = False,
+                        vertex_budget: int = VERTEX_BUDGET):
+    """
+    fast: coarse tessellation without contour lines (also chosen automatically for large scenes).
+    vertex_budget: total cylinder vertices, see plan_cylinder_lod.
+    """
     fig = go.Figure()
     
     # 1. Parse Data
-    def safe_float(val):
-        try: return float(str(val).replace(",",""))
-        except: return 0.0
+    safe_float = schema.to_float
     
     df['d_val'] = df['diameter_mm'].apply(safe_float)
     df['t_val'] = df['thickness_mm'].apply(safe_float)
@@ -248,6 +289,7 @@ def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin"):
     # 3. Pipes (Sorted)
     pipes = df[df['type'].str.contains('Pipe', case=False)].copy()
     
+    cylinders = []   # (diameter, height, z_start, color); meshed after the LOD plan
     if not pipes.empty:
         pipes = pipes.sort_values(by='d_val', ascending=False)
         largest_d = pipes.iloc[0]['d_val']
@@ -267,12 +309,10 @@ def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin"):
                     rest_h = l - protection_h
                     
                     # Protected Part
-                    surf_bot = create_cylinder_mesh(d, protection_h, current_z, color='#5A708B')
-                    fig.add_trace(surf_bot)
+                    cylinders.append((d, protection_h, current_z, '#5A708B'))
                     
                     # Top Part
-                    surf_top = create_cylinder_mesh(d, rest_h, current_z + protection_h, color='#B8E0F6')
-                    fig.add_trace(surf_top)
+                    cylinders.append((d, rest_h, current_z + protection_h, '#B8E0F6'))
                     
                     label_text = f"Pipe D-<b>{d:.1f}</b>\nL={l:.0f}"
                     fig.add_trace(create_text_annotation(label_offset_x, 0, current_z + l/2, label_text))
@@ -280,13 +320,19 @@ def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin"):
                     current_z += l
                 else:
                     # Standard Pipe
-                    surf = create_cylinder_mesh(d, l, current_z, color='#B8E0F6')
-                    if surf: fig.add_trace(surf)
+                    cylinders.append((d, l, current_z, '#B8E0F6'))
                     
                     label_text = f"D-<b>{d:.1f}</b> L={l:.0f}"
                     fig.add_trace(create_text_annotation(label_offset_x, 0, current_z + l/2, label_text))
                     
                     current_z += l
+
+    # Scene spans the pole height and the reference objects beside it
+    scene_extent = max(current_z, largest_d + 7200)
+    lod = plan_cylinder_lod([c[0] for c in cylinders], scene_extent, vertex_budget, fast)
+    for (d, h, z0, color), (segments, rows, contours) in zip(cylinders, lod):
+        surf = create_cylinder_mesh(d, h, z0, color=color, segments=segments, rows=rows, contours=contours)
+        if surf: fig.add_trace(surf)
     
     # 4. Ribs
     ribs = df[df['name'].str.contains('Rib', case=False)]
@@ -369,3 +415,229 @@ def generate_3d_preview(df: pd.DataFrame, title: str = "AxelOn Digital Twin"):
     )
     
     return fig
+
+# --- Project Site View (全体配置ビュー) ---
+SITE_VERTEX_BUDGET = 150000   # Total vertices of the whole site scene
+SITE_MIN_SEGMENTS = 6
+SITE_SPACING_MM = 3000        # Minimum distance between pole centres
+PROTECTION_H = 1000.0         # Ground protection band of the bottom pipe (as in generate_3d_preview)
+
+def geometry_signature(components: list) -> tuple:
+    """
+    Components that define a pole's shape, rounded to 0.1mm, in row order (the first
+    base plate / rib and equal-diameter pipes are drawn by position). Equal signatures share one mesh.
+    """
+    safe_float = schema.to_float
+    return tuple(
+        (str(c.get("type", "")).lower(), str(c.get("name", "")).lower(),
+         round(safe_float(c.get("diameter_mm")), 1), round(safe_float(c.get("thickness_mm")), 1),
+         round(safe_float(c.get("length_mm")), 1), round(safe_float(c.get("width_mm")), 1),
+         round(safe_float(c.get("count")), 1))
+        for c in components
+    )
+
+def pole_parts(components: list) -> list:
+    """
+    Stacks a pattern the same way as generate_3d_preview (base plate, pipes by
+    descending diameter, ribs on the largest pipe). Returns
+    [("box" | "cylinder" | "rib", params tuple, color)].
+    """
+    safe_float = schema.to_float
+    parts = []
+    z = 0.0
+    base = next((c for c in components if "base" in str(c.get("name", "")).lower()
+                 and "plate" in str(c.get("type", "")).lower()), None)
+    base_t = 0.0
+    if base and safe_float(base.get("length_mm")) > 0:
+        base_t = safe_float(base.get("thickness_mm"))
+        parts.append(("box", (safe_float(base.get("length_mm")), safe_float(base.get("width_mm")), base_t, 0.0), '#808080'))
+        z = base_t
+
+    pipes = sorted((c for c in components if "pipe" in str(c.get("type", "")).lower()),
+                   key=lambda c: safe_float(c.get("diameter_mm")), reverse=True)
+    largest_d = safe_float(pipes[0].get("diameter_mm")) if pipes else 0.0
+    for c in pipes:
+        d, l = safe_float(c.get("diameter_mm")), safe_float(c.get("length_mm"))
+        if d <= 0 or l <= 0:
+            continue
+        if d == largest_d and l > 1500:
+            parts.append(("cylinder", (d, PROTECTION_H, z), '#5A708B'))
+            parts.append(("cylinder", (d, l - PROTECTION_H, z + PROTECTION_H), '#B8E0F6'))
+        else:
+            parts.append(("cylinder", (d, l, z), '#B8E0F6'))
+        z += l
+
+    rib = next((c for c in components if "rib" in str(c.get("name", "")).lower()), None)
+    if rib and largest_d > 0:
+        count = int(safe_float(rib.get("count"))) or 4
+        for n in range(count):
+            parts.append(("rib", (largest_d / 2.0, safe_float(rib.get("width_mm")), safe_float(rib.get("length_mm")),
+                                  safe_float(rib.get("thickness_mm")), base_t, n * 360.0 / count), '#606060'))
+    return parts
+
+def _cylinder_arrays(diameter, height, z_start, segments):
+    """Open cylinder wall as a triangle mesh: (vertices (2n, 3), faces (2n, 3))."""
+    theta = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    ring = np.column_stack([diameter / 2.0 * np.cos(theta), diameter / 2.0 * np.sin(theta)])
+    verts = np.vstack([np.column_stack([ring, np.full(segments, z_start)]),
+                       np.column_stack([ring, np.full(segments, z_start + height)])])
+    a = np.arange(segments)
+    b = (a + 1) % segments
+    faces = np.vstack([np.column_stack([a, b, a + segments]), np.column_stack([b, b + segments, a + segments])])
+    return verts, faces
+
+def _mesh_arrays(mesh):
+    """Vertices / faces of a Mesh3d trace built by create_box_mesh / create_rib_mesh."""
+    verts = np.column_stack([np.asarray(mesh.x, dtype=float), np.asarray(mesh.y, dtype=float), np.asarray(mesh.z, dtype=float)])
+    faces = np.column_stack([np.asarray(mesh.i), np.asarray(mesh.j), np.asarray(mesh.k)])
+    return verts, faces
+
+def pole_geometry(components: list, segments: int):
+    """
+    One pole merged into a single triangle mesh.
+    Returns (vertices, faces, face colors, height, footprint) or None if nothing is drawable.
+    """
+    verts, faces, colors = [], [], []
+    offset = 0
+    height = footprint = 0.0
+    for kind, params, color in pole_parts(components):
+        if kind == "cylinder":
+            v, f = _cylinder_arrays(*params, segments)
+            footprint = max(footprint, params[0])
+        else:
+            mesh = create_box_mesh(*params) if kind == "box" else create_rib_mesh(*params)
+            if mesh is None:
+                continue
+            v, f = _mesh_arrays(mesh)
+            footprint = max(footprint, 2 * float(np.abs(v[:, :2]).max()))
+        verts.append(v)
+        faces.append(f + offset)
+        colors.extend([color] * len(f))
+        offset += len(v)
+        height = max(height, float(v[:, 2].max()))
+    if not verts:
+        return None
+    return np.vstack(verts), np.vstack(faces), colors, height, footprint
+
+def generate_site_view(patterns: list, title: str = "AxelOn Site View", vertex_budget: int = SITE_VERTEX_BUDGET):
+    """
+    Lays out every pattern x its quantity on a grid.
+    Identical poles (same geometry_signature) are meshed once and copied by offset
+    into a single trace, so the scene has one trace per unique pole.
+    """
+    groups = {}
+    for p in patterns:
+        qty = max(0, int(schema.to_float(p.get("quantity", 1))))
+        if qty == 0:
+            continue
+        sig = geometry_signature(p.get("components", []))
+        group = groups.setdefault(sig, {"components": p.get("components", []), "names": [], "count": 0})
+        group["names"].append(p.get("pattern_name", ""))
+        group["count"] += qty
+
+    fig = go.Figure()
+    if not groups:
+        return fig
+
+    # Tessellation shared by all poles, sized to the vertex budget
+    wall_vertices = sum(g["count"] * 2 * sum(1 for kind, _, _ in pole_parts(g["components"]) if kind == "cylinder")
+                        for g in groups.values())
+    segments = int(np.clip(vertex_budget / max(wall_vertices, 1), SITE_MIN_SEGMENTS, FAST_SEGMENTS))
+
+    meshes = []
+    for group in groups.values():
+        geometry = pole_geometry(group["components"], segments)
+        if geometry is not None:
+            meshes.append((group, geometry))
+    if not meshes:
+        return fig
+
+    spacing = max(SITE_SPACING_MM, 2.5 * max(g[4] for _, g in meshes))
+    total = sum(group["count"] for group, _ in meshes)
+    columns = int(np.ceil(np.sqrt(total)))
+
+    slot = 0
+    for group, (verts, faces, colors, height, _) in meshes:
+        n = group["count"]
+        slots = np.arange(slot, slot + n)
+        offsets = np.column_stack([(slots % columns) * spacing, (slots // columns) * spacing, np.zeros(n)])
+        all_verts = (verts[None, :, :] + offsets[:, None, :]).reshape(-1, 3)
+        all_faces = (faces[None, :, :] + (np.arange(n) * len(verts))[:, None, None]).reshape(-1, 3)
+        names = group["names"]
+        label = " / ".join(names[:3]) + (f" +{len(names) - 3}" if len(names) > 3 else "")
+        # Face colours as a per-cell index into a stepped colorscale (far smaller than colour strings)
+        palette = list(dict.fromkeys(colors))
+        index = {c: m for m, c in enumerate(palette)}
+        steps = [[edge, c] for m, c in enumerate(palette) for edge in (m / len(palette), (m + 1) / len(palette))]
+        fig.add_trace(go.Mesh3d(
+            x=all_verts[:, 0], y=all_verts[:, 1], z=all_verts[:, 2],
+            i=all_faces[:, 0], j=all_faces[:, 1], k=all_faces[:, 2],
+            intensity=np.tile(np.array([index[c] for c in colors], dtype=np.uint8), n), intensitymode="cell",
+            colorscale=steps, cmin=-0.5, cmax=len(palette) - 0.5, showscale=False,
+            flatshading=True, name=label, hovertext=label, hoverinfo="text",
+            lighting=dict(ambient=0.6, diffuse=0.9, specular=0.1)
+        ))
+        fig.add_trace(create_text_annotation(offsets[0, 0], offsets[0, 1], height + 500, f"{label} x{n}"))
+        slot += n
+
+    bg_color = '#001f3f'
+    fig.update_layout(
+        height=800,
+        title={'text': f"{title} ({total} poles)", 'y': 0.95, 'x': 0.5, 'xanchor': 'center', 'yanchor': 'top',
+               'font': dict(size=24, color="white")},
+        paper_bgcolor=bg_color,
+        plot_bgcolor=bg_color,
+        scene=dict(
+            aspectmode='data',
+            xaxis=dict(title='', showgrid=True, gridcolor='rgba(255,255,255,0.15)', zeroline=False, showticklabels=False),
+            yaxis=dict(title='', showgrid=True, gridcolor='rgba(255,255,255,0.15)', zeroline=False, showticklabels=False),
+            zaxis=dict(title=dict(text='Height (mm)', font=dict(color='white', size=14)), showgrid=True,
+                       gridcolor='rgba(255,255,255,0.25)', tickfont=dict(color='white', size=12)),
+            bgcolor=bg_color,
+            camera=dict(up=dict(x=0, y=0, z=1), eye=dict(x=1.6, y=-1.6, z=1.0))
+        ),
+        margin=dict(l=0, r=0, b=0, t=80),
+        showlegend=False,
+    )
+    return fig
+
+# --- Compact figure payloads ---
+COORD_DECIMALS = 0   # Coordinates are sent rounded to whole millimetres
+
+def compact_figure(fig):
+    """
+    Converts trace coordinates to float32 rounded to COORD_DECIMALS and mesh
+    indices to the smallest unsigned integer type. Plotly serializes NumPy
+    arrays as base64 typed arrays, so the figure JSON shrinks several times.
+    """
+    def replace(trace, attr, arr):
+        # Plotly ignores assignments equal to the current value, even if the dtype differs
+        trace[attr] = None
+        trace[attr] = arr
+
+    for trace in fig.data:
+        for attr in ("x", "y", "z"):
+            values = getattr(trace, attr, None)
+            if values is None:
+                continue
+            arr = np.asarray(values)
+            if arr.dtype.kind not in "fiu":
+                continue
+            replace(trace, attr, np.round(arr.astype(np.float64), COORD_DECIMALS).astype(np.float32))
+        if trace.type == "mesh3d" and trace.i is not None:
+            top = max(int(np.max(trace[a])) for a in ("i", "j", "k"))
+            dtype = np.uint16 if top < 2 ** 16 else np.uint32
+            for attr in ("i", "j", "k"):
+                replace(trace, attr, np.asarray(trace[attr]).astype(dtype))
+    return fig
+
+def geometry_hash(components, *options) -> str:
+    """
+    Cache key for a figure: the pole geometry (components or a component
+    DataFrame) plus any rendering options (title, LOD mode, quantities...).
+    """
+    if isinstance(components, pd.DataFrame):
+        components = components.to_dict("records")
+    h = hashlib.sha1(repr(geometry_signature(components)).encode())
+    h.update(repr(options).encode())
+    return h.hexdigest()